@@ -0,0 +1,67 @@
+"""
+benchmark concurrent CommandJob runs, executor threads vs asyncio subprocess.
+
+    PYTHONPATH=. python benchmarks/bench_command_concurrency.py --jobs 200 --cmd "sleep 0.5"
+"""
+import argparse
+import asyncio
+import io
+import threading
+import time
+from schd.job import JobContext
+from schd.scheduler import CommandJob
+from schd.util import install_child_watcher
+
+
+class ThreadCounter:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._running = True
+
+    async def watch(self):
+        while self._running:
+            self.peak = max(self.peak, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    def stop(self):
+        self._running = False
+
+
+async def run_jobs(cmd, total, use_async):
+    job = CommandJob(cmd)
+    loop = asyncio.get_running_loop()
+    install_child_watcher()
+    counter = ThreadCounter()
+    watcher = loop.create_task(counter.watch())
+
+    async def one():
+        context = JobContext('bench', stdout=io.StringIO())
+        if use_async:
+            return await job.execute_async(context)
+        return await loop.run_in_executor(None, job.execute, context)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    counter.stop()
+    await watcher
+    return elapsed, counter.peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--cmd', default='sleep 0.5')
+    args = parser.parse_args()
+
+    # separate loops, so the default executor of the first run doesn't leak threads into the second
+    thread_time, thread_peak = asyncio.run(run_jobs(args.cmd, args.jobs, use_async=False))
+    async_time, async_peak = asyncio.run(run_jobs(args.cmd, args.jobs, use_async=True))
+
+    print(f'jobs: {args.jobs}, cmd: {args.cmd}')
+    print(f'executor threads: {thread_time:8.2f}s  peak threads: {thread_peak}')
+    print(f'asyncio subprocess: {async_time:6.2f}s  peak threads: {async_peak}')
+
+
+if __name__ == '__main__':
+    main()
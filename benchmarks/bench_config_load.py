@@ -0,0 +1,69 @@
+"""
+config load time at 10 / 1k / 10k jobs: yaml parsing and SchdConfig.from_dict.
+
+    PYTHONPATH=. python benchmarks/bench_config_load.py --jobs 10 1000 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import yaml
+from schd import config as schd_config
+from schd.config import SchdConfig, read_config
+
+
+def write_config(path, jobs):
+    data = {
+        'scheduler_cls': 'RemoteScheduler',
+        'queues': {f'q{i}': {'max_concurrency': 4} for i in range(10)},
+        'jobs': {
+            f'job{i}': {
+                'class': 'CommandJob',
+                'cron': f'{i % 60} * * * *',
+                'cmd': f'python -m tasks.job{i} --date today',
+                'queue': f'q{i % 10}',
+                'params': {'interleave': True, 'retries': i % 3},
+            }
+            for i in range(jobs)
+        },
+    }
+    with open(path, 'w', encoding='utf8') as f:
+        yaml.dump(data, f)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    loader = getattr(schd_config, 'YamlLoader', yaml.FullLoader)
+    print(f'yaml loader: {loader.__name__}')
+    with tempfile.TemporaryDirectory() as directory:
+        for jobs in args.jobs:
+            path = os.path.join(directory, f'schd-{jobs}.yaml')
+            write_config(path, jobs)
+            with open(path, 'r', encoding='utf8') as f:
+                data = yaml.load(f, Loader=loader)
+
+            def parse_yaml():
+                with open(path, 'r', encoding='utf8') as f:
+                    yaml.load(f, Loader=loader)
+            parse = best_of(parse_yaml, args.repeat)
+            from_dict = best_of(lambda: SchdConfig.from_dict(data), args.repeat)
+            total = best_of(lambda: read_config(path), args.repeat)
+            print(f'{jobs:6d} jobs  yaml {parse * 1000:9.1f}ms  from_dict {from_dict * 1000:8.1f}ms  '
+                  f'read_config {total * 1000:9.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+scheduling cost of LocalScheduler's cron engines: APScheduler CronTrigger per job against schd.cron.
+
+both engines get the same jobs and are driven through simulated minutes with a fake clock, jobs are
+dispatched to an executor which does nothing, so what is measured is the scheduling core alone.
+lag is the time from a due minute until its last job was handed to the executor, cpu is the process
+time spent over all simulated minutes.
+
+    PYTHONPATH=. python benchmarks/bench_cron_engine.py --jobs 1000,10000,100000 --minutes 60
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import random
+import time
+from apscheduler.executors.base import BaseExecutor
+import apscheduler.schedulers.base as apscheduler_base
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.triggers.cron import CronTrigger
+from schd.cron import CronEngine, compile_cron
+
+START = datetime(2025, 3, 5, 10, 0)
+
+
+def expressions(count):
+    """
+    a mix like a big worker has: bursts at the top of the hour, frequent jobs and spread out daily ones.
+    """
+    rng = random.Random(0)
+    result = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            result.append('0 * * * *')
+        elif kind < 0.3:
+            result.append('* * * * *')
+        elif kind < 0.45:
+            result.append('*/%d * * * *' % rng.choice([2, 5, 10, 15, 30]))
+        elif kind < 0.7:
+            result.append('%d * * * *' % rng.randrange(60))
+        else:
+            result.append('%d %d * * *' % (rng.randrange(60), rng.randrange(24)))
+    return result
+
+
+def noop(job_name):
+    pass
+
+
+class FakeDatetime(datetime):
+    current = START
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current.replace(tzinfo=tz) if tz is not None else cls.current
+
+
+class CountingExecutor(BaseExecutor):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def _do_submit_job(self, job, run_times):
+        self.count += 1
+        self._run_job_success(job.id, [])
+
+
+class ManualScheduler(BaseScheduler):
+    """
+    processes due jobs only when asked, no thread.
+    """
+    def wakeup(self):
+        pass
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait)
+
+
+class CountingPool:
+    def __init__(self):
+        self.count = 0
+
+    def submit(self, fn, *args):
+        self.count += 1
+        fn(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Clock:
+    def __init__(self):
+        self.now = START.timestamp()
+
+    def __call__(self):
+        return self.now
+
+
+def bench_apscheduler(exprs, minutes):
+    utc = timezone.utc
+    apscheduler_base.datetime = FakeDatetime
+    FakeDatetime.current = START - timedelta(seconds=30)
+    executor = CountingExecutor()
+    scheduler = ManualScheduler(executors={'default': executor}, timezone=utc)
+    start = time.perf_counter()
+    scheduler.start()
+    for i, expr in enumerate(exprs):
+        scheduler.add_job(noop, CronTrigger.from_crontab(expr, timezone=utc), kwargs={'job_name': f'job{i}'},
+                          id=f'job{i}')
+    added = time.perf_counter() - start
+
+    def tick(minute):
+        FakeDatetime.current = START + timedelta(minutes=minute)
+        scheduler._process_jobs()
+    try:
+        return (added,) + drive(tick, minutes) + (executor.count,)
+    finally:
+        scheduler.shutdown(wait=False)
+
+
+def bench_compiled(exprs, minutes):
+    clock = Clock()
+    clock.now = (START - timedelta(seconds=30)).timestamp()
+    pool = CountingPool()
+    engine = CronEngine(pool, clock=clock)
+    start = time.perf_counter()
+    for i, expr in enumerate(exprs):
+        engine.add_job(noop, compile_cron(expr), kwargs={'job_name': f'job{i}'}, id=f'job{i}')
+    added = time.perf_counter() - start
+
+    def tick(minute):
+        clock.now = (START + timedelta(minutes=minute)).timestamp()
+        engine.run_pending()
+    return (added,) + drive(tick, minutes) + (pool.count,)
+
+
+def drive(tick, minutes):
+    lags = []
+    cpu_start = time.process_time()
+    for minute in range(minutes):
+        start = time.perf_counter()
+        tick(minute)
+        lags.append(time.perf_counter() - start)
+    return sum(lags) / len(lags), max(lags), time.process_time() - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', default='1000,10000,100000')
+    parser.add_argument('--minutes', type=int, default=60)
+    args = parser.parse_args()
+
+    original_datetime = apscheduler_base.datetime
+    for count in (int(n) for n in args.jobs.split(',')):
+        exprs = expressions(count)
+        print(f'{count} jobs, {len(set(exprs))} distinct expressions, {args.minutes} minutes')
+        for name, bench in (('apscheduler', bench_apscheduler), ('compiled', bench_compiled)):
+            try:
+                added, mean_lag, max_lag, cpu, runs = bench(exprs, args.minutes)
+            finally:
+                apscheduler_base.datetime = original_datetime
+            print(f'  {name:12s} add {added * 1000:9.1f}ms  lag mean {mean_lag * 1000:8.2f}ms  '
+                  f'max {max_lag * 1000:8.2f}ms  cpu {cpu * 1000:9.1f}ms  runs {runs}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+events/sec through RemoteApiClient.subscribe_worker_eventstream.
+
+a minimal server writes a prebuilt body, so the numbers are about the client decoding:
+one event per line against batched frames, and the readline + json.loads loop the client used before.
+
+    PYTHONPATH=. python benchmarks/bench_eventstream.py --events 200000
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urljoin
+import aiohttp
+from aiohttp import web
+from schd.schedulers import remote
+from schd.schedulers.remote import RemoteApiClient
+
+
+class ReadlineClient(RemoteApiClient):
+    """
+    the subscribe loop before batched frames: readline, decode, strip and json.loads per line.
+    """
+    async def subscribe_worker_eventstream(self, worker_name, socket_timeout=600, last_event_id=None, on_connected=None):
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/eventstream')
+        session = self._get_session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(sock_read=socket_timeout)) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:
+                decoded = line.decode("utf-8").strip()
+                remote.logger.debug('got event, raw data: %s', decoded)
+                event = json.loads(decoded)
+                if event['event_type'] == 'NewJobInstance':
+                    yield event
+
+
+def build_body(events, batch_size, heartbeat_every=10):
+    frames = []
+    batch = []
+    for i in range(events):
+        batch.append({'event_type': 'NewJobInstance', 'event_id': i, 'data': {'id': i, 'job_name': f'job{i % 100}'}})
+        if i % heartbeat_every == 0:
+            batch.append({'event_type': 'heartbeat'})
+        if len(batch) >= batch_size:
+            frames.append(batch)
+            batch = []
+    if batch:
+        frames.append(batch)
+    if batch_size == 1:
+        return b''.join(json.dumps(event).encode() + b'\n' for frame in frames for event in frame)
+    return b''.join(json.dumps(frame).encode() + b'\n' for frame in frames)
+
+
+async def serve(body):
+    async def handler(request):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for i in range(0, len(body), 64 * 1024):
+            await resp.write(body[i:i + 64 * 1024])
+        return resp
+
+    app = web.Application()
+    app.router.add_get('/api/workers/{worker}/eventstream', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}/'
+
+
+async def measure(client_cls, body, events, loads):
+    remote.json_loads = loads
+    runner, base_url = await serve(body)
+    try:
+        async with client_cls(base_url) as client:
+            start = time.perf_counter()
+            received = 0
+            async for _ in client.subscribe_worker_eventstream('w1'):
+                received += 1
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    assert received == events, received
+    return events / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=200000)
+    args = parser.parse_args()
+
+    fast_loads = remote.json_loads
+    single = build_body(args.events, 1)
+    batched = build_body(args.events, 100)
+    cases = [
+        ('readline + json', ReadlineClient, single, json.loads),
+        ('lines + json', RemoteApiClient, single, json.loads),
+        ('batch100 + json', RemoteApiClient, batched, json.loads),
+    ]
+    if fast_loads is not json.loads:
+        cases += [
+            ('lines + orjson', RemoteApiClient, single, fast_loads),
+            ('batch100 + orjson', RemoteApiClient, batched, fast_loads),
+        ]
+    for name, client_cls, body, loads in cases:
+        rate = await measure(client_cls, body, args.events, loads)
+        print(f'{name:20s} {rate:12,.0f} events/s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
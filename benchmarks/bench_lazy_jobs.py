@@ -0,0 +1,94 @@
+"""
+daemon startup time and resident memory, jobs built at startup against LazyJob.
+
+generates job modules which import heavy stdlib modules and hold some module level data,
+each mode runs in a fresh interpreter.
+
+    PYTHONPATH=. python benchmarks/bench_lazy_jobs.py --jobs 300
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_IMPORTS = ['asyncio', 'decimal', 'email.mime.multipart', 'http.client', 'json', 'xml.dom.minidom',
+                 'sqlite3', 'unittest', 'csv', 'statistics', 'tarfile', 'zipfile']
+
+MODULE_TEMPLATE = '''
+import {imports}
+
+# stands in for the state a heavy library builds at import
+_DATA = bytes(range(256)) * {data_kb} * 4
+
+
+class Job{index}:
+    def __init__(self, **params):
+        self.params = params
+
+    def execute(self, context):
+        return len(_DATA) and 0
+'''
+
+
+def generate(directory, jobs, data_kb):
+    package = os.path.join(directory, 'benchjobs')
+    os.makedirs(package)
+    open(os.path.join(package, '__init__.py'), 'w').close()
+    for i in range(jobs):
+        imports = ', '.join(HEAVY_IMPORTS[j % len(HEAVY_IMPORTS)] for j in range(i, i + 3))
+        with open(os.path.join(package, f'job{i}.py'), 'w') as f:
+            f.write(MODULE_TEMPLATE.format(imports=imports, data_kb=data_kb, index=i))
+
+
+def child(mode, jobs, runs):
+    from schd.config import JobConfig
+    from schd.job import JobContext
+    from schd.lazyjob import LazyJob
+    from schd.scheduler import build_job
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    built = []
+    for i in range(jobs):
+        job_config = JobConfig(cls=f'benchjobs.job{i}:Job{i}', cron='* * * * *')
+        if mode == 'lazy':
+            built.append(LazyJob(f'job{i}', job_config))
+        else:
+            built.append(build_job(f'job{i}', job_config.cls, job_config))
+    startup = time.perf_counter() - start
+    for job in built[:runs]:
+        job.execute(JobContext('bench'))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'startup': startup, 'rss_kb': rss, 'rss_jobs_kb': rss - rss_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=300)
+    parser.add_argument('--data-kb', type=int, default=256, help='module level data of each job module')
+    parser.add_argument('--runs', type=int, default=10, help='jobs executed after startup')
+    parser.add_argument('--child')
+    parser.add_argument('--path')
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, args.path)
+        child(args.child, args.jobs, args.runs)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, args.jobs, args.data_kb)
+        for mode in ('eager', 'lazy'):
+            output = subprocess.check_output([sys.executable, __file__, '--child', mode, '--path', directory,
+                                              '--jobs', str(args.jobs), '--runs', str(args.runs)])
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print(f'{mode:6s} startup {result["startup"] * 1000:8.1f}ms  max rss {result["rss_kb"] / 1024:7.1f}MB  '
+                  f'(+{result["rss_jobs_kb"] / 1024:.1f}MB for jobs, {args.runs} of {args.jobs} jobs run)')
+
+
+if __name__ == '__main__':
+    main()
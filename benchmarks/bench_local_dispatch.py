@@ -0,0 +1,331 @@
+"""
+how many jobs LocalScheduler dispatches before fire times slip, with a simulated clock.
+
+every job fires every minute, the clock jumps from one minute to the next as soon as all runs of
+the previous one finished, so nothing waits on wall-clock time. both cron engines are driven
+through LocalScheduler's own add_job / execute_job path, APScheduler through
+_process_jobs as its thread would.
+
+reported per engine, job kind and job count:
+  dispatch    runs per second, from the due minute until its last run finished
+  lag         p50 / p99 / max from the due minute to the start of a run
+  mem/job     bytes allocated per job added (tracemalloc, a separate pass)
+and once, the per-run cost of what execute_job wraps around a job: the JobContext with its
+StringIO, capture_output, and the whole execute_job (result, metrics, logging).
+
+--json writes the results with the git revision, --compare prints the change against such a file.
+
+    PYTHONPATH=. python benchmarks/bench_local_dispatch.py --jobs 100,1000,10000 --json before.json
+    PYTHONPATH=. python benchmarks/bench_local_dispatch.py --compare before.json
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+from apscheduler.executors.pool import ThreadPoolExecutor
+import apscheduler.executors.base as apscheduler_executors
+import apscheduler.schedulers.base as apscheduler_base
+from apscheduler.schedulers.base import BaseScheduler
+from schd.config import JobConfig, SchdConfig
+from schd.job import JobContext
+from schd.output import capture_output
+from schd.scheduler import LocalScheduler
+
+START = datetime(2025, 3, 5, 10, 0)
+ENGINES = ('apscheduler', 'compiled')
+
+
+class FakeDatetime(datetime):
+    current = START
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current.replace(tzinfo=tz) if tz is not None else cls.current
+
+
+class ManualScheduler(BaseScheduler):
+    """
+    processes due jobs only when asked, no thread.
+    """
+    def wakeup(self):
+        pass
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait)
+
+
+class Recorder:
+    """
+    start times of the runs of one minute, relative to the moment the minute was due.
+    """
+    def __init__(self):
+        self.due_at = 0.0
+        self.lags = []
+        self.finished = 0
+        self._cond = threading.Condition()
+
+    def start_minute(self):
+        with self._cond:
+            self.finished = 0
+        self.due_at = time.perf_counter()
+
+    def started(self):
+        self.lags.append(time.perf_counter() - self.due_at)
+
+    def done(self):
+        with self._cond:
+            self.finished += 1
+            self._cond.notify()
+
+    def wait(self, count):
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished >= count)
+
+
+class NoopJob:
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def execute(self, context):
+        if self.recorder is not None:
+            self.recorder.started()
+            self.recorder.done()
+        return 0
+
+
+class SleepJob(NoopJob):
+    def __init__(self, recorder, seconds):
+        super().__init__(recorder)
+        self.seconds = seconds
+
+    def execute(self, context):
+        self.recorder.started()
+        time.sleep(self.seconds)
+        self.recorder.done()
+        return 0
+
+
+def make_scheduler(engine, threads):
+    scheduler = LocalScheduler(SchdConfig.from_dict({'cron_engine': engine}), max_concurrent_jobs=threads)
+    if engine == 'apscheduler':
+        # same executor, the jobs are processed on each tick instead of by the scheduler thread
+        scheduler.scheduler = ManualScheduler(executors={'default': ThreadPoolExecutor(threads)})
+        scheduler.scheduler.start()
+    return scheduler
+
+
+def add_jobs(scheduler, count, make_job):
+    job_config = JobConfig(cls='CommandJob', cron='* * * * *')
+    asyncio.run(scheduler.add_jobs([(make_job(), f'job{i}', job_config) for i in range(count)]))
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def wait_idle(engine):
+    """
+    the engines mark a run finished after the job returned, a run due before that would be skipped.
+    """
+    if isinstance(engine, ManualScheduler):
+        executor = engine._lookup_executor('default')
+        # a defaultdict, finished jobs may be left with a count of 0
+        busy = lambda: any(list(executor._instances.values()))
+    else:
+        busy = lambda: any(job.running for job in engine._jobs.values())
+    while busy():
+        time.sleep(0.0005)
+
+
+def bench_dispatch(engine, count, minutes, threads, make_job, recorder):
+    """
+    returns runs/sec and the lags of all runs.
+    """
+    FakeDatetime.current = START - timedelta(seconds=30)
+    scheduler = make_scheduler(engine, threads)
+    if engine == 'compiled':
+        scheduler.scheduler.clock = lambda: FakeDatetime.current.timestamp()
+    add_jobs(scheduler, count, make_job)
+
+    busy = 0.0
+    try:
+        for minute in range(minutes):
+            FakeDatetime.current = START + timedelta(minutes=minute)
+            recorder.start_minute()
+            if engine == 'compiled':
+                scheduler.scheduler.run_pending()
+            else:
+                scheduler.scheduler._process_jobs()
+            recorder.wait(count)
+            busy += time.perf_counter() - recorder.due_at
+            wait_idle(scheduler.scheduler)
+    finally:
+        if engine == 'compiled':
+            # never started, its thread would run jobs on the real clock
+            scheduler.scheduler.shutdown()
+        asyncio.run(scheduler.close())
+    return count * minutes / busy, recorder.lags
+
+
+def bench_memory(engine, count, threads):
+    scheduler = make_scheduler(engine, threads)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        add_jobs(scheduler, count, lambda: NoopJob(None))
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+        if engine == 'compiled':
+            scheduler.scheduler.shutdown()
+        asyncio.run(scheduler.close())
+    return used / count
+
+
+def bench_overhead(runs):
+    """
+    microseconds per run of a no-op job: bare, in a JobContext, with captured output, through execute_job.
+    """
+    job = NoopJob(None)
+    scheduler = LocalScheduler(SchdConfig.from_dict({}))
+    asyncio.run(scheduler.add_job(job, 'noop', JobConfig(cls='CommandJob', cron='* * * * *')))
+
+    def bare():
+        job.execute(None)
+
+    def context():
+        job.execute(JobContext(job_name='noop', stdout=io.StringIO()))
+
+    def captured():
+        output = io.StringIO()
+        ctx = JobContext(job_name='noop', stdout=output)
+        with capture_output(output, ctx.stderr):
+            job.execute(ctx)
+
+    def execute_job():
+        scheduler.execute_job('noop')
+
+    result = {}
+    for name, fn in (('bare', bare), ('context', context), ('capture_output', captured),
+                     ('execute_job', execute_job)):
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        result[name] = (time.perf_counter() - start) / runs * 1e6
+    asyncio.run(scheduler.close())
+    return result
+
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, bool(dirty)
+
+
+def result_key(row):
+    return (row['engine'], row['kind'], row['jobs'])
+
+
+def compare(current, baseline):
+    print(f'\nagainst {baseline["revision"]}{" (dirty)" if baseline["dirty"] else ""}:')
+    for name in ('minutes', 'threads', 'sleep_ms'):
+        if baseline['args'].get(name) != current['args'][name]:
+            print(f'  note: {name} was {baseline["args"].get(name)}, now {current["args"][name]}')
+    old_rows = {result_key(row): row for row in baseline['results']}
+    for row in current['results']:
+        old = old_rows.get(result_key(row))
+        if old is None:
+            continue
+        changes = '  '.join(f'{name} {(row[name] / old[name] - 1) * 100:+6.1f}%'
+                            for name in ('dispatch_per_s', 'lag_p50_ms', 'lag_p99_ms', 'memory_per_job')
+                            if old.get(name))
+        print(f'  {row["engine"]:12s} {row["kind"]:6s} {row["jobs"]:6d} jobs  {changes}')
+    for name, value in current['overhead_us'].items():
+        old = baseline['overhead_us'].get(name)
+        if old:
+            print(f'  overhead {name:15s} {(value / old - 1) * 100:+6.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', default='100,1000,10000')
+    parser.add_argument('--minutes', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=10, help='max_concurrent_jobs of LocalScheduler')
+    parser.add_argument('--sleep-ms', type=float, default=5, help='duration of a sleep job')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--overhead-runs', type=int, default=20000)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    revision, dirty = git_revision()
+    report = {
+        'revision': revision,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'results': [],
+    }
+    print(f'revision {revision}{" (dirty)" if dirty else ""}, python {report["python"]}, '
+          f'{args.minutes} minutes, {args.threads} threads')
+
+    original = apscheduler_base.datetime, apscheduler_executors.datetime
+    apscheduler_base.datetime = apscheduler_executors.datetime = FakeDatetime
+    try:
+        for count in (int(n) for n in args.jobs.split(',')):
+            for engine in args.engines.split(','):
+                memory = bench_memory(engine, count, args.threads)
+                for kind in ('noop', 'sleep'):
+                    recorder = Recorder()
+                    if kind == 'noop':
+                        make_job = lambda: NoopJob(recorder)
+                    else:
+                        make_job = lambda: SleepJob(recorder, args.sleep_ms / 1000)
+                    throughput, lags = bench_dispatch(engine, count, args.minutes, args.threads, make_job, recorder)
+                    row = {
+                        'engine': engine,
+                        'kind': kind,
+                        'jobs': count,
+                        'dispatch_per_s': throughput,
+                        'lag_p50_ms': percentile(lags, 50) * 1000,
+                        'lag_p99_ms': percentile(lags, 99) * 1000,
+                        'lag_max_ms': max(lags) * 1000,
+                        'memory_per_job': memory,
+                    }
+                    report['results'].append(row)
+                    print(f'  {engine:12s} {kind:6s} {count:6d} jobs  dispatch {throughput:9.0f}/s  '
+                          f'lag p50 {row["lag_p50_ms"]:9.2f}ms  p99 {row["lag_p99_ms"]:9.2f}ms  '
+                          f'max {row["lag_max_ms"]:9.2f}ms  mem/job {memory:6.0f}B')
+    finally:
+        apscheduler_base.datetime, apscheduler_executors.datetime = original
+
+    report['overhead_us'] = bench_overhead(args.overhead_runs)
+    print('per run of a no-op job: ' + '  '.join(f'{name} {value:.2f}us'
+                                                  for name, value in report['overhead_us'].items()))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+startup latency of PythonJob (warm zygote) against CommandJob running `python -m`.
+
+    PYTHONPATH=. python benchmarks/bench_pyrunner.py --runs 20
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from schd import pyrunner
+from schd.job import JobContext
+from schd.pyrunner import PythonJob
+from schd.scheduler import CommandJob
+
+PRELOAD = ['asyncio', 'decimal', 'email.mime.multipart', 'http.client', 'json', 'xml.dom.minidom', 'benchmarks.heavy_task']
+
+
+def measure(job, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        ret_code = job.execute(JobContext('bench', stdout=io.StringIO()))
+        timings.append((time.perf_counter() - start) * 1000)
+        assert ret_code == 0, ret_code
+    return timings
+
+
+def report(name, timings):
+    print(f'{name:14s} mean {statistics.mean(timings):8.1f}ms  median {statistics.median(timings):8.1f}ms  '
+          f'max {max(timings):8.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    pyrunner.configure(PRELOAD)
+    python_job = PythonJob('benchmarks.heavy_task:main')
+    # first run starts the zygote
+    start = time.perf_counter()
+    measure(python_job, 1)
+    print(f'zygote start: {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    report('CommandJob', measure(CommandJob(f'"{sys.executable}" -m benchmarks.heavy_task'), args.runs))
+    report('PythonJob', measure(python_job, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+worker startup: time to register the jobs with the stand-in server, with a simulated round-trip latency.
+
+    PYTHONPATH=. python benchmarks/bench_register.py --jobs 800 --latency 0.005
+"""
+import argparse
+import asyncio
+import time
+from schd.config import JobConfig
+from schd.schedulers.remote import RemoteScheduler
+from schd.standin import StandinServer
+
+
+class NoopJob:
+    def execute(self, context):
+        return 0
+
+
+def build_jobs(count):
+    return [(NoopJob(), f'job{i}', JobConfig(cls='NoopJob', cron='*/5 * * * *')) for i in range(count)]
+
+
+async def measure(name, server, base_url, jobs, bulk=True, sequential=False):
+    server.bulk_register = bulk
+    server.request_count = 0
+    scheduler = RemoteScheduler('w1', base_url)
+    start = time.perf_counter()
+    if sequential:
+        for job in jobs:
+            await scheduler.add_job(*job)
+    else:
+        await scheduler.add_jobs(jobs)
+    elapsed = time.perf_counter() - start
+    await scheduler.close()
+    print(f'{name:22s} {elapsed * 1000:9.1f}ms  {server.request_count:5d} requests')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=800)
+    parser.add_argument('--latency', type=float, default=0.005)
+    args = parser.parse_args()
+
+    jobs = build_jobs(args.jobs)
+    for name, kwargs in [('sequential add_job', {'sequential': True}),
+                         ('concurrent fallback', {'bulk': False}),
+                         ('bulk', {})]:
+        server = StandinServer()
+        server.latency = args.latency
+        base_url = await server.start()
+        await measure(name, server, base_url, jobs, **kwargs)
+        if name == 'bulk':
+            # restart of the worker, nothing changed
+            await measure('bulk, unchanged', server, base_url, jobs)
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+benchmark RemoteApiClient against the local stand-in server.
+
+compares one ClientSession per request (the old behaviour) with the pooled client.
+
+    PYTHONPATH=. python benchmarks/bench_remote_client.py --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urljoin
+import aiohttp
+from schd.schedulers.remote import RemoteApiClient
+from schd.standin import StandinServer
+
+
+class PerRequestSessionClient(RemoteApiClient):
+    """
+    opens a new session (and connection) for each call, as RemoteApiClient did before pooling.
+    """
+    async def update_job_instance(self, worker_name, job_name, job_instance_id, status, ret_code=None):
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}')
+        async with aiohttp.ClientSession() as session:
+            async with session.put(url, json={'status': status}) as response:
+                response.raise_for_status()
+                await response.json()
+
+
+async def run_client(client, total, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await client.update_job_instance('bench', 'job', i, status='RUNNING')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return total / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    server = StandinServer()
+    base_url = await server.start()
+    try:
+        before = await run_client(PerRequestSessionClient(base_url), args.requests, args.concurrency)
+        after = await run_client(RemoteApiClient(base_url), args.requests, args.concurrency)
+    finally:
+        await server.stop()
+
+    print(f'requests: {args.requests}, concurrency: {args.concurrency}')
+    print(f'per-request session: {before:10.1f} req/s')
+    print(f'pooled session:      {after:10.1f} req/s')
+    print(f'speedup:             {after / before:10.2f}x')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
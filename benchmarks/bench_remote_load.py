@@ -0,0 +1,145 @@
+"""
+load test of the remote worker protocol: N NewJobInstance events/sec spread over M workers.
+
+the stand-in server runs in this process and pushes the events, the workers are RemoteSchedulers
+in --processes spawned processes talking to it over HTTP. each instance runs a job writing
+--log-bytes of output, its log is uploaded and its status reported like with schd-server.
+
+reported: events pushed, instances completed, latency from the event to the COMPLETED status
+(p50/p90/p99/max, measured by the server on one clock), log upload throughput and requests served.
+
+    PYTHONPATH=. python benchmarks/bench_remote_load.py --workers 8 --processes 2 --rate 500 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from schd.config import JobConfig
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.remote import RemoteScheduler
+from schd.standin import StandinServer
+
+
+class OutputJob:
+    """
+    writes `size` bytes of output, awaited on the worker's loop.
+    the output is random hex, it compresses about like real logs and unlike a repeated character.
+    """
+    def __init__(self, size):
+        self.output = os.urandom((size + 1) // 2).hex()[:size]
+
+    async def execute(self, context):
+        context.stdout.write(self.output)
+        return 0
+
+
+def worker_process(base_url, worker_names, jobs, log_bytes, concurrency, log_stream, joblog_dir, stop):
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run_workers(base_url, worker_names, jobs, log_bytes, concurrency, log_stream, joblog_dir, stop))
+
+
+async def run_workers(base_url, worker_names, jobs, log_bytes, concurrency, log_stream, joblog_dir, stop):
+    schedulers = []
+    job_config = JobConfig(cls='OutputJob', cron='* * * * *')
+    try:
+        for worker_name in worker_names:
+            scheduler = RemoteScheduler(worker_name, base_url, queues={'': concurrency}, max_inflight=concurrency,
+                                        log_stream=log_stream,
+                                        joblog_store=JoblogStore(os.path.join(joblog_dir, worker_name)))
+            schedulers.append(scheduler)
+            await scheduler.init()
+            await scheduler.add_jobs([(OutputJob(log_bytes), f'job{i}', job_config) for i in range(jobs)])
+            scheduler.start()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+    finally:
+        for scheduler in schedulers:
+            await scheduler.close()
+
+
+async def wait_until(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def push_events(server, worker_names, jobs, rate, duration):
+    """
+    instance i goes to worker i % M, the jobs of a worker take turns.
+    """
+    total = int(rate * duration)
+    pushed = 0
+    start = time.perf_counter()
+    while pushed < total:
+        due = min(total, int((time.perf_counter() - start) * rate) + 1)
+        while pushed < due:
+            worker_name = worker_names[pushed % len(worker_names)]
+            server.new_job_instance(worker_name, f'job{pushed // len(worker_names) % jobs}')
+            pushed += 1
+        await asyncio.sleep(0.005)
+    return pushed, time.perf_counter() - start
+
+
+async def main(args):
+    server = StandinServer()
+    server.batch_events = args.batch_events
+    base_url = await server.start()
+    worker_names = [f'w{i}' for i in range(args.workers)]
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    loop = asyncio.get_running_loop()
+
+    with tempfile.TemporaryDirectory() as joblog_dir:
+        processes = [context.Process(target=worker_process,
+                                     args=(base_url, worker_names[i::args.processes], args.jobs, args.log_bytes,
+                                           args.concurrency, args.log_stream, joblog_dir, stop))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            if not await wait_until(lambda: len({connect[0] for connect in server.stream_connects}) >= args.workers,
+                                    60):
+                raise RuntimeError('workers did not connect')
+            start = time.perf_counter()
+            pushed, push_seconds = await push_events(server, worker_names, args.jobs, args.rate, args.duration)
+            drained = await wait_until(lambda: len(server.completion_latencies) >= pushed, args.drain_timeout)
+            elapsed = time.perf_counter() - start
+        finally:
+            stop.set()
+            for process in processes:
+                await loop.run_in_executor(None, process.join, 30)
+            await server.stop()
+
+    stats = server.stats()
+    print(f'{args.workers} workers in {args.processes} processes, {args.jobs} jobs each, '
+          f'{args.log_bytes} log bytes per run, log stream {"on" if args.log_stream else "off"}')
+    print(f'pushed      {pushed} events in {push_seconds:.2f}s ({pushed / push_seconds:.0f}/s, asked {args.rate}/s)')
+    print(f'completed   {stats["completed"]}{"" if drained else " (drain timed out)"} '
+          f'in {elapsed:.2f}s ({stats["completed"] / elapsed:.0f}/s)')
+    latency = stats['completion_latency']
+    if latency:
+        print('latency     ' + '  '.join(f'{name} {value * 1000:.1f}ms' for name, value in latency.items()))
+    if stats['log_seconds']:
+        print(f'log upload  {stats["log_bytes"] / 1e6:.1f}MB in {stats["log_seconds"]:.2f}s '
+              f'({stats["log_bytes"] / 1e6 / stats["log_seconds"]:.1f}MB/s, as stored)')
+    print(f'requests    {stats["requests"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=2, help='processes the workers are spread over')
+    parser.add_argument('--rate', type=float, default=500, help='NewJobInstance events per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of pushing events')
+    parser.add_argument('--jobs', type=int, default=10, help='jobs of each worker')
+    parser.add_argument('--log-bytes', type=int, default=4096, help='output of each run')
+    parser.add_argument('--concurrency', type=int, default=100, help='queue slots and max in-flight of each worker')
+    parser.add_argument('--log-stream', action='store_true', help='upload logs in chunks while jobs run')
+    parser.add_argument('--batch-events', action='store_true', help='server writes pending events as one frame')
+    parser.add_argument('--drain-timeout', type=float, default=60)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,18 @@
+"""
+a task with some heavy stdlib imports, run by bench_pyrunner.py.
+"""
+import asyncio
+import decimal
+import email.mime.multipart
+import http.client
+import json
+import xml.dom.minidom
+
+
+def main():
+    print(json.dumps({'ok': True}))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
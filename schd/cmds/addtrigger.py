@@ -17,14 +17,14 @@ class AddTriggerCommand(CommandBase):
 
     def run(self, args, config:SchdConfig=None):
         remote_url = args.base_url or config.scheduler_remote_host
-        client = RemoteApiClient(remote_url)
         worker_name = args.worker_name or config.worker_name
         job_name = args.job_name
         # if on_worker_name is not provided, use current worker name
         on_worker_name = args.on_worker_name or worker_name
         on_job_name = args.on_job_name
         on_job_status = args.on_job_status
-        asyncio.run(client.add_trigger(
+        asyncio.run(self.add_trigger(
+            remote_url,
             worker_name=worker_name,
             job_name=job_name,
             on_worker_name=on_worker_name,
@@ -32,3 +32,7 @@ class AddTriggerCommand(CommandBase):
             on_job_status=on_job_status,
         ))
         logging.info(f"Trigger added successfully for job '{job_name}'")
+
+    async def add_trigger(self, remote_url, **kwargs):
+        async with RemoteApiClient(remote_url) as client:
+            return await client.add_trigger(**kwargs)
@@ -21,4 +21,4 @@ class DaemonCommand(CommandBase):
             log_stream = sys.stdout
 
         logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S', stream=log_stream)
-        asyncio.run(run_daemon(config))
+        asyncio.run(run_daemon(config, args.config))
@@ -10,7 +10,12 @@ async def run_job(config, job_name):
     job_config = config.jobs[job_name]
     job = build_job(job_name, job_config.cls, job_config)
     await scheduler.add_job(job, job_name, job_config)
-    scheduler.execute_job(job_name)
+    # in a thread like a scheduled run, an async job then runs to the end there
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, scheduler.execute_job, job_name)
+    finally:
+        # sends the failure mail, if any
+        await scheduler.close()
 
 
 class RunCommand(CommandBase):
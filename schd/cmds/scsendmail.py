@@ -92,6 +92,7 @@ def main():
             bcc_emails=bcc_emails,
             attachments=attachments
         )
+        service.close()
 
 
 if __name__ == '__main__':
@@ -1,10 +1,17 @@
 from dataclasses import dataclass, field, fields, is_dataclass
 import os
-from typing import Any, Dict, Optional, Type, TypeVar, Union, get_args, get_origin, get_type_hints
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar, Union, get_args, get_origin, get_type_hints
 import yaml
 
 T = TypeVar("T", bound="ConfigValue")
 
+# the C loader of libyaml when PyYAML was built with it, same documents, several times faster
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+# (field name, key in data, env var, field type, converter of the value or None)
+FieldPlan = Tuple[str, str, Optional[str], Any, Optional[Callable[[Any], Any]]]
+_field_plans:Dict[type, List[FieldPlan]] = {}
+
 
 class ConfigValue:
     """
@@ -25,49 +32,61 @@ class ConfigValue:
         Creates an instance of the class using the fields specified in the dictionary.
         Handles nested fields that are also derived from ConfigValue.
         """
-        type_hints = get_type_hints(cls)
+        plan = _field_plans.get(cls)
+        if plan is None:
+            plan = _field_plans[cls] = _build_field_plan(cls)
+
         init_data:Dict[str,Any] = {}
-        if not is_dataclass(cls):
-            raise TypeError(f'class {cls} is not dataclass')
-        
-        for f in fields(cls):
-            field_name = f.name
-            json_key = f.metadata.get("json", f.name)
-            envvar_key = f.metadata.get('env_var')
-            field_type = type_hints[field_name]
-            origin = get_origin(field_type)
-            args = get_args(field_type)
-
-            if envvar_key and envvar_key in os.environ:
-                init_data[field_name] = _cast_type(os.environ[envvar_key], field_type)
+        environ = os.environ
+        for field_name, json_key, envvar_key, field_type, convert in plan:
+            if envvar_key and envvar_key in environ:
+                init_data[field_name] = _cast_type(environ[envvar_key], field_type)
                 continue
 
             if json_key in data:
                 value = data[json_key]
-                # Handle nested ConfigValue objects
-                if isinstance(field_type, type) and issubclass(field_type, ConfigValue):
-                    init_data[field_name] = field_type.from_dict(value)
-                # Handle lists of ConfigValue objects   List[ConfigValue]
-                elif origin is list and issubclass(args[0], ConfigValue):
-                    nested_type = field_type.__args__[0]
-                    init_data[field_name] = [nested_type.from_dict(item) for item in value]
-                    # Handle Optional[ConfigValue]
-                elif origin is Union and type(None) in args:
-                    actual_type = next((arg for arg in args if arg is not type(None)), None)
-                    if actual_type and issubclass(actual_type, ConfigValue):
-                        init_data[field_name] = actual_type.from_dict(value) if value is not None else None
-                    else:
-                        init_data[field_name] = value
-                # Case 4: Dict[str, ConfigValue]
-                elif origin is dict and issubclass(args[1], ConfigValue):
-                    value_type = args[1]
-                    init_data[field_name] = {
-                        k: value_type.from_dict(v) for k, v in value.items()
-                    }
-                else:
-                    init_data[field_name] = value
+                init_data[field_name] = convert(value) if convert is not None else value
         return cls(**init_data)
 
+
+def _is_config_value(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, ConfigValue)
+
+
+def _build_field_plan(cls) -> List[FieldPlan]:
+    """
+    resolve type hints and pick the converter of each field once per class,
+    from_dict runs for every job of the config.
+    """
+    if not is_dataclass(cls):
+        raise TypeError(f'class {cls} is not dataclass')
+
+    type_hints = get_type_hints(cls)
+    plan:List[FieldPlan] = []
+    for f in fields(cls):
+        field_type = type_hints[f.name]
+        origin = get_origin(field_type)
+        args = get_args(field_type)
+        convert = None
+        # Handle nested ConfigValue objects
+        if _is_config_value(field_type):
+            convert = field_type.from_dict
+        # Handle lists of ConfigValue objects   List[ConfigValue]
+        elif origin is list and args and _is_config_value(args[0]):
+            nested_type = args[0]
+            convert = lambda value, nested_type=nested_type: [nested_type.from_dict(item) for item in value]
+        # Handle Optional[ConfigValue]
+        elif origin is Union and type(None) in args:
+            actual_type = next((arg for arg in args if arg is not type(None)), None)
+            if _is_config_value(actual_type):
+                convert = lambda value, actual_type=actual_type: actual_type.from_dict(value) if value is not None else None
+        # Case 4: Dict[str, ConfigValue]
+        elif origin is dict and len(args) == 2 and _is_config_value(args[1]):
+            value_type = args[1]
+            convert = lambda value, value_type=value_type: {k: value_type.from_dict(v) for k, v in value.items()}
+        plan.append((f.name, f.metadata.get("json", f.name), f.metadata.get('env_var'), field_type, convert))
+    return plan
+
 def _cast_type(value, target_type):
     origin = get_origin(target_type)
     args = get_args(target_type)
@@ -105,6 +124,20 @@ class EmailConfig(ConfigValue):
     to_addr: Optional[str] = field(metadata={'env_var': 'SCHD_SMTP_TO'}, default=None)
     smtp_port: int = field(metadata={'env_var': 'SCHD_SMTP_PORT'}, default=25)
     smtp_starttls: bool = field(metadata={'env_var': 'SCHD_SMTP_TLS'}, default=False)
+    smtp_timeout: float = 30
+    # failure mails: at most rate_limit per minute (0 for no limit). failures within digest_window seconds
+    # of the first one go out as one digest mail, 0 sends each right away while under the rate limit.
+    rate_limit: int = field(metadata={'env_var': 'SCHD_MAIL_RATE_LIMIT'}, default=10)
+    digest_window: float = field(metadata={'env_var': 'SCHD_MAIL_DIGEST_WINDOW'}, default=0)
+    # failures waiting to be mailed, the oldest are dropped beyond it
+    max_pending: int = 1000
+    # body of a failure mail: a summary and the end of the output, at most tail_lines lines and tail_bytes.
+    # when the output was cut, all of it is attached gzip compressed, unless attach_log is false
+    tail_lines: int = field(metadata={'env_var': 'SCHD_MAIL_TAIL_LINES'}, default=200)
+    tail_bytes: int = 64 * 1024
+    attach_log: bool = True
+    # total size of the attachments of one mail, larger ones are left out, 0 for no limit
+    attachment_max_bytes: int = 10 * 1024 * 1024
 
 
 @dataclass
@@ -115,16 +148,96 @@ class JobConfig(ConfigValue):
     params: dict = field(default_factory=dict)
     timezone: Optional[str] = None
     queue: str = ''
+    # number of queue slots a running instance takes
+    slots: int = 1
+    # thread | process, process runs the job in the process pool, for CPU bound Python jobs
+    executor: str = 'thread'
+    # max seconds a run of an async job may take, it is cancelled after. not enforced on jobs running in threads
+    timeout: Optional[float] = None
+
+    def __post_init__(self):
+        if self.executor not in ('thread', 'process'):
+            raise ValueError('invalid executor: %s, expected thread or process' % self.executor)
+
+
+@dataclass
+class QueueConfig(ConfigValue):
+    max_concurrency: int = 1
+
+
+WORKER_OVERFLOW_MODES = ('block', 'reject', 'defer')
+# apscheduler: a CronTrigger per job. compiled: schd.cron, for tens of thousands of jobs
+CRON_ENGINES = ('apscheduler', 'compiled')
 
 
 @dataclass
 class SchdConfig(ConfigValue):
     jobs: Dict[str, JobConfig] = field(default_factory=dict)
+    queues: Dict[str, QueueConfig] = field(default_factory=dict)
     scheduler_cls: str = field(metadata={'env_var': 'SCHD_SCHEDULER_CLS'}, default='LocalScheduler')
     scheduler_remote_host: Optional[str] = field(metadata={'env_var': 'SCHD_SCHEDULER_REMOTE_HOST'}, default=None)
+    # connection pool of the remote api client, 0 means no limit.
+    scheduler_remote_conn_limit: int = field(metadata={'env_var': 'SCHD_SCHEDULER_REMOTE_CONN_LIMIT'}, default=100)
+    scheduler_remote_conn_limit_per_host: int = field(metadata={'env_var': 'SCHD_SCHEDULER_REMOTE_CONN_LIMIT_PER_HOST'}, default=0)
     worker_name: str = field(metadata={'env_var': 'SCHD_WORKER_NAME'}, default='local')
+    # RemoteScheduler uploads job log in chunks while the job runs.
+    log_stream: bool = field(metadata={'env_var': 'SCHD_LOG_STREAM'}, default=False)
+    log_stream_chunk_size: int = 256 * 1024
+    log_stream_interval: float = 5
+    # RemoteScheduler admission control, see "admission control" in README.
+    # max instances running at once / received but not running yet, 0 for no limit.
+    # worker_overflow: block | reject | defer, what to do with instances arriving when pending is full.
+    worker_max_inflight: int = field(metadata={'env_var': 'SCHD_WORKER_MAX_INFLIGHT'}, default=100)
+    worker_max_pending: int = field(metadata={'env_var': 'SCHD_WORKER_MAX_PENDING'}, default=1000)
+    worker_overflow: str = field(metadata={'env_var': 'SCHD_WORKER_OVERFLOW'}, default='block')
+    # RemoteScheduler sends job status in the background, batched and retried until the server takes it.
+    status_report_batch_size: int = field(metadata={'env_var': 'SCHD_STATUS_REPORT_BATCH_SIZE'}, default=100)
+    status_report_max_backoff: float = 30
+    # reports waiting for the server beyond this are dropped, oldest first
+    status_report_max_pending: int = 100000
+    # local state of the worker, RemoteScheduler keeps reports the server didn't take yet here
+    data_dir: Optional[str] = field(metadata={'env_var': 'SCHD_DATA_DIR'}, default=None)
+    # job logs of RemoteScheduler: none | gzip | zstd (needs zstandard), retention by age, count and total size.
+    # 0 for no limit.
+    joblog_dir: str = field(metadata={'env_var': 'SCHD_JOBLOG_DIR'}, default='joblog')
+    joblog_compression: str = field(metadata={'env_var': 'SCHD_JOBLOG_COMPRESSION'}, default='gzip')
+    joblog_retention_days: float = 7
+    joblog_max_count: int = 10000
+    joblog_max_bytes: int = 1024 ** 3
+    # seconds before reconnecting the event stream, doubled on each failure up to the max, with jitter
+    event_stream_reconnect_min: float = 0.5
+    event_stream_reconnect_max: float = 60
+    # seconds a stream must stay up, or an event received, before the delay starts over from the min
+    event_stream_reconnect_stable: float = 10
+    # import and build jobs on their first run instead of at startup.
+    # job_cache_size: built jobs kept, the least recently run ones are dropped beyond it. 0 keeps all.
+    lazy_jobs: bool = field(metadata={'env_var': 'SCHD_LAZY_JOBS'}, default=False)
+    job_cache_size: int = 0
+    # job registrations in flight at startup when the server has no bulk registration
+    job_register_concurrency: int = 16
+    # worker processes for jobs with `executor: process`, defaults to the number of cpu cores
+    process_pool_workers: Optional[int] = field(metadata={'env_var': 'SCHD_PROCESS_POOL_WORKERS'}, default=None)
+    # modules imported once by the zygote process PythonJob forks its runs from
+    python_runner_preload: List[str] = field(default_factory=list)
+    # seconds between checks of the config file for changes, jobs are reloaded without restart. 0 turns it off,
+    # the daemon still reloads on SIGHUP.
+    config_reload_interval: float = field(metadata={'env_var': 'SCHD_CONFIG_RELOAD_INTERVAL'}, default=5)
+    # scheduling core of LocalScheduler, one of CRON_ENGINES
+    cron_engine: str = field(metadata={'env_var': 'SCHD_CRON_ENGINE'}, default='apscheduler')
+    # serve Prometheus metrics on http://metrics_host:metrics_port/metrics, off when no port is set
+    metrics_port: Optional[int] = field(metadata={'env_var': 'SCHD_METRICS_PORT'}, default=None)
+    metrics_host: str = field(metadata={'env_var': 'SCHD_METRICS_HOST'}, default='127.0.0.1')
     email: EmailConfig = field(default_factory=lambda: EmailConfig.from_dict({}))
 
+    def __post_init__(self):
+        self.worker_overflow = self.worker_overflow.lower()
+        if self.worker_overflow not in WORKER_OVERFLOW_MODES:
+            raise ValueError('invalid worker_overflow: %s, expected one of %s'
+                             % (self.worker_overflow, ', '.join(WORKER_OVERFLOW_MODES)))
+        self.cron_engine = self.cron_engine.lower()
+        if self.cron_engine not in CRON_ENGINES:
+            raise ValueError('invalid cron_engine: %s, expected one of %s' % (self.cron_engine, ', '.join(CRON_ENGINES)))
+
     def __getitem__(self,key):
         # compatible to old fashion config['key']
         if hasattr(self, key):
@@ -136,16 +249,19 @@ class SchdConfig(ConfigValue):
 class ConfigFileNotFound(Exception):...
 
 
-def read_config(config_file=None) -> SchdConfig:
+def find_config_file(config_file=None) -> str:
     if config_file:
-        config_filepath = config_file
+        return config_file
     elif 'SCHD_CONFIG' in os.environ:
-        config_filepath = os.environ['SCHD_CONFIG']
+        return os.environ['SCHD_CONFIG']
     elif os.path.exists('conf/schd.yaml'):
-        config_filepath = 'conf/schd.yaml'
+        return 'conf/schd.yaml'
     else:
         raise ConfigFileNotFound()
 
+
+def read_config(config_file=None) -> SchdConfig:
+    config_filepath = find_config_file(config_file)
     with open(config_filepath, 'r', encoding='utf8') as f:
-        config = SchdConfig.from_dict(yaml.load(f, Loader=yaml.FullLoader))
+        config = SchdConfig.from_dict(yaml.load(f, Loader=YamlLoader))
         return config
@@ -0,0 +1,333 @@
+"""
+compiled cron schedules and a scheduling core for very large numbers of jobs.
+
+APScheduler keeps a CronTrigger per job and works out next fire times field by field. Here a
+crontab expression is compiled once to one bitset per field, jobs with the same expression share the
+compiled schedule and one entry in a heap of next fire times, so a wake-up costs one next-time
+computation per distinct expression rather than per job.
+
+Expressions mean the same as with APScheduler 3's CronTrigger.from_crontab, so switching engines
+doesn't move a job: day of week 0 is Monday, and day of month and day of week must both match.
+Supported: numbers, names (jan-dec, mon-sun), `*`, `a-b`, `a,b`, `*/n`, `a-b/n` and `a/n`.
+"""
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import functools
+import heapq
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from apscheduler.events import EVENT_JOB_SUBMITTED, JobSubmissionEvent
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {name: i for i, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+WEEKDAYS = {name: i for i, name in enumerate(['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])}
+
+# (name, min, max, names)
+FIELDS = [
+    ('minute', 0, 59, None),
+    ('hour', 0, 23, None),
+    ('day', 1, 31, None),
+    ('month', 1, 12, MONTHS),
+    ('day_of_week', 0, 6, WEEKDAYS),
+]
+
+# an expression matching no date, e.g. "0 0 31 2 *", gives up after this many years.
+# 28 years is the cycle of weekdays on dates, a day and weekday that ever meet do within it
+MAX_SEARCH_YEARS = 28
+
+
+def _value(text:str, names) -> int:
+    if names is not None and text.lower() in names:
+        return names[text.lower()]
+    return int(text)
+
+
+def _parse_field(expr:str, name:str, lo:int, hi:int, names) -> int:
+    mask = 0
+    for part in expr.split(','):
+        step = None
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f'invalid step in {name} field: {expr}')
+        if part == '*':
+            first, last = lo, hi
+        elif '-' in part:
+            first_text, last_text = part.split('-', 1)
+            first, last = _value(first_text, names), _value(last_text, names)
+        else:
+            first = _value(part, names)
+            # "a/n" runs from a to the max, a plain value is just itself
+            last = hi if step is not None else first
+        if first > last:
+            raise ValueError(f'the minimum value in a range must not be higher than the maximum: {expr}')
+        if first < lo or last > hi:
+            raise ValueError(f'{name} value out of range {lo}-{hi}: {expr}')
+        for value in range(first, last + 1, step or 1):
+            mask |= 1 << value
+    return mask
+
+
+def _next_bit(mask:int, start:int) -> "Optional[int]":
+    """
+    lowest set bit of mask at or above start.
+    """
+    rest = mask >> start
+    if not rest:
+        return None
+    return start + (rest & -rest).bit_length() - 1
+
+
+class CronSchedule:
+    """
+    a crontab expression compiled to bitsets, times are naive local datetimes at minute resolution.
+    """
+    __slots__ = ('expr', 'minutes', 'hours', 'days', 'months', 'weekdays')
+
+    def __init__(self, expr:str):
+        values = expr.split()
+        if len(values) != 5:
+            raise ValueError(f'Wrong number of fields; got {len(values)}, expected 5')
+        self.expr = ' '.join(values)
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(value, name, lo, hi, names) for value, (name, lo, hi, names) in zip(values, FIELDS))
+
+    def __repr__(self):
+        return f'CronSchedule({self.expr!r})'
+
+    def matches(self, dt:datetime) -> bool:
+        return bool(self.months >> dt.month & 1 and self.days >> dt.day & 1 and self.weekdays >> dt.weekday() & 1
+                    and self.hours >> dt.hour & 1 and self.minutes >> dt.minute & 1)
+
+    def next_after(self, dt:datetime) -> "Optional[datetime]":
+        """
+        the first matching minute after dt, None if there is none.
+        """
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end_year = t.year + MAX_SEARCH_YEARS
+        while t.year < end_year:
+            if not self.months >> t.month & 1:
+                month = _next_bit(self.months, t.month + 1)
+                if month is None:
+                    t = datetime(t.year + 1, _next_bit(self.months, 1), 1)
+                else:
+                    t = datetime(t.year, month, 1)
+                continue
+
+            if not (self.days >> t.day & 1 and self.weekdays >> t.weekday() & 1):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+
+            hour = _next_bit(self.hours, t.hour)
+            if hour is None:
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if hour != t.hour:
+                t = t.replace(hour=hour, minute=0)
+
+            minute = _next_bit(self.minutes, t.minute)
+            if minute is None:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            return t.replace(minute=minute)
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(expr:str) -> CronSchedule:
+    return CronSchedule(expr)
+
+
+def compile_cron(expr:str) -> CronSchedule:
+    """
+    the compiled schedule of an expression, identical expressions share it.
+    """
+    return _compile(' '.join(expr.split()))
+
+
+@dataclass
+class _CronJob:
+    id: str
+    func: Callable[..., Any]
+    kwargs: Dict[str, Any]
+    schedule: CronSchedule
+    running: bool = False
+
+
+@dataclass
+class _Group:
+    """
+    jobs of one expression, they share one next fire time.
+    """
+    schedule: CronSchedule
+    next_time: Optional[float] = None
+    jobs: Dict[str, _CronJob] = field(default_factory=dict)
+
+
+class CronEngine:
+    """
+    runs cron jobs from one scheduling thread, the jobs run in `executor`.
+
+    Has the part of the APScheduler scheduler interface LocalScheduler uses, with a CronSchedule as
+    the trigger. Like APScheduler's defaults a job has at most one instance running, a run due while
+    the previous one is still going is skipped, and runs later than `misfire_grace_time` are skipped.
+    """
+    def __init__(self, executor:Executor, misfire_grace_time:float=1, clock:Callable[[], float]=time.time,
+                 max_wait:float=60):
+        """
+        :param clock: current time as a timestamp.
+        :param max_wait: max seconds the scheduling thread sleeps, bounds the effect of a clock jump.
+        """
+        self.executor = executor
+        self.misfire_grace_time = misfire_grace_time
+        self.clock = clock
+        self.max_wait = max_wait
+        self.running = False
+        self._jobs:Dict[str, _CronJob] = {}
+        self._groups:Dict[str, _Group] = {}
+        # (next fire time, expression), entries of emptied or rescheduled groups are skipped when popped
+        self._heap:List[Tuple[float, str]] = []
+        self._cond = threading.Condition()
+        self._thread:"Optional[threading.Thread]" = None
+        self._listeners:List[Callable[[JobSubmissionEvent], Any]] = []
+
+    def _next_time(self, schedule:CronSchedule, after:float) -> "Optional[float]":
+        next_dt = schedule.next_after(datetime.fromtimestamp(after))
+        return next_dt.timestamp() if next_dt is not None else None
+
+    def add_job(self, func:Callable[..., Any], trigger:CronSchedule, kwargs:"Optional[Dict[str, Any]]"=None,
+                id:"Optional[str]"=None, replace_existing:bool=False):
+        job_id = id if id is not None else f'{getattr(func, "__name__", "job")}-{len(self._jobs)}'
+        with self._cond:
+            if job_id in self._jobs:
+                if not replace_existing:
+                    raise ValueError(f'job {job_id} already exists')
+                self._remove(job_id)
+            job = _CronJob(job_id, func, dict(kwargs or {}), trigger)
+            self._jobs[job_id] = job
+            group = self._groups.get(trigger.expr)
+            if group is None:
+                group = self._groups[trigger.expr] = _Group(trigger)
+                group.next_time = self._next_time(trigger, self.clock())
+                if group.next_time is not None:
+                    heapq.heappush(self._heap, (group.next_time, trigger.expr))
+                    self._cond.notify()
+            group.jobs[job_id] = job
+
+    def remove_job(self, job_id:str):
+        with self._cond:
+            if job_id not in self._jobs:
+                raise KeyError(job_id)
+            self._remove(job_id)
+
+    def _remove(self, job_id:str):
+        job = self._jobs.pop(job_id)
+        group = self._groups[job.schedule.expr]
+        del group.jobs[job_id]
+        if not group.jobs:
+            # its heap entry is dropped when it comes up
+            del self._groups[job.schedule.expr]
+
+    def get_next_fire_time(self, job_id:str) -> "Optional[datetime]":
+        with self._cond:
+            group = self._groups[self._jobs[job_id].schedule.expr]
+            return datetime.fromtimestamp(group.next_time) if group.next_time is not None else None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add_listener(self, callback:Callable[[JobSubmissionEvent], Any], mask:int=EVENT_JOB_SUBMITTED):
+        """
+        like APScheduler's, only EVENT_JOB_SUBMITTED is dispatched, from the scheduling thread once a run was submitted.
+        """
+        if mask & EVENT_JOB_SUBMITTED:
+            self._listeners.append(callback)
+
+    def _pop_due(self, now:float) -> List[Tuple[_CronJob, float]]:
+        """
+        jobs due at `now` with their fire time.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_time, expr = heapq.heappop(self._heap)
+            group = self._groups.get(expr)
+            if group is None or group.next_time != fire_time:
+                continue
+            if now - fire_time > self.misfire_grace_time:
+                logger.warning('run of %d jobs with cron %r at %s missed by %.3fs.', len(group.jobs), expr,
+                               datetime.fromtimestamp(fire_time), now - fire_time)
+            else:
+                due.extend((job, fire_time) for job in group.jobs.values())
+            # one computation for all jobs of the expression, missed runs are not caught up
+            group.next_time = self._next_time(group.schedule, max(fire_time, now))
+            if group.next_time is not None:
+                heapq.heappush(self._heap, (group.next_time, expr))
+        return due
+
+    def run_pending(self, now:"Optional[float]"=None) -> int:
+        """
+        submit the jobs due at `now` to the executor, returns the number submitted.
+        """
+        now = self.clock() if now is None else now
+        with self._cond:
+            due = self._pop_due(now)
+        submitted = 0
+        for job, fire_time in due:
+            if job.running:
+                logger.warning('run of job %s skipped: maximum number of running instances reached (1)', job.id)
+                continue
+            job.running = True
+            self.executor.submit(self._run_job, job)
+            submitted += 1
+            self._dispatch(JobSubmissionEvent(EVENT_JOB_SUBMITTED, job.id, 'default',
+                                              [datetime.fromtimestamp(fire_time)]))
+        return submitted
+
+    def _dispatch(self, event:JobSubmissionEvent):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as ex:
+                logger.exception('error notifying listener %s, %s', listener, ex)
+
+    def _run_job(self, job:_CronJob):
+        try:
+            job.func(**job.kwargs)
+        except Exception as ex:
+            logger.exception('job %s raised an exception, %s', job.id, ex)
+        finally:
+            job.running = False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self.running:
+                    return
+                wait = self._heap[0][0] - self.clock() if self._heap else self.max_wait
+                if wait > 0:
+                    self._cond.wait(min(wait, self.max_wait))
+                    continue
+            self.run_pending()
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+        self._thread = threading.Thread(target=self._run, name='schd-cron', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait:bool=True):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.executor.shutdown(wait=wait)
@@ -1,29 +1,45 @@
 import smtplib
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
 from email.message import EmailMessage
 import logging
-from typing import List, Optional, Union
+import threading
+import time
+from typing import Callable, Deque, Iterable, List, Optional, Tuple, Union
 import os
 from pathlib import Path
 from schd.config import EmailConfig
+from schd.util import Backoff
 
 logger = logging.getLogger(__name__)
 
 
 class EmailService:
     def __init__(self, smtp_server: str, smtp_user: str, smtp_password: str,
-                 from_addr: str, smtp_port: int = 25, smtp_starttls: bool = False):
+                 from_addr: str, smtp_port: int = 25, smtp_starttls: bool = False,
+                 timeout: float = 30, debug: bool = False):
+        """
+        one SMTP connection is kept open and reused by all mails, it is opened again when the server
+        dropped it.
+
+        :param timeout: seconds to wait for the server on connect and each command.
+        """
         self.smtp_server = smtp_server
         self.smtp_user = smtp_user
         self.smtp_password = smtp_password
         self.from_addr = from_addr
         self.smtp_port = smtp_port
         self.smtp_starttls = smtp_starttls
+        self.timeout = timeout
+        self.debug = debug
+        self._smtp:"Optional[smtplib.SMTP]" = None
+        self._lock = threading.Lock()
 
-    def send_mail(self, title: str, content: str, to_emails: Union[str, List[str]],
-                  attachments: Optional[List[str]] = None,
-                  content_html: Optional[str] = None,
-                  cc_emails: Optional[List[str]] = None,
-                  bcc_emails: Optional[List[str]] = None):
+    def build_message(self, title: str, content: str, to_emails: Union[str, List[str]],
+                      attachments: Optional[List[str]] = None,
+                      content_html: Optional[str] = None,
+                      cc_emails: Optional[List[str]] = None) -> EmailMessage:
         msg = EmailMessage()
         msg['Subject'] = title
         msg['From'] = self.from_addr
@@ -33,8 +49,6 @@ class EmailService:
         if cc_emails:
             msg['Cc'] = ', '.join(cc_emails)
 
-        recipients = to_emails + (cc_emails or []) + (bcc_emails or [])
-
         # Add text and HTML
         if content_html:
             msg.set_content(content)
@@ -45,19 +59,72 @@ class EmailService:
         # Attach files
         for filepath in attachments or []:
             file_path = Path(filepath)
+            subtype = 'gzip' if file_path.suffix == '.gz' else 'octet-stream'
             with open(file_path, 'rb') as f:
                 file_data = f.read()
-                msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_path.name)
+                msg.add_attachment(file_data, maintype='application', subtype=subtype, filename=file_path.name)
+        return msg
+
+    def send_mail(self, title: str, content: str, to_emails: Union[str, List[str]],
+                  attachments: Optional[List[str]] = None,
+                  content_html: Optional[str] = None,
+                  cc_emails: Optional[List[str]] = None,
+                  bcc_emails: Optional[List[str]] = None):
+        if isinstance(to_emails, str):
+            to_emails = [to_emails]
+        msg = self.build_message(title, content, to_emails, attachments=attachments, content_html=content_html,
+                                 cc_emails=cc_emails)
+        recipients = to_emails + (cc_emails or []) + (bcc_emails or [])
+        self.send_message(msg, recipients)
 
-        # Send email
-        with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            server.set_debuglevel(self.debug)
             if self.smtp_starttls:
                 server.starttls()
             if self.smtp_user and self.smtp_password:
                 server.login(self.smtp_user, self.smtp_password)
             else:
                 logger.info('no username/pass, skip logging in.')
-            server.send_message(msg, from_addr=self.from_addr, to_addrs=recipients)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def send_message(self, msg: EmailMessage, recipients: List[str]):
+        """
+        send over the open connection. a connection the server closed meanwhile is only noticed when
+        using it, then the mail is sent once more over a new one.
+        """
+        with self._lock:
+            reused = self._smtp is not None
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.send_message(msg, from_addr=self.from_addr, to_addrs=recipients)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as ex:
+                self._drop()
+                if not reused:
+                    raise
+                logger.info('smtp connection lost, reconnecting, %s', ex)
+            self._smtp = self._connect()
+            self._smtp.send_message(msg, from_addr=self.from_addr, to_addrs=recipients)
+
+    def _drop(self):
+        if self._smtp is not None:
+            self._smtp.close()
+            self._smtp = None
+
+    def close(self):
+        with self._lock:
+            if self._smtp is not None:
+                try:
+                    self._smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+            self._drop()
 
     @classmethod
     def from_config(cls, config: 'EmailConfig') -> 'EmailService':
@@ -67,5 +134,226 @@ class EmailService:
             smtp_password=config.smtp_password,
             from_addr=config.from_addr,
             smtp_port=config.smtp_port,
-            smtp_starttls=config.smtp_starttls
+            smtp_starttls=config.smtp_starttls,
+            timeout=config.smtp_timeout,
         )
+
+
+@dataclass
+class Alert:
+    title: str
+    content: str
+    to_emails: Tuple[str, ...]
+    created: float
+    # clock() when it was queued
+    queued: float
+    # files sent with it, the sender removes them once done
+    attachments: Tuple[str, ...] = ()
+
+
+class AlertSender:
+    """
+    sends alert mails from a background thread, callers never wait for the mail server.
+
+    At most `rate_limit` mails go out per minute. Alerts to the same recipients that arrive within
+    `digest_window` seconds of the first one, or while the rate limit holds mails back, go out
+    together as one digest mail. Beyond `max_pending` waiting alerts the oldest are dropped, the
+    next mail tells how many.
+    """
+    def __init__(self, service:EmailService, rate_limit:int=10, digest_window:float=0, max_pending:int=1000,
+                 retries:int=3, digest_max_chars:int=20000, attachment_max_bytes:int=10*1024*1024,
+                 clock:Callable[[], float]=time.monotonic):
+        """
+        :param rate_limit: mails per minute, 0 for no limit.
+        :param digest_window: seconds alerts are collected for after the first one, 0 sends right away.
+        :param retries: attempts to send a mail, with backoff, before its alerts are given up.
+        :param digest_max_chars: content kept of each alert in a digest, its last characters.
+        :param attachment_max_bytes: total size of the files attached to one mail, files beyond it are
+            left out, 0 for no limit.
+        """
+        self.service = service
+        self.rate_limit = rate_limit
+        self.digest_window = digest_window
+        self.max_pending = max_pending
+        self.retries = retries
+        self.digest_max_chars = digest_max_chars
+        self.attachment_max_bytes = attachment_max_bytes
+        self.clock = clock
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending:Deque[Alert] = deque()
+        self._dropped_since_sent = 0
+        # token bucket of the rate limit, full at start
+        self._tokens = float(rate_limit)
+        self._tokens_at = clock()
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread:"Optional[threading.Thread]" = None
+
+    @classmethod
+    def from_config(cls, config:EmailConfig) -> 'AlertSender':
+        return cls(EmailService.from_config(config), rate_limit=config.rate_limit,
+                   digest_window=config.digest_window, max_pending=config.max_pending,
+                   attachment_max_bytes=config.attachment_max_bytes)
+
+    def notify(self, title:str, content:str, to_emails:Union[str, List[str]], attachments:Optional[List[str]]=None):
+        """
+        queue an alert, returns right away.
+
+        :param attachments: paths of files to attach, they are removed once the mail went out or was given up.
+        """
+        if isinstance(to_emails, str):
+            to_emails = [to_emails]
+        alert = Alert(title, content, tuple(to_emails), time.time(), self.clock(), tuple(attachments or ()))
+        with self._cond:
+            if self._closing:
+                logger.warning('alert sender closed, alert %s dropped.', title)
+                _remove_files(alert.attachments)
+                return
+            if self.max_pending > 0 and len(self._pending) >= self.max_pending:
+                _remove_files(self._pending.popleft().attachments)
+                self.dropped += 1
+                self._dropped_since_sent += 1
+            self._pending.append(alert)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='schd-alerts', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._tokens_at) * self.rate_limit / 60)
+        self._tokens_at = now
+
+    def _next_batch(self) -> "Optional[Tuple[List[Alert], int]]":
+        """
+        wait for alerts, the digest window and the rate limit, then take the alerts of the next mail.
+        None once closed and nothing is left.
+        """
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closing:
+                        return None
+                    self._cond.wait()
+                    continue
+                # on close, what is left goes out right away
+                wait = 0.0
+                if not self._closing:
+                    if self.digest_window > 0:
+                        wait = self._pending[0].queued + self.digest_window - self.clock()
+                    if self.rate_limit > 0:
+                        self._refill()
+                        if self._tokens < 1:
+                            wait = max(wait, (1 - self._tokens) * 60 / self.rate_limit)
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                if self.rate_limit > 0:
+                    self._refill()
+                    self._tokens -= 1
+                to_emails = self._pending[0].to_emails
+                batch = [alert for alert in self._pending if alert.to_emails == to_emails]
+                self._pending = deque(alert for alert in self._pending if alert.to_emails != to_emails)
+                dropped, self._dropped_since_sent = self._dropped_since_sent, 0
+                return batch, dropped
+
+    def _run(self):
+        while True:
+            taken = self._next_batch()
+            if taken is None:
+                return
+            batch, dropped = taken
+            title, content = self.compose(batch, dropped)
+            files = [path for alert in batch for path in alert.attachments]
+            try:
+                attachments, left_out = self._fit_attachments(files)
+                if left_out:
+                    content += ('\n\nnot attached, over the limit of %d bytes per mail: %s'
+                                % (self.attachment_max_bytes, ', '.join(os.path.basename(path) for path in left_out)))
+                self._send(title, content, list(batch[0].to_emails), len(batch), attachments)
+            finally:
+                _remove_files(files)
+
+    def _fit_attachments(self, files:List[str]) -> Tuple[List[str], List[str]]:
+        """
+        the files attached to a mail and the ones left out, in order, as long as they fit the limit.
+        """
+        attachments:List[str] = []
+        left_out:List[str] = []
+        total = 0
+        for path in files:
+            try:
+                size = os.path.getsize(path)
+            except OSError as ex:
+                logger.warning('attachment %s is gone, %s', path, ex)
+                continue
+            if self.attachment_max_bytes > 0 and total + size > self.attachment_max_bytes:
+                left_out.append(path)
+                continue
+            attachments.append(path)
+            total += size
+        return attachments, left_out
+
+    def compose(self, alerts:List[Alert], dropped:int=0) -> Tuple[str, str]:
+        """
+        subject and text of the mail carrying `alerts`, a digest when there are several.
+        """
+        if len(alerts) == 1 and not dropped:
+            return alerts[0].title, alerts[0].content
+
+        lines = [f'{len(alerts)} alerts from {_format_time(alerts[0].created)} to {_format_time(alerts[-1].created)}.']
+        if dropped:
+            lines.append(f'{dropped} more alerts were dropped, too many were waiting.')
+        lines.append('')
+        lines.extend(f'{_format_time(alert.created)}  {alert.title}' for alert in alerts)
+        for alert in alerts:
+            content = alert.content
+            if len(content) > self.digest_max_chars:
+                content = (f'... {len(content) - self.digest_max_chars} characters cut ...\n'
+                           + content[-self.digest_max_chars:])
+            lines.extend(['', f'===== {_format_time(alert.created)}  {alert.title}', content])
+        return f'[{len(alerts)} alerts] {alerts[0].title}', '\n'.join(lines)
+
+    def _send(self, title:str, content:str, to_emails:List[str], count:int, attachments:Optional[List[str]]=None):
+        backoff = Backoff(1, 60)
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.service.send_mail(title, content, to_emails, attachments=attachments)
+                self.sent += 1
+                logger.info('alert mail sent, %s', title)
+                return
+            except Exception as ex:
+                logger.warning('error when sending alert mail, attempt %d/%d, %s', attempt, self.retries, ex)
+            if attempt < self.retries:
+                with self._cond:
+                    if not self._closing:
+                        self._cond.wait(backoff.next_delay())
+        self.failed += 1
+        logger.error('alert mail %s not sent, %d alerts lost.', title, count)
+
+    def close(self, timeout:"Optional[float]"=30):
+        """
+        send what is waiting, without waiting for the digest window or the rate limit, and stop.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.service.close()
+
+
+def _remove_files(paths:Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as ex:
+            logger.warning('failed to remove attachment %s, %s', path, ex)
+
+
+def _format_time(timestamp:float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
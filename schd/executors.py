@@ -0,0 +1,103 @@
+"""
+run Python jobs in a process pool.
+
+CPU bound jobs running in threads share the GIL with each other and with the scheduler.
+Jobs configured with `executor: process` are rebuilt in a pool worker from their JobConfig
+(class path + params) and executed there, output and result are sent back to the scheduler.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import traceback
+from typing import Any, Optional, Tuple
+from schd.config import JobConfig
+from schd.job import JobContext, is_async_job, job_result_code
+from schd.output import capture_output
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+
+
+def run_job_in_process(job_name:str, job_config:JobConfig) -> Tuple[Any, str]:
+    """
+    entry point in the pool worker, returns the job result and the path of a file holding its output.
+    results that cannot be pickled are replaced by their return code.
+    """
+    # imported here, schd.scheduler imports the schedulers which import this module
+    from schd.scheduler import build_job
+
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', prefix='schd-', suffix='.log', delete=False) as output:
+        context = JobContext(job_name=job_name, stdout=output)
+        try:
+            job = build_job(job_name, job_config.cls, job_config)
+            with capture_output(output):
+                if is_async_job(job):
+                    job_result = asyncio.run(asyncio.wait_for(job.execute(context), job_config.timeout))
+                else:
+                    job_result = job.execute(context)
+            try:
+                pickle.dumps(job_result)
+            except Exception:
+                job_result = _result_code(job_name, job_result)
+        except Exception:
+            traceback.print_exc(file=output)
+            return -1, output.name
+    return job_result, output.name
+
+
+def _result_code(job_name:str, job_result:Any) -> int:
+    try:
+        return job_result_code(job_result)
+    except ValueError as ex:
+        raise ValueError('job %s returned a result that cannot be sent back from the pool worker, %s'
+                         % (job_name, ex)) from None
+
+
+class ProcessJobExecutor:
+    def __init__(self, max_workers:"Optional[int]"=None):
+        """
+        :param max_workers: number of worker processes, defaults to the number of cpu cores.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool:"Optional[ProcessPoolExecutor]" = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, forking a process that runs scheduler threads is not safe
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            logger.info('process pool started with %d workers', self.max_workers)
+        return self._pool
+
+    def _collect(self, context:JobContext, job_result:Any, output_path:str) -> Any:
+        try:
+            if context.stdout is not None:
+                with open(output_path, 'r', encoding='utf-8') as f:
+                    shutil.copyfileobj(f, context.stdout)
+        finally:
+            os.remove(output_path)
+        return job_result
+
+    def execute(self, job_name:str, job_config:JobConfig, context:JobContext) -> Any:
+        """
+        run the job in the pool and wait for it, output is copied into context.stdout.
+        """
+        job_result, output_path = self.pool.submit(run_job_in_process, job_name, job_config).result()
+        return self._collect(context, job_result, output_path)
+
+    async def execute_async(self, job_name:str, job_config:JobConfig, context:JobContext) -> Any:
+        loop = asyncio.get_running_loop()
+        job_result, output_path = await loop.run_in_executor(self.pool, run_job_in_process, job_name, job_config)
+        return self._collect(context, job_result, output_path)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,4 +1,5 @@
-from typing import Protocol, Union
+import inspect
+from typing import Any, Protocol, Union
 
 
 class JobExecutionResult(Protocol):
@@ -20,6 +21,27 @@ class Job(Protocol):
     """
     def execute(self, context:JobContext) -> Union[JobExecutionResult, int, None]:
         """
-        execute the job
+        execute the job, may be `async def`, the schedulers then await it on their event loop.
         """
         pass
+
+
+def is_async_job(job) -> bool:
+    """
+    True if the execute method of the job is a coroutine function.
+    """
+    return inspect.iscoroutinefunction(getattr(job, 'execute', None))
+
+
+def job_result_code(job_result:Any) -> int:
+    """
+    return code of what Job.execute returned.
+    """
+    if job_result is None:
+        return 0
+    elif isinstance(job_result, int):
+        return job_result
+    elif hasattr(job_result, 'get_code'):
+        return job_result.get_code()
+    else:
+        raise ValueError('unsupported result type: %s' % job_result)
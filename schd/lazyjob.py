@@ -0,0 +1,98 @@
+"""
+jobs imported and built on their first run.
+
+Building every job at startup imports all job modules up front, with many jobs importing heavy
+libraries the daemon takes long to start and holds the memory before anything runs.
+A LazyJob keeps the job name and JobConfig only, and builds the job when it runs the first time.
+"""
+from collections import OrderedDict
+import logging
+import threading
+from typing import Any, Optional
+from schd.config import JobConfig
+from schd.job import Job, JobContext
+
+logger = logging.getLogger(__name__)
+
+
+class JobCache:
+    """
+    built jobs by name, the least recently run ones are dropped beyond `maxsize` and built again
+    on their next run. the modules they imported stay loaded, what is freed is the job instance.
+    """
+    def __init__(self, maxsize:int):
+        self.maxsize = maxsize
+        self._jobs:"OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_name:str) -> "Optional[Job]":
+        with self._lock:
+            job = self._jobs.get(job_name)
+            if job is not None:
+                self._jobs.move_to_end(job_name)
+            return job
+
+    def put(self, job_name:str, job:Job):
+        with self._lock:
+            self._jobs[job_name] = job
+            self._jobs.move_to_end(job_name)
+            while len(self._jobs) > self.maxsize:
+                dropped, _ = self._jobs.popitem(last=False)
+                logger.debug('job %s dropped from job cache.', dropped)
+
+    def discard(self, job_name:str):
+        with self._lock:
+            self._jobs.pop(job_name, None)
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+class LazyJob:
+    """
+    builds the job on first use. with a cache the built job lives there and may be dropped,
+    without one it is kept for good.
+    """
+    def __init__(self, job_name:str, job_config:JobConfig, cache:"Optional[JobCache]"=None):
+        self.job_name = job_name
+        self.job_config = job_config
+        self.cache = cache
+        self._job:"Optional[Job]" = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        if self.cache is not None:
+            return self.cache.get(self.job_name) is not None
+        return self._job is not None
+
+    def get(self) -> Job:
+        """
+        the built job, imported and built now if needed.
+        """
+        job = self.cache.get(self.job_name) if self.cache is not None else self._job
+        if job is not None:
+            return job
+
+        with self._lock:
+            job = self.cache.get(self.job_name) if self.cache is not None else self._job
+            if job is None:
+                # imported here, schd.scheduler imports the schedulers which import this module
+                from schd.scheduler import build_job
+                logger.info('building job %s, %s', self.job_name, self.job_config.cls)
+                job = build_job(self.job_name, self.job_config.cls, self.job_config)
+                if self.cache is not None:
+                    self.cache.put(self.job_name, job)
+                else:
+                    self._job = job
+        return job
+
+    def execute(self, context:JobContext) -> Any:
+        return self.get().execute(context)
+
+
+def resolve_job(job) -> Job:
+    """
+    the job to run, LazyJob is built.
+    """
+    return job.get() if isinstance(job, LazyJob) else job
@@ -0,0 +1,299 @@
+"""
+metrics of the daemon, served in the Prometheus text format on /metrics.
+
+Recording takes no lock: every thread adds into its own preallocated cells, a scrape sums the
+cells of all threads. A lock is taken only the first time a thread records into a metric, and
+when a new label combination is created.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a quick API call to a long batch job
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class _Cells:
+    """
+    `size` floats kept per thread, each thread writes only its own cells.
+    """
+    def __init__(self, size:int):
+        self._size = size
+        self._local = threading.local()
+        self._all:List[List[float]] = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> List[float]:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = [0.0] * self._size
+            with self._lock:
+                self._all.append(cells)
+            self._local.cells = cells
+            return cells
+
+    def sum(self) -> List[float]:
+        with self._lock:
+            all_cells = list(self._all)
+        totals = [0.0] * self._size
+        for cells in all_cells:
+            for i, value in enumerate(cells):
+                totals[i] += value
+        return totals
+
+
+class CounterChild:
+    def __init__(self):
+        self._cells = _Cells(1)
+
+    def inc(self, amount:float=1):
+        self._cells.mine()[0] += amount
+
+    def get(self) -> float:
+        return self._cells.sum()[0]
+
+
+class GaugeChild:
+    def __init__(self):
+        self._cells = _Cells(1)
+        self._function:"Optional[Callable[[], float]]" = None
+
+    def inc(self, amount:float=1):
+        self._cells.mine()[0] += amount
+
+    def dec(self, amount:float=1):
+        self._cells.mine()[0] -= amount
+
+    def set_function(self, function:Callable[[], float]):
+        """
+        take the value from `function` at scrape time.
+        """
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._cells.sum()[0]
+
+
+class HistogramChild:
+    def __init__(self, buckets:Sequence[float]):
+        self.buckets = tuple(buckets)
+        # a count per bucket, the last one is +Inf, then the sum
+        self._cells = _Cells(len(self.buckets) + 2)
+
+    def observe(self, value:float):
+        cells = self._cells.mine()
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def get(self) -> Tuple[List[float], float]:
+        """
+        cumulative bucket counts, +Inf last, and the sum.
+        """
+        totals = self._cells.sum()
+        cumulative = []
+        count = 0.0
+        for value in totals[:-1]:
+            count += value
+            cumulative.append(count)
+        return cumulative, totals[-1]
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name:str, documentation:str, labelnames:Sequence[str]=(),
+                 registry:"Optional[Registry]"=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children:"Dict[Tuple[str, ...], object]" = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def children(self) -> "List[Tuple[Tuple[str, ...], object]]":
+        with self._lock:
+            return list(self._children.items())
+
+    def _label_text(self, values:Sequence[str], extra:Iterable[Tuple[str, str]]=()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+    def expose(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in self.children():
+            lines.extend(self._expose_child(values, child))
+        return lines
+
+    def _expose_child(self, values, child) -> List[str]:
+        return [f'{self.name}{self._label_text(values)} {_format(child.get())}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount:float=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def _expose_child(self, values, child) -> List[str]:
+        try:
+            value = child.get()
+        except Exception as ex:
+            logger.error('failed to read gauge %s%s, %s', self.name, self._label_text(values), ex)
+            return []
+        return [f'{self.name}{self._label_text(values)} {_format(value)}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, documentation:str, labelnames:Sequence[str]=(),
+                 buckets:Sequence[float]=DEFAULT_BUCKETS, registry:"Optional[Registry]"=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value:float):
+        self.labels().observe(value)
+
+    def _expose_child(self, values, child) -> List[str]:
+        counts, total = child.get()
+        lines = []
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            labels = self._label_text(values, [('le', _format(bound))])
+            lines.append(f'{self.name}_bucket{labels} {_format(count)}')
+        lines.append(f'{self.name}_sum{self._label_text(values)} {_format(total)}')
+        lines.append(f'{self.name}_count{self._label_text(values)} {_format(counts[-1])}')
+        return lines
+
+
+def _escape(value:str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value:float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics:Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric:Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('metric %s already registered' % metric.name)
+            self._metrics[metric.name] = metric
+
+    def get(self, name:str) -> Metric:
+        return self._metrics[name]
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+JOB_RUNS = Counter('schd_job_runs_total', 'Job runs completed, by job and result.', ['job', 'result'])
+JOB_DURATION = Histogram('schd_job_run_duration_seconds', 'Duration of job runs.', ['job'])
+JOB_OUTPUT_BYTES = Counter('schd_job_output_bytes_total', 'Bytes of output written by job runs.', ['job'])
+SCHEDULING_LAG = Histogram('schd_scheduling_lag_seconds', 'Delay from the planned fire time to the submission of a run.',
+                           buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+QUEUE_WAIT = Histogram('schd_queue_wait_seconds', 'Time job instances waited for a queue slot.', ['queue'])
+JOBS_RUNNING = Gauge('schd_jobs_running', 'Job runs in progress, by executor.', ['executor'])
+EXECUTOR_CAPACITY = Gauge('schd_executor_capacity', 'Job runs an executor takes at once.', ['executor'])
+QUEUE_SLOTS = Gauge('schd_queue_slots', 'Slots of each queue, by state (capacity, used, waiting).',
+                    ['queue', 'state'])
+INSTANCES_PENDING = Gauge('schd_instances_pending', 'Job instances received and waiting to run.')
+API_DURATION = Histogram('schd_api_request_duration_seconds', 'Round-trip time of schd-server API calls.', ['call'],
+                         buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+API_ERRORS = Counter('schd_api_errors_total', 'schd-server API calls that failed.', ['call'])
+
+
+def record_run(job_name:str, ret_code:int, duration:float, output_bytes:int=0):
+    JOB_RUNS.labels(job_name, 'success' if ret_code == 0 else 'failure').inc()
+    JOB_DURATION.labels(job_name).observe(duration)
+    if output_bytes:
+        JOB_OUTPUT_BYTES.labels(job_name).inc(output_bytes)
+
+
+@contextmanager
+def track_running(executor:str):
+    """
+    count a run in progress on `executor` in schd_jobs_running.
+    """
+    gauge = JOBS_RUNNING.labels(executor)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+async def start_metrics_server(host:str='127.0.0.1', port:int=9108, registry:"Optional[Registry]"=None) -> web.AppRunner:
+    """
+    serve /metrics until the returned runner is cleaned up.
+    """
+    registry = registry if registry is not None else REGISTRY
+
+    async def handle_metrics(request:web.Request):
+        return web.Response(body=registry.expose().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('metrics served on http://%s:%d/metrics', host, port)
+    return runner
@@ -0,0 +1,154 @@
+"""
+per job stdout/stderr capture.
+
+contextlib.redirect_stdout swaps the process wide sys.stdout, concurrent jobs then write into each
+other's buffers. Here sys.stdout/sys.stderr are replaced once by dispatchers, which look up the
+target stream of the current thread or asyncio task in a ContextVar.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import io
+import sys
+import tempfile
+import threading
+from typing import IO, Iterator, Optional, Tuple
+
+_stdout_target:"ContextVar[Optional[IO[str]]]" = ContextVar('schd_stdout_target', default=None)
+_stderr_target:"ContextVar[Optional[IO[str]]]" = ContextVar('schd_stderr_target', default=None)
+_install_lock = threading.Lock()
+
+
+class StreamDispatcher(io.TextIOBase):
+    """
+    text stream writing to the stream captured by the current context, or to `fallback` if none.
+    """
+    def __init__(self, target:"ContextVar[Optional[IO[str]]]", fallback:IO[str]):
+        self._target = target
+        self.fallback = fallback
+
+    def current(self) -> IO[str]:
+        stream = self._target.get()
+        return stream if stream is not None else self.fallback
+
+    def write(self, s):
+        return self.current().write(s)
+
+    def writelines(self, lines):
+        self.current().writelines(lines)
+
+    def flush(self):
+        self.current().flush()
+
+    def isatty(self):
+        return self.current().isatty()
+
+    def fileno(self):
+        # captured streams are usually in memory, only the real stream has a file descriptor
+        return self.fallback.fileno()
+
+    @property
+    def encoding(self):
+        return getattr(self.current(), 'encoding', None) or 'utf-8'
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+
+def install():
+    """
+    replace sys.stdout/sys.stderr with dispatchers, again if someone assigned them in between.
+    """
+    with _install_lock:
+        if not isinstance(sys.stdout, StreamDispatcher):
+            sys.stdout = StreamDispatcher(_stdout_target, sys.stdout)
+        if not isinstance(sys.stderr, StreamDispatcher):
+            sys.stderr = StreamDispatcher(_stderr_target, sys.stderr)
+
+
+@contextmanager
+def capture_output(stdout:"Optional[IO[str]]", stderr:"Optional[IO[str]]"=None):
+    """
+    route print()/sys.stdout writes of the current thread or task into `stdout`,
+    and sys.stderr writes into `stderr` when given.
+    other threads and tasks are not affected.
+    """
+    install()
+    stdout_token = _stdout_target.set(stdout)
+    stderr_token = _stderr_target.set(stderr) if stderr is not None else None
+    try:
+        yield
+    finally:
+        _stdout_target.reset(stdout_token)
+        if stderr_token is not None:
+            _stderr_target.reset(stderr_token)
+
+
+class JobOutput(io.TextIOBase):
+    """
+    captured output of a job run, utf-8 encoded. Kept in memory up to `spool_size` bytes and in a
+    temporary file beyond, a job printing hundreds of MB doesn't hold them in the scheduler.
+    """
+    def __init__(self, spool_size:int=1024*1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        # bytes written
+        self.size = 0
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def write(self, s:str) -> int:
+        data = s.encode('utf-8', 'replace')
+        self._file.write(data)
+        self.size += len(data)
+        return len(s)
+
+    def getvalue(self) -> str:
+        """
+        the whole output, for output known to be small.
+        """
+        return b''.join(self.chunks()).decode('utf-8', 'replace')
+
+    def chunks(self, size:int=64*1024) -> Iterator[bytes]:
+        """
+        the output from the start, read `size` bytes at a time.
+        """
+        self._file.seek(0)
+        try:
+            while True:
+                data = self._file.read(size)
+                if not data:
+                    return
+                yield data
+        finally:
+            self._file.seek(0, io.SEEK_END)
+
+    def tail(self, max_bytes:int, max_lines:int=0) -> Tuple[str, bool]:
+        """
+        the end of the output, at most `max_bytes` and `max_lines` lines (0 for no limit),
+        and whether anything before it was cut.
+        """
+        start = max(0, self.size - max_bytes) if max_bytes > 0 else 0
+        self._file.seek(start)
+        try:
+            data = self._file.read()
+        finally:
+            self._file.seek(0, io.SEEK_END)
+        cut = start > 0
+        if cut:
+            # from the next complete line, unless it is all one line
+            newline = data.find(b'\n')
+            if 0 <= newline < len(data) - 1:
+                data = data[newline + 1:]
+        lines = data.splitlines(keepends=True)
+        if max_lines > 0 and len(lines) > max_lines:
+            lines = lines[-max_lines:]
+            cut = True
+        return b''.join(lines).decode('utf-8', 'replace'), cut
+
+    def close(self):
+        self._file.close()
+        super().close()
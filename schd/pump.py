@@ -0,0 +1,116 @@
+import asyncio
+import codecs
+import io
+import locale
+import shutil
+import tempfile
+import threading
+from typing import IO, Optional
+
+
+class OutputPump:
+    """
+    Copies the stdout/stderr pipes of a child process into text streams while it runs.
+
+    Pipes are read in chunks of at most `buffer_size` bytes and decoded incrementally,
+    so memory stays flat however much the process writes.
+
+    :param stdout: stream receiving the process stdout, None to discard.
+    :param stderr: stream receiving the process stderr, None to discard.
+    If both are the same stream, chunks are written in the order they arrive.
+    """
+    def __init__(self, stdout:"Optional[IO[str]]", stderr:"Optional[IO[str]]", buffer_size:int=64*1024,
+                 encoding:"Optional[str]"=None, errors:str='replace'):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.buffer_size = buffer_size
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.errors = errors
+        self._lock = threading.Lock()
+
+    def _new_decoder(self):
+        decoder = codecs.getincrementaldecoder(self.encoding)(self.errors)
+        # behave like text=True of subprocess, which translates newlines.
+        return io.IncrementalNewlineDecoder(decoder, translate=True)
+
+    def _copy(self, pipe:IO[bytes], target:"Optional[IO[str]]"):
+        decoder = self._new_decoder()
+        read = getattr(pipe, 'read1', pipe.read)
+        while True:
+            data = read(self.buffer_size)
+            text = decoder.decode(data, final=not data)
+            if text and target is not None:
+                with self._lock:
+                    target.write(text)
+            if not data:
+                break
+        pipe.close()
+
+    def pump(self, stdout_pipe:"Optional[IO[bytes]]", stderr_pipe:"Optional[IO[bytes]]"):
+        """
+        copy both pipes until they are closed by the child, blocks the calling thread.
+        """
+        thread = None
+        if stderr_pipe is not None:
+            thread = threading.Thread(target=self._copy, args=(stderr_pipe, self.stderr), daemon=True)
+            thread.start()
+        if stdout_pipe is not None:
+            self._copy(stdout_pipe, self.stdout)
+        if thread is not None:
+            thread.join()
+
+    async def _copy_async(self, reader:asyncio.StreamReader, target:"Optional[IO[str]]"):
+        decoder = self._new_decoder()
+        while True:
+            data = await reader.read(self.buffer_size)
+            text = decoder.decode(data, final=not data)
+            if text and target is not None:
+                target.write(text)
+            if not data:
+                break
+
+    async def pump_async(self, stdout_reader:"Optional[asyncio.StreamReader]", stderr_reader:"Optional[asyncio.StreamReader]"):
+        """
+        copy the pipes of an asyncio subprocess until they are closed by the child.
+        """
+        copies = []
+        if stdout_reader is not None:
+            copies.append(self._copy_async(stdout_reader, self.stdout))
+        if stderr_reader is not None:
+            copies.append(self._copy_async(stderr_reader, self.stderr))
+        await asyncio.gather(*copies)
+
+
+def pump_command_output(process, stdout:"Optional[IO[str]]", stderr:"Optional[IO[str]]"=None,
+                        interleave:bool=True, buffer_size:int=64*1024):
+    """
+    stream the output of a Popen process started with stdout=PIPE, stderr=PIPE.
+
+    with `interleave`, stderr is written to `stderr` if given, otherwise mixed into `stdout` by arrival.
+    without it and no `stderr` stream, stderr is spooled (to disk once larger than `buffer_size`)
+    and appended after stdout.
+    """
+    if interleave or stderr is not None or stdout is None:
+        OutputPump(stdout, stderr if stderr is not None else stdout, buffer_size=buffer_size).pump(process.stdout, process.stderr)
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=buffer_size, mode='w+', encoding='utf-8') as spool:
+        OutputPump(stdout, spool, buffer_size=buffer_size).pump(process.stdout, process.stderr)
+        spool.seek(0)
+        shutil.copyfileobj(spool, stdout, buffer_size)
+
+
+async def pump_command_output_async(process:asyncio.subprocess.Process, stdout:"Optional[IO[str]]",
+                                    stderr:"Optional[IO[str]]"=None, interleave:bool=True, buffer_size:int=64*1024):
+    """
+    same as pump_command_output, for a process created by asyncio.create_subprocess_*.
+    """
+    if interleave or stderr is not None or stdout is None:
+        pump = OutputPump(stdout, stderr if stderr is not None else stdout, buffer_size=buffer_size)
+        await pump.pump_async(process.stdout, process.stderr)
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=buffer_size, mode='w+', encoding='utf-8') as spool:
+        await OutputPump(stdout, spool, buffer_size=buffer_size).pump_async(process.stdout, process.stderr)
+        spool.seek(0)
+        shutil.copyfileobj(spool, stdout, buffer_size)
@@ -0,0 +1,324 @@
+"""
+run Python entry points in processes forked from a warm zygote process.
+
+A `python -m pkg.task` command pays interpreter startup and imports on every run. The zygote
+imports the configured modules once, each run is a fresh child forked from it: isolated like a
+command, without the startup cost.
+
+multiprocessing's forkserver is not used, it re-runs the __main__ module of the scheduler in
+every child, which costs as much as the startup it should save.
+"""
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import codecs
+import importlib
+import itertools
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+import signal
+import sys
+import tempfile
+import threading
+import traceback
+from typing import Any, Dict, List, Optional
+from schd.job import JobContext
+
+logger = logging.getLogger(__name__)
+
+
+def _run_entry(entry:str, args:List[Any], kwargs:dict, output_path:str) -> int:
+    """
+    runs in the child, output of the child goes to output_path. returns the exit code.
+    """
+    fd = os.open(output_path, os.O_WRONLY | os.O_APPEND)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    sys.stdout = open(1, 'w', encoding='utf-8', closefd=False, buffering=1)
+    sys.stderr = open(2, 'w', encoding='utf-8', closefd=False, buffering=1)
+
+    try:
+        module_name, func_name = entry.split(':', 1)
+        func = getattr(importlib.import_module(module_name), func_name)
+        result = func(*args, **kwargs)
+        code = result if isinstance(result, int) else 0
+    except SystemExit as ex:
+        code = ex.code if isinstance(ex.code, int) else (0 if ex.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return code
+
+
+def _spawned_entry(entry:str, args:List[Any], kwargs:dict, output_path:str):
+    sys.exit(_run_entry(entry, args, kwargs, output_path))
+
+
+def _fork_child(conn:Connection, wakeup_fds, request) -> int:
+    run_id, entry, args, kwargs, output_path = request
+    pid = os.fork()
+    if pid:
+        return pid
+
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        # the zygote's handlers, a run is interrupted like any Python program
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for fd in wakeup_fds:
+            os.close(fd)
+        conn.close()
+        code = _run_entry(entry, args, kwargs, output_path)
+    finally:
+        os._exit(code & 0xff)
+
+
+def _zygote_main(conn:Connection, preload:List[str]):
+    """
+    main loop of the zygote: fork a child per request, report the exit codes of reaped children.
+    single threaded, so forking from it is safe.
+    """
+    for module_name in preload:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            traceback.print_exc()
+
+    # SIGCHLD wakes up wait() through the wakeup fd
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    children:Dict[int, int] = {}
+
+    def terminate(signum, frame):
+        # terminated by Zygote.stop(), its runs go with it
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        os._exit(1)
+    signal.signal(signal.SIGTERM, terminate)
+
+    running = True
+    while running or children:
+        ready = wait([conn, wakeup_r] if running else [wakeup_r])
+        if wakeup_r in ready:
+            try:
+                os.read(wakeup_r, 4096)
+            except BlockingIOError:
+                pass
+        if running and conn in ready:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                request = None
+            if request is None:
+                running = False
+            else:
+                children[_fork_child(conn, (wakeup_r, wakeup_w), request)] = request[0]
+
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            run_id = children.pop(pid, None)
+            if run_id is not None and running:
+                try:
+                    conn.send((run_id, os.waitstatus_to_exitcode(status)))
+                except OSError:
+                    running = False
+
+
+class Zygote:
+    """
+    client side of the zygote process, thread safe. the zygote is restarted when it died.
+    """
+    def __init__(self, preload:"Optional[List[str]]"=None):
+        self.preload = list(preload or [])
+        self._lock = threading.Lock()
+        self._conn:"Optional[Connection]" = None
+        self._process = None
+        self._futures:"Dict[int, Future]" = {}
+        self._ids = itertools.count(1)
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        # spawn, the zygote must not inherit the threads of the scheduler
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_zygote_main, args=(child_conn, self.preload), name='schd-zygote', daemon=True)
+        process.start()
+        child_conn.close()
+        self._process = process
+        self._conn = parent_conn
+        # runs of each zygote are tracked apart, a restart doesn't mix them up
+        self._futures = {}
+        threading.Thread(target=self._read_results, args=(parent_conn, self._futures),
+                         name='schd-zygote-reader', daemon=True).start()
+        logger.info('python runner zygote started, pid %s, preload %s', process.pid, self.preload)
+
+    def _read_results(self, conn:Connection, futures:"Dict[int, Future]"):
+        while True:
+            try:
+                run_id, exitcode = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = futures.pop(run_id, None)
+            if future is not None:
+                future.set_result(exitcode)
+
+        # runs of a dead zygote are never reported
+        conn.close()
+        with self._lock:
+            pending = list(futures.values())
+            futures.clear()
+        for future in pending:
+            future.set_exception(RuntimeError('python runner zygote exited'))
+
+    def submit(self, entry:str, args:List[Any], kwargs:dict, output_path:str) -> Future:
+        future:Future = Future()
+        with self._lock:
+            self._ensure_started()
+            run_id = next(self._ids)
+            self._futures[run_id] = future
+            self._conn.send((run_id, entry, args, kwargs, output_path))
+        return future
+
+    def stop(self, timeout:float=5):
+        """
+        stop the zygote once its runs finished, runs still going after `timeout` seconds are terminated.
+        a later submit starts it again.
+        """
+        with self._lock:
+            process, self._process = self._process, None
+            if self._conn is not None:
+                try:
+                    self._conn.send(None)
+                except OSError:
+                    pass
+                self._conn = None
+        if process is None:
+            return
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning('python runner zygote still has runs after %ss, terminating them.', timeout)
+            process.terminate()
+            process.join()
+
+
+_zygote:"Optional[Zygote]" = None
+
+
+def configure(preload:"Optional[List[str]]"=None):
+    """
+    set the modules imported by the zygote, must be called before the first PythonJob runs.
+    """
+    global _zygote
+    if _zygote is not None:
+        logger.warning('python runner already started, preload %s ignored.', preload)
+        return
+    _zygote = Zygote(preload)
+
+
+def stop():
+    """
+    stop the shared zygote if it was started, called when a scheduler closes.
+    """
+    if _zygote is not None:
+        _zygote.stop()
+
+
+def get_zygote() -> "Optional[Zygote]":
+    """
+    the shared zygote, None where fork is not available.
+    """
+    global _zygote
+    if not hasattr(os, 'fork'):
+        return None
+    if _zygote is None:
+        _zygote = Zygote()
+    return _zygote
+
+
+class PythonJob:
+    """
+    run `module:function` in a child forked from the warm zygote.
+
+    the return value of the function is the return code if it is an int, otherwise 0.
+    uncaught exceptions are printed to the job output and give return code 1.
+    """
+    def __init__(self, entry:str, args:"Optional[List[Any]]"=None, kwargs:"Optional[dict]"=None,
+                 job_name:"Optional[str]"=None, poll_interval:float=0.2):
+        if ':' not in entry:
+            raise ValueError('entry should be in format "module:function", got %s' % entry)
+        self.entry = entry
+        self.args = list(args or [])
+        self.kwargs = dict(kwargs or {})
+        self.job_name = job_name
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_settings(cls, job_name=None, config=None, **kwargs):
+        params = dict(config.params)
+        return cls(entry=params.pop('entry'), args=params.pop('args', None), kwargs=params.pop('kwargs', None),
+                   job_name=job_name)
+
+    def _start(self, output_path:str) -> Future:
+        zygote = get_zygote()
+        if zygote is not None:
+            return zygote.submit(self.entry, self.args, self.kwargs, output_path)
+
+        # no fork (windows), every run starts a fresh interpreter
+        future:Future = Future()
+        process = multiprocessing.get_context('spawn').Process(
+            target=_spawned_entry, args=(self.entry, self.args, self.kwargs, output_path), name=f'schd-{self.job_name}')
+        process.start()
+
+        def wait_process():
+            process.join()
+            future.set_result(process.exitcode)
+        threading.Thread(target=wait_process, daemon=True).start()
+        return future
+
+    def execute(self, context:JobContext) -> int:
+        fd, output_path = tempfile.mkstemp(prefix='schd-', suffix='.log')
+        os.close(fd)
+        try:
+            future = self._start(output_path)
+            # tail the output while the child runs, bytes of a character split by a read wait for the next one
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            with open(output_path, 'rb') as output:
+                while not future.done():
+                    try:
+                        future.result(self.poll_interval)
+                    except FutureTimeoutError:
+                        pass
+                    self._copy(output, decoder, context)
+                self._copy(output, decoder, context, final=True)
+            return future.result()
+        finally:
+            os.remove(output_path)
+
+    def _copy(self, output, decoder, context:JobContext, final=False):
+        while True:
+            data = output.read(64 * 1024)
+            text = decoder.decode(data, final=final and not data)
+            if text and context.stdout is not None:
+                context.stdout.write(text)
+            if not data:
+                break
@@ -0,0 +1,169 @@
+"""
+reload jobs of a running daemon when its config file changes, or on SIGHUP.
+
+Only the difference to the running jobs is applied: new jobs are added, jobs gone from the config are
+removed and jobs whose config changed are added again, which reschedules them. Other jobs are left
+alone, and instances already running finish with the job they started with.
+"""
+import asyncio
+from dataclasses import dataclass, field, fields
+import logging
+import os
+import signal
+from typing import Callable, Dict, List, Optional, Tuple
+from schd.config import JobConfig, SchdConfig, read_config
+from schd.job import Job
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobsDiff:
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def diff_jobs(old:Dict[str, JobConfig], new:Dict[str, JobConfig]) -> JobsDiff:
+    diff = JobsDiff()
+    for job_name, job_config in new.items():
+        if job_name not in old:
+            diff.added.append(job_name)
+        elif old[job_name] != job_config:
+            diff.changed.append(job_name)
+    diff.removed = [job_name for job_name in old if job_name not in new]
+    return diff
+
+
+def changed_settings(old:SchdConfig, new:SchdConfig) -> List[str]:
+    """
+    names of the settings other than jobs that differ, they take effect after a restart only.
+    """
+    return [f.name for f in fields(SchdConfig) if f.name != 'jobs' and getattr(old, f.name) != getattr(new, f.name)]
+
+
+class ConfigReloader:
+    """
+    watches the config file of the daemon, polling its mtime and size every `interval` seconds,
+    and applies the job changes to the scheduler.
+    """
+    def __init__(self, scheduler, config:SchdConfig, config_file:str, make_job:Callable[[str, JobConfig], Job],
+                 interval:float=5):
+        """
+        :param make_job: builds the job of a job config, it may import the job module.
+        :param interval: seconds between two checks of the file, 0 to reload on SIGHUP only.
+        """
+        self.scheduler = scheduler
+        self.config = config
+        self.config_file = config_file
+        self.make_job = make_job
+        self.interval = interval
+        self.reloads = 0
+        self._lock = asyncio.Lock()
+        self._signature = self._stat()
+        self._task:"Optional[asyncio.Task]" = None
+        self._signal_tasks = set()
+        self._sighup = False
+
+    def _stat(self) -> "Optional[Tuple[int, int]]":
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.interval > 0:
+            self._task = loop.create_task(self._watch())
+        if hasattr(signal, 'SIGHUP'):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, self._on_sighup)
+                self._sighup = True
+            except (NotImplementedError, RuntimeError):
+                # not the main thread, or a loop without signal support
+                pass
+
+    def _on_sighup(self):
+        logger.info('SIGHUP received, reloading %s.', self.config_file)
+        task = asyncio.get_running_loop().create_task(self.reload())
+        self._signal_tasks.add(task)
+        task.add_done_callback(self._signal_tasks.discard)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = self._stat()
+            if signature is not None and signature != self._signature:
+                logger.info('config file %s changed, reloading.', self.config_file)
+                await self.reload()
+
+    async def reload(self) -> JobsDiff:
+        """
+        read the config file again and apply the job changes. a config that can't be read or jobs that
+        can't be built are logged and the running ones are kept.
+        """
+        async with self._lock:
+            self._signature = self._stat()
+            loop = asyncio.get_running_loop()
+            try:
+                new_config = await loop.run_in_executor(None, read_config, self.config_file)
+            except Exception as ex:
+                logger.error('failed to reload config %s, keeping the running jobs, %s', self.config_file, ex,
+                             exc_info=ex)
+                return JobsDiff()
+
+            settings = changed_settings(self.config, new_config)
+            if settings:
+                logger.warning('changed settings %s take effect after a restart.', ', '.join(settings))
+
+            diff = diff_jobs(self.config.jobs, new_config.jobs)
+            if not diff:
+                logger.info('config reloaded, jobs unchanged.')
+                return diff
+
+            jobs = dict(self.config.jobs)
+            for job_name in diff.removed:
+                try:
+                    await self.scheduler.remove_job(job_name)
+                    del jobs[job_name]
+                except Exception as ex:
+                    logger.error('failed to remove job %s, %s', job_name, ex, exc_info=ex)
+
+            to_add = []
+            for job_name in diff.added + diff.changed:
+                job_config = new_config.jobs[job_name]
+                try:
+                    job = await loop.run_in_executor(None, self.make_job, job_name, job_config)
+                except Exception as ex:
+                    logger.error('failed to build job %s, %s', job_name, ex, exc_info=ex)
+                    continue
+                to_add.append((job, job_name, job_config))
+            try:
+                # adding a job again replaces it, it is rescheduled with its new config
+                await self.scheduler.add_jobs(to_add)
+                jobs.update((job_name, job_config) for _, job_name, job_config in to_add)
+            except Exception as ex:
+                logger.error('failed to add jobs, %s', ex, exc_info=ex)
+
+            # the settings still in use stay, only jobs are reloaded
+            self.config.jobs = jobs
+            self.reloads += 1
+            logger.info('config reloaded, %d jobs added, %d removed, %d changed.',
+                        len(diff.added), len(diff.removed), len(diff.changed))
+            return diff
+
+    async def stop(self):
+        if self._sighup:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._sighup = False
+        tasks = list(self._signal_tasks)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,30 +1,43 @@
 import argparse
 import asyncio
-from contextlib import redirect_stdout
+import concurrent.futures
+import gzip
 import logging
 import importlib
-import io
 import os
+import re
+import signal
 import socket
 import sys
-from typing import Any, Optional, Dict
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
+from typing import Any, Optional, Dict, List, Tuple
 import subprocess
 import tempfile
-from apscheduler.schedulers.blocking import BlockingScheduler
+import time
+from apscheduler.events import EVENT_JOB_SUBMITTED, JobSubmissionEvent
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor
 from schd import __version__ as schd_version
-from schd.email import EmailService
+from schd.email import AlertSender, EmailService
+from schd.executors import EXECUTOR_PROCESS, EXECUTOR_THREAD, ProcessJobExecutor
+from schd.lazyjob import JobCache, LazyJob, resolve_job
+from schd import metrics
+from schd import pyrunner
+from schd.pyrunner import PythonJob
+from schd.pump import pump_command_output, pump_command_output_async
 from schd.schedulers.remote import RemoteScheduler
 from schd.util import ensure_bool
-from schd.job import Job, JobContext, JobExecutionResult
-from schd.config import JobConfig, SchdConfig, read_config
+from schd.job import Job, JobContext, JobExecutionResult, is_async_job, job_result_code
+from schd.output import JobOutput, capture_output
+from schd.cron import CronEngine, compile_cron
+from schd.config import ConfigFileNotFound, JobConfig, SchdConfig, find_config_file, read_config
+from schd.reload import ConfigReloader
 
 logger = logging.getLogger(__name__)
 
+# output of a run written to the log, the end of it when there is more
+OUTPUT_LOG_MAX_BYTES = 1024 * 1024
+
 
 class DefaultJobExecutionResult(JobExecutionResult):
     def __init__(self, code:int, log:str):
@@ -65,16 +78,25 @@ class CommandJobFailedException(JobFailedException):
 
 
 class CommandJob:
-    def __init__(self, cmd, job_name=None):
+    def __init__(self, cmd, job_name=None, interleave=True, buffer_size=64*1024):
+        """
+        :param interleave: mix stderr into the job output in the order it arrives,
+            otherwise stderr is written after stdout (or to context.stderr when set).
+        :param buffer_size: max bytes read from the process pipes at once.
+        """
         self.cmd = cmd
         self.job_name = job_name
+        self.interleave = interleave
+        self.buffer_size = buffer_size
         self.logger = logging.getLogger(f'CommandJob#{job_name}')
 
     @classmethod
     def from_settings(cls, job_name=None, config=None, **kwargs):
         # compatible with old cmd field
         command = config.params.get('cmd') or config.cmd
-        return cls(cmd=command, job_name=job_name)
+        return cls(cmd=command, job_name=job_name,
+                   interleave=ensure_bool(config.params.get('interleave', True)),
+                   buffer_size=int(config.params.get('buffer_size', 64*1024)))
     
     def execute(self, context:JobContext) -> int:
         process = subprocess.Popen(
@@ -83,17 +105,44 @@ class CommandJob:
             env=os.environ,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
         )
 
-        stdout, stderr = process.communicate()
-        if context.stdout:
-            context.stdout.write(stdout)
-            context.stdout.write(stderr)
-                
+        pump_command_output(process, context.stdout, context.stderr,
+                            interleave=self.interleave, buffer_size=self.buffer_size)
         ret_code = process.wait()
         return ret_code
 
+    async def execute_async(self, context:JobContext) -> int:
+        """
+        run the command with asyncio subprocess, it doesn't occupy a thread while waiting.
+        """
+        process = await asyncio.create_subprocess_shell(
+            self.cmd,
+            env=os.environ,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # its own process group, a cancelled run kills the children of the shell too
+            start_new_session=hasattr(os, 'killpg'),
+        )
+
+        try:
+            await pump_command_output_async(process, context.stdout, context.stderr,
+                                            interleave=self.interleave, buffer_size=self.buffer_size)
+            ret_code = await process.wait()
+        except asyncio.CancelledError:
+            # timed out or shutting down, the command must not outlive its run.
+            # wait() returns once the pipes are closed, by every process holding them
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            raise
+        return ret_code
+
     
     def __call__(self, context:"Optional[JobContext]"=None, **kwds: Any) -> Any:
         output_to_console = False
@@ -136,7 +185,8 @@ class JobExceptionWrapper:
 
 
 class EmailErrorNotifier:
-    def __init__(self, from_addr, to_addr, smtp_server, smtp_port, smtp_user, smtp_password, start_tls=True, debug=False):
+    def __init__(self, from_addr, to_addr, smtp_server, smtp_port, smtp_user, smtp_password, start_tls=True, debug=False,
+                 rate_limit=10, digest_window=0):
         self.from_addr = from_addr
         self.to_addr = to_addr
         self.smtp_server = smtp_server
@@ -145,6 +195,9 @@ class EmailErrorNotifier:
         self.smtp_password = smtp_password
         self.start_tls = start_tls
         self.debug=debug
+        # sent in the background over one connection, the failing job doesn't wait for the mail server
+        service = EmailService(smtp_server, smtp_user, smtp_password, from_addr, smtp_port, start_tls, debug=debug)
+        self.alerts = AlertSender(service, rate_limit=rate_limit, digest_window=digest_window)
 
     def __call__(self, ex:"Exception"):
         if isinstance(ex, JobFailedException):
@@ -155,23 +208,7 @@ class EmailErrorNotifier:
             error_message = str(ex)
 
         mail_subject = f'Schd job failed. {job_name}' 
-        msg = MIMEText(error_message, 'plain', 'utf8')
-        msg['From'] = str(Header(self.from_addr, 'utf8'))
-        msg['To'] = str(Header(self.to_addr, 'utf8'))
-        msg['Subject'] = str(Header(mail_subject, 'utf8'))
-
-        try:
-            smtp = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            smtp.set_debuglevel(self.debug)
-            if self.start_tls:
-                smtp.starttls()
-
-            smtp.login(self.smtp_user, self.smtp_password)
-            smtp.sendmail(self.from_addr, self.to_addr, msg.as_string())
-            smtp.quit()
-            logger.info('Error mail notification sent. %s', mail_subject)
-        except Exception as ex:
-            logger.error('Error when sending email notification, %s', ex, exc_info=ex)
+        self.alerts.notify(mail_subject, error_message, self.to_addr)
 
 
 class ConsoleErrorNotifier:
@@ -187,18 +224,34 @@ class LocalScheduler:
         
         :param max_concurrent_jobs: Maximum number of jobs to run concurrently.
         """
-        executors = {
-            'default': ThreadPoolExecutor(max_concurrent_jobs)
-        }
-        self.scheduler = BlockingScheduler(executors=executors)
+        # runs in its own thread, the event loop stays free for config reloads
+        if config.cron_engine == 'compiled':
+            self.scheduler = CronEngine(concurrent.futures.ThreadPoolExecutor(max_concurrent_jobs))
+            self._make_trigger = compile_cron
+        else:
+            executors = {
+                'default': ThreadPoolExecutor(max_concurrent_jobs)
+            }
+            self.scheduler = BackgroundScheduler(executors=executors)
+            self._make_trigger = CronTrigger.from_crontab
+        self.scheduler.add_listener(self._run_submitted, EVENT_JOB_SUBMITTED)
         self._jobs:Dict[str, Job] = {}
-        self.email_service = EmailService.from_config(config.email)
+        self._job_configs:Dict[str, JobConfig] = {}
+        self.process_executor = ProcessJobExecutor(config.process_pool_workers)
+        # failure mails go out from a background thread, a failing job doesn't wait for the mail server
+        self.alerts = AlertSender.from_config(config.email)
         self.to_mail = config.email.to_addr
+        self.email_config = config.email
         self.worker_name = config.worker_name or socket.gethostname()
+        # async jobs run on the loop of the daemon, at most one run of each job at a time
+        self._loop:"Optional[asyncio.AbstractEventLoop]" = None
+        self._async_runs:"Dict[str, concurrent.futures.Future]" = {}
+        metrics.EXECUTOR_CAPACITY.labels(EXECUTOR_THREAD).set_function(lambda: max_concurrent_jobs)
+        metrics.EXECUTOR_CAPACITY.labels(EXECUTOR_PROCESS).set_function(lambda: self.process_executor.max_workers)
         logger.info("LocalScheduler initialized in 'local' mode with concurrency support")
 
     async def init(self):
-        pass
+        self._loop = asyncio.get_running_loop()
 
     async def add_job(self, job: Job, job_name: str, job_config:JobConfig) -> None:
         """
@@ -209,43 +262,158 @@ class LocalScheduler:
         :param job_name: Optional name for the job.
         """
         self._jobs[job_name] = job
+        self._job_configs[job_name] = job_config
         try:
             cron_expression = job_config.cron
-            cron_trigger = CronTrigger.from_crontab(cron_expression)
-            self.scheduler.add_job(self.execute_job, cron_trigger, kwargs={'job_name':job_name})
+            cron_trigger = self._make_trigger(cron_expression)
+            # added again on reload, replacing reschedules the job
+            self.scheduler.add_job(self.execute_job, cron_trigger, kwargs={'job_name':job_name}, id=job_name,
+                                   replace_existing=True)
             logger.info(f"Job '{job_name or job.__class__.__name__}' added with cron expression: {cron_expression}")
         except Exception as e:
             logger.error(f"Failed to add job '{job_name or job.__class__.__name__}': {str(e)}")
             raise
 
+    async def add_jobs(self, jobs:"List[Tuple[Job, str, JobConfig]]") -> None:
+        for job, job_name, job_config in jobs:
+            await self.add_job(job, job_name, job_config)
+
+    async def remove_job(self, job_name:str) -> None:
+        """
+        unschedule a job, a run in progress finishes.
+        """
+        try:
+            self.scheduler.remove_job(job_name)
+        except KeyError:
+            # JobLookupError of APScheduler is a KeyError
+            pass
+        self._jobs.pop(job_name, None)
+        self._job_configs.pop(job_name, None)
+        logger.info('job %s removed.', job_name)
+
+    def _run_submitted(self, event:JobSubmissionEvent):
+        # the engine submitted a run to its thread pool, lag from the fire time it was planned for
+        now = time.time()
+        for run_time in event.scheduled_run_times:
+            metrics.SCHEDULING_LAG.observe(max(0, now - run_time.timestamp()))
+
     def execute_job(self, job_name:str):
+        # taken together at the start, a reload replacing the job doesn't change a run in progress
         job = self._jobs[job_name]
-        output_stream = io.StringIO()
+        job_config = self._job_configs[job_name]
+        output_stream = JobOutput()
         context = JobContext(job_name=job_name, stdout=output_stream)
+        start = time.perf_counter()
         try:
-            with redirect_stdout(output_stream):
-                job_result = job.execute(context)
-
-            if job_result is None:
-                ret_code = 0
-            elif isinstance(job_result, int):
-                ret_code = job_result
-            elif hasattr(job_result, 'get_code'):
-                ret_code = job_result.get_code()
+            if job_config.executor == EXECUTOR_PROCESS:
+                with metrics.track_running(EXECUTOR_PROCESS):
+                    job_result = self.process_executor.execute(job_name, job_config, context)
             else:
-                raise ValueError('unsupported result type: %s', job_result)
-            
+                job = resolve_job(job)
+                if is_async_job(job):
+                    self._start_async_job(job, job_name, job_config, context)
+                    return
+                with metrics.track_running(EXECUTOR_THREAD), capture_output(output_stream, context.stderr):
+                    job_result = job.execute(context)
+            ret_code = job_result_code(job_result)
+        except Exception as ex:
+            logger.exception('error when executing job, %s', ex)
+            ret_code = -1
+
+        self._finish_run(job_name, ret_code, output_stream, time.perf_counter() - start)
+
+    def _start_async_job(self, job:Job, job_name:str, job_config:JobConfig, context:JobContext):
+        """
+        hand an async job to the loop, the scheduler thread doesn't wait for it.
+        without a loop (init not called), it runs to the end in the calling thread.
+        """
+        if self._loop is None or not self._loop.is_running():
+            asyncio.run(self._execute_async_job(job, job_name, job_config, context))
+            return
+
+        previous = self._async_runs.get(job_name)
+        if previous is not None and not previous.done():
+            logger.warning('run of job %s skipped: the previous run is still going.', job_name)
+            return
+        self._async_runs[job_name] = asyncio.run_coroutine_threadsafe(
+            self._execute_async_job(job, job_name, job_config, context), self._loop)
+
+    async def _execute_async_job(self, job:Job, job_name:str, job_config:JobConfig, context:JobContext):
+        start = time.perf_counter()
+        try:
+            with metrics.track_running('async'), capture_output(context.stdout, context.stderr):
+                job_result = await asyncio.wait_for(job.execute(context), job_config.timeout)
+            ret_code = job_result_code(job_result)
+        except asyncio.TimeoutError:
+            logger.error('job %s timed out after %ss, cancelled.', job_name, job_config.timeout)
+            ret_code = -1
         except Exception as ex:
             logger.exception('error when executing job, %s', ex)
             ret_code = -1
+        # in a thread, compressing a large output for the failure mail would hold up the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._finish_run, job_name, ret_code, context.stdout, time.perf_counter() - start)
 
-        output = output_stream.getvalue()
+    def _finish_run(self, job_name:str, ret_code:int, output:JobOutput, duration:float):
+        try:
+            metrics.record_run(job_name, ret_code, duration, output.size)
+            self._job_finished(job_name, ret_code, output, duration)
+        finally:
+            output.close()
+
+    def _job_finished(self, job_name:str, ret_code:int, output:JobOutput, duration:float):
         logger.info('job %s execute complete: %d', job_name, ret_code)
-        logger.info('job %s process output: \n%s', job_name, output)
+        text, cut = output.tail(OUTPUT_LOG_MAX_BYTES)
+        if cut:
+            logger.info('job %s process output, the last %d of %d bytes: \n%s', job_name, len(text.encode('utf-8')),
+                        output.size, text)
+        else:
+            logger.info('job %s process output: \n%s', job_name, text)
         if ret_code != 0 and self.to_mail:
-            self.email_service.send_mail('job failed %s %s' % (self.worker_name, job_name),
-                                         content=output,
-                                         to_emails=self.to_mail)
+            content, attachments = self._failure_mail(job_name, ret_code, output, duration)
+            self.alerts.notify('job failed %s %s' % (self.worker_name, job_name), content, self.to_mail,
+                               attachments=attachments)
+
+    def _failure_mail(self, job_name:str, ret_code:int, output:JobOutput, duration:float) -> Tuple[str, List[str]]:
+        """
+        body of the failure mail, a summary and the end of the output, and the files to attach:
+        the whole output gzip compressed, when the body doesn't hold all of it.
+        """
+        email_config = self.email_config
+        tail, cut = output.tail(email_config.tail_bytes, email_config.tail_lines)
+        attachments = []
+        if not cut:
+            output_line = '%d bytes' % output.size
+        else:
+            output_line = '%d bytes, the last %d lines below' % (output.size, len(tail.splitlines()))
+            if email_config.attach_log:
+                path = self._save_output(job_name, output)
+                attachments.append(path)
+                output_line += ', all of it attached as %s' % os.path.basename(path)
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - duration))
+        content = '\n'.join([
+            f'job:          {job_name}',
+            f'worker:       {self.worker_name}',
+            f'return code:  {ret_code}',
+            f'started:      {started}',
+            f'duration:     {duration:.2f}s',
+            f'output:       {output_line}',
+            '',
+            '----- output -----',
+            tail,
+        ])
+        return content, attachments
+
+    def _save_output(self, job_name:str, output:JobOutput) -> str:
+        """
+        compress the output into a temporary file chunk by chunk, returns its path.
+        """
+        name = re.sub(r'[^\w.-]', '_', job_name)
+        fd, path = tempfile.mkstemp(prefix=f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-', suffix='.log.gz')
+        with os.fdopen(fd, 'wb') as f, gzip.GzipFile(filename=f'{name}.log', mode='wb', fileobj=f) as compressed:
+            for chunk in output.chunks():
+                compressed.write(chunk)
+        return path
 
     def run(self):
         """
@@ -254,12 +422,28 @@ class LocalScheduler:
         try:
             logger.info("Starting LocalScheduler...")
             self.scheduler.start()
+            while self.scheduler.running:
+                time.sleep(1)
         except (KeyboardInterrupt, SystemExit):
             logger.info("Scheduler stopped.")
 
     def start(self):
         self.scheduler.start()
 
+    async def close(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        runs = [asyncio.wrap_future(run) for run in self._async_runs.values() if not run.done()]
+        for run in runs:
+            run.cancel()
+        await asyncio.gather(*runs, return_exceptions=True)
+        self._async_runs.clear()
+        self.process_executor.shutdown()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, pyrunner.stop)
+        # failures of the last runs are still mailed
+        await loop.run_in_executor(None, self.alerts.close)
+
 
 def build_scheduler(config:SchdConfig):
     scheduler_cls = config.scheduler_cls
@@ -274,13 +458,18 @@ def build_scheduler(config:SchdConfig):
         worker_name = config.worker_name
         assert worker_name, 'worker_name cannot be none'
         logger.info('worker_name: %s ', worker_name)
-        scheduler = RemoteScheduler(worker_name=worker_name, remote_host=scheduler_remote_host)
+        scheduler = RemoteScheduler.from_config(config)
     else:
         raise ValueError('invalid scheduler_cls: %s' % scheduler_cls)
     return scheduler
 
 
-async def run_daemon(config):
+async def run_daemon(config, config_file=None):
+    """
+    :param config_file: the file `config` was read from, watched for job changes.
+        defaults to the file read_config() finds.
+    """
+    pyrunner.configure(config.python_runner_preload)
     scheduler = build_scheduler(config)
     await scheduler.init()
 
@@ -310,17 +499,45 @@ async def run_daemon(config):
     else:
         job_error_handler = ConsoleErrorNotifier()
         
-    for job_name, job_config in config.jobs.items():
-        job_class_name = job_config.cls
-        job_cron = job_config.cron
-        job = build_job(job_name, job_class_name, job_config)
-        await scheduler.add_job(job, job_name, job_config)
-        logger.info('job added, %s', job_name)
+    job_cache = JobCache(config.job_cache_size) if config.job_cache_size > 0 else None
+    def make_job(job_name:str, job_config:JobConfig):
+        if config.lazy_jobs:
+            # a reloaded job must not run the job built from its old config
+            if job_cache is not None:
+                job_cache.discard(job_name)
+            return LazyJob(job_name, job_config, job_cache)
+        return build_job(job_name, job_config.cls, job_config)
+
+    jobs = [(make_job(job_name, job_config), job_name, job_config) for job_name, job_config in config.jobs.items()]
+    # registered together, a worker with many jobs doesn't wait for one round-trip per job
+    await scheduler.add_jobs(jobs)
+    logger.info('%d jobs added', len(jobs))
+
+    try:
+        config_file = find_config_file(config_file)
+    except ConfigFileNotFound:
+        config_file = None
+    reloader = None
+    if config_file is not None:
+        reloader = ConfigReloader(scheduler, config, config_file, make_job, interval=config.config_reload_interval)
+
+    metrics_runner = None
+    if config.metrics_port:
+        metrics_runner = await metrics.start_metrics_server(config.metrics_host, config.metrics_port)
 
     logger.info('scheduler starting.')
-    scheduler.start()
-    while True:
-        await asyncio.sleep(1000)
+    try:
+        scheduler.start()
+        if reloader is not None:
+            reloader.start()
+        while True:
+            await asyncio.sleep(1000)
+    finally:
+        if reloader is not None:
+            await reloader.stop()
+        await scheduler.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 async def main():
@@ -343,7 +560,7 @@ async def main():
         log_stream = sys.stdout
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s - %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S', stream=log_stream)
-    await run_daemon(config)
+    await run_daemon(config, args.config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+"""
+job log files of RemoteScheduler: compressed, sharded by instance id and cleaned up by retention.
+"""
+import gzip
+import io
+import logging
+import os
+import threading
+import time
+from typing import BinaryIO, Optional, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# compression: (file suffix, Content-Encoding of the upload)
+COMPRESSIONS = {
+    'none': ('.log', None),
+    'gzip': ('.log.gz', 'gzip'),
+    'zstd': ('.log.zst', 'zstd'),
+}
+
+
+class JoblogStore:
+    """
+    Writes the log of each job instance to `root/<shard>/<shard>/<instance_id><suffix>`.
+    Each shard directory holds at most 1000 entries, however many instances ran.
+
+    cleanup() removes logs older than `retention_days`, then the oldest ones beyond `max_count`
+    files or `max_bytes` in total. Logs still being written are kept.
+    """
+    def __init__(self, root:str='joblog', compression:str='gzip', retention_days:float=7,
+                 max_count:int=10000, max_bytes:int=1024**3, compresslevel:int=6):
+        """
+        :param compression: none | gzip | zstd, zstd needs the zstandard package.
+        :param retention_days: max age of a log, 0 for no limit.
+        :param max_count: max number of logs kept, 0 for no limit.
+        :param max_bytes: max total size of the logs, 0 for no limit.
+        """
+        compression = compression.lower()
+        if compression not in COMPRESSIONS:
+            raise ValueError('invalid joblog compression: %s, expected one of %s'
+                             % (compression, ', '.join(COMPRESSIONS)))
+        if compression == 'zstd' and zstandard is None:
+            logger.warning('zstandard is not installed, job logs are compressed with gzip.')
+            compression = 'gzip'
+        self.root = root
+        self.compression = compression
+        self.suffix, self.content_encoding = COMPRESSIONS[compression]
+        self.retention_days = retention_days
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self._active:Set[str] = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, instance_id:int) -> str:
+        return os.path.join(self.root, '%03d' % (instance_id // 1000000 % 1000), '%03d' % (instance_id // 1000 % 1000),
+                            f'{instance_id}{self.suffix}')
+
+    def open(self, instance_id:int) -> Tuple[str, BinaryIO]:
+        """
+        create the log file of an instance, returns its path and a binary stream compressing into it.
+        the file is protected from cleanup until release(path).
+        """
+        path = self.path_for(instance_id)
+        # under the lock, cleanup must not remove the shard directory between makedirs and open
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.compression == 'gzip':
+                stream = gzip.open(path, 'wb', compresslevel=self.compresslevel)
+            elif self.compression == 'zstd':
+                stream = zstandard.open(path, 'wb', cctx=zstandard.ZstdCompressor(level=self.compresslevel))
+            else:
+                stream = io.FileIO(path, mode='w')
+            self._active.add(os.path.abspath(path))
+        return path, stream
+
+    def bytes_written(self, stream:BinaryIO) -> "Optional[int]":
+        """
+        uncompressed bytes written so far to a stream from open(), None when the stream can't tell:
+        a zstd writer counts compressed bytes.
+        """
+        if self.compression == 'zstd':
+            return None
+        return stream.tell()
+
+    def hold(self, path:str):
+        """
+        protect an existing log from cleanup until release(path), one still to be uploaded.
+        """
+        with self._lock:
+            self._active.add(os.path.abspath(path))
+
+    def release(self, path:str):
+        with self._lock:
+            self._active.discard(os.path.abspath(path))
+
+    def cleanup(self, now:"Optional[float]"=None) -> int:
+        """
+        apply the retention, returns the number of logs removed.
+        """
+        now = time.time() if now is None else now
+        entries = []
+        with self._lock:
+            active = set(self._active)
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                if path in active:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        # oldest first
+        entries.sort()
+
+        expired = 0
+        if self.retention_days > 0:
+            deadline = now - self.retention_days * 86400
+            while expired < len(entries) and entries[expired][0] < deadline:
+                expired += 1
+        remove, keep = entries[:expired], entries[expired:]
+
+        total = sum(size for _, size, _ in keep)
+        drop = 0
+        while drop < len(keep) and ((self.max_count > 0 and len(keep) - drop > self.max_count)
+                                    or (self.max_bytes > 0 and total > self.max_bytes)):
+            total -= keep[drop][1]
+            drop += 1
+        remove += keep[:drop]
+
+        for _, _, path in remove:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._remove_empty_dirs()
+        if remove:
+            logger.info('joblog cleanup removed %d logs, %d kept, %d bytes', len(remove), len(keep) - drop, total)
+        return len(remove)
+
+    def _remove_empty_dirs(self):
+        for dirpath, _, _ in os.walk(self.root, topdown=False):
+            if dirpath == self.root:
+                continue
+            with self._lock:
+                try:
+                    if not os.listdir(dirpath):
+                        os.rmdir(dirpath)
+                except OSError:
+                    pass
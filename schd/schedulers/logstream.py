@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class JobLogStreamer:
+    """
+    Tails a job log file and ships new bytes to the server while the job is running.
+
+    Every chunk carries the offset it starts at, the server answers with the offset it has stored.
+    After a failed upload the streamer asks the server for its offset and resumes from there,
+    so on completion only the remaining tail is sent and the log is sealed.
+    A compressed log file is shipped as is, its encoding is given when sealing.
+    """
+    def __init__(self, client, worker_name:str, job_name:str, instance_id:int, logfile_path:str,
+                 chunk_size:int=256*1024, interval:float=5, poll_interval:float=0.5,
+                 content_encoding:"Optional[str]"=None):
+        self.client = client
+        self.worker_name = worker_name
+        self.job_name = job_name
+        self.instance_id = instance_id
+        self.logfile_path = logfile_path
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.poll_interval = min(poll_interval, interval)
+        self.content_encoding = content_encoding
+        self.acked_offset = 0
+        self._resync = False
+        self._last_ship = time.monotonic()
+        self._stopped = asyncio.Event()
+        self._task:"Optional[asyncio.Task]" = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            pending = self._file_size() - self.acked_offset
+            if pending >= self.chunk_size or (pending > 0 and time.monotonic() - self._last_ship >= self.interval):
+                await self.ship()
+
+    def _file_size(self) -> int:
+        try:
+            return os.path.getsize(self.logfile_path)
+        except OSError:
+            return 0
+
+    async def ship(self) -> bool:
+        """
+        upload everything written so far, returns False if the upload failed.
+        """
+        try:
+            if self._resync:
+                self.acked_offset = await self.client.get_job_log_offset(self.worker_name, self.job_name, self.instance_id)
+                self._resync = False
+                logger.info('log stream %s@%d resumed at offset %d', self.job_name, self.instance_id, self.acked_offset)
+
+            with open(self.logfile_path, 'rb') as f:
+                f.seek(self.acked_offset)
+                while True:
+                    data = f.read(self.chunk_size)
+                    if not data:
+                        break
+                    self.acked_offset = await self.client.append_job_log(self.worker_name, self.job_name,
+                                                                         self.instance_id, self.acked_offset, data)
+                    f.seek(self.acked_offset)
+            self._last_ship = time.monotonic()
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as ex:
+            logger.warning('log stream %s@%d upload failed at offset %d, %s',
+                           self.job_name, self.instance_id, self.acked_offset, ex)
+            self._resync = True
+            return False
+
+    async def close(self) -> bool:
+        """
+        stop tailing, ship the remaining tail and seal the log.
+        falls back to a full upload when the tail cannot be shipped.
+        returns False when the log could not be committed, errors are logged and not raised,
+        the caller decides whether to retry and can still report the job status.
+        """
+        self._stopped.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as ex:
+                logger.error('log stream %s@%d stopped with error, %s', self.job_name, self.instance_id, ex, exc_info=ex)
+                self._resync = True
+            self._task = None
+
+        try:
+            if await self.ship():
+                await self.client.seal_job_log(self.worker_name, self.job_name, self.instance_id, self.acked_offset,
+                                               content_encoding=self.content_encoding)
+            else:
+                await self.client.commit_job_log(self.worker_name, self.job_name, self.instance_id, self.logfile_path,
+                                                 content_encoding=self.content_encoding)
+            return True
+        except Exception as ex:
+            logger.error('failed to commit log of %s@%d, %s', self.job_name, self.instance_id, ex, exc_info=ex)
+            return False
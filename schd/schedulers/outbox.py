@@ -0,0 +1,81 @@
+"""
+durable queue of reports for the server, kept in SQLite under the worker's data dir.
+
+Reports are written before they are sent and deleted once the server took them, so status and log
+commits of instances finishing while the server is down are replayed after it is back, also across
+restarts of the daemon.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    def __init__(self, path:str, compact_free_pages:int=1024):
+        """
+        :param path: sqlite database file, its directory is created if needed.
+        :param compact_free_pages: compact() vacuums the file once this many pages are free.
+        """
+        self.path = path
+        self.compact_free_pages = compact_free_pages
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        # WAL without fsync per commit: a crash may lose the last reports, not corrupt the file
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS reports ('
+                           'seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL)')
+
+    def append(self, kind:str, payload:Dict[str, Any]) -> int:
+        """
+        store a report, returns its sequence number.
+        """
+        with self._lock:
+            cursor = self._conn.execute('INSERT INTO reports (kind, payload) VALUES (?, ?)',
+                                        (kind, json.dumps(payload)))
+            return cursor.lastrowid
+
+    def load(self) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        all stored reports as (seq, kind, payload), oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT seq, kind, payload FROM reports ORDER BY seq').fetchall()
+        return [(seq, kind, json.loads(payload)) for seq, kind, payload in rows]
+
+    def delete(self, seqs:Iterable[int]):
+        seqs = [(seq,) for seq in seqs]
+        if not seqs:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('DELETE FROM reports WHERE seq = ?', seqs)
+            self._conn.execute('COMMIT')
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+
+    def compact(self) -> bool:
+        """
+        give pages of sent reports back to the file system, returns True if the file was vacuumed.
+        """
+        with self._lock:
+            free_pages = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free_pages < self.compact_free_pages:
+                return False
+            self._conn.execute('VACUUM')
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        logger.info('outbox %s compacted, %d pages freed', self.path, free_pages)
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,81 @@
+import asyncio
+import collections
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+
+
+class WeightedSemaphore:
+    """
+    asyncio semaphore where each acquirer takes a number of slots.
+
+    Waiters are served in FIFO order, so a heavy job at the head of the queue
+    is not starved by lighter jobs arriving after it.
+    """
+    def __init__(self, capacity:int):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1, got %s' % capacity)
+        self.capacity = capacity
+        self.used = 0
+        self._waiters:"Deque[Tuple[int, asyncio.Future]]" = collections.deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, weight:int=1):
+        weight = min(weight, self.capacity)
+        if not self._waiters and self.used + weight <= self.capacity:
+            self.used += weight
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((weight, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # slots were granted right before the cancellation
+                self.release(weight)
+            else:
+                self._wake()
+            raise
+
+    def release(self, weight:int=1):
+        weight = min(weight, self.capacity)
+        self.used -= weight
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            weight, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if self.used + weight > self.capacity:
+                break
+            self._waiters.popleft()
+            self.used += weight
+            fut.set_result(True)
+
+    @asynccontextmanager
+    async def slots(self, weight:int=1):
+        await self.acquire(weight)
+        try:
+            yield
+        finally:
+            self.release(weight)
+
+
+def queue_stats(semaphores:"Dict[str, WeightedSemaphore]") -> Dict[str, Dict[str, int]]:
+    """
+    slot usage per queue, plus the worker level totals under the key '*'.
+    """
+    stats = {}
+    for name, sem in semaphores.items():
+        stats[name] = {'capacity': sem.capacity, 'used': sem.used, 'waiting': sem.waiting}
+    stats['*'] = {
+        'capacity': sum(s['capacity'] for s in stats.values()),
+        'used': sum(s['used'] for s in stats.values()),
+        'waiting': sum(s['waiting'] for s in stats.values()),
+    }
+    return stats
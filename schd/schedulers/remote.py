@@ -1,203 +1,768 @@
 import asyncio
-from contextlib import redirect_stdout
+import functools
+import hashlib
 import io
 import json
 import os
-from typing import Dict, Tuple
+import time
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
 from urllib.parse import urljoin
 import aiohttp
 import aiohttp.client_exceptions
-from schd.config import JobConfig
-from schd.job import JobContext, Job
+from schd.config import JobConfig, SchdConfig
+from schd.job import JobContext, Job, is_async_job, job_result_code
+from schd.executors import EXECUTOR_PROCESS, EXECUTOR_THREAD, ProcessJobExecutor
+from schd.lazyjob import LazyJob
+from schd.output import capture_output
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.logstream import JobLogStreamer
+from schd.schedulers.outbox import Outbox
+from schd.schedulers.queues import WeightedSemaphore, queue_stats
+from schd.schedulers.reporter import StatusReporter
+from schd.util import Backoff, LRUSet, install_child_watcher
+from schd import metrics
+from schd import pyrunner
 from schd import __version__ as schd_version
 
 import logging
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # optional, pip install schd[speedups]
+    json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
 
+async def iter_lines(content:aiohttp.StreamReader):
+    """
+    non empty lines of a response body, read in whatever chunks arrive instead of one readline per line.
+    """
+    tail = b''
+    async for chunk in content.iter_any():
+        lines = (tail + chunk).split(b'\n') if tail else chunk.split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            if line and line != b'\r':
+                yield line
+    if tail.strip():
+        yield tail
+
+
+def job_definition(cron:str, timezone:"Optional[str]"=None, queue:"Optional[str]"=None) -> dict:
+    """
+    registration data of a job, with a hash the server keeps to tell whether a job changed.
+    """
+    definition = {'cron': cron}
+    if timezone:
+        definition['timezone'] = timezone
+    if queue:
+        definition['queue'] = queue
+    definition['definition_hash'] = definition_hash(definition)
+    return definition
+
+
+def definition_hash(definition:dict) -> str:
+    key = json.dumps([definition.get('cron'), definition.get('timezone') or None, definition.get('queue') or ''])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def parse_frame(line:bytes) -> List[dict]:
+    """
+    events of one event stream line: a single event, a JSON array of events,
+    or a {"event_type": "batch", "events": [...]} frame.
+    """
+    frame = json_loads(line)
+    if isinstance(frame, list):
+        return frame
+    if frame.get('event_type') == 'batch':
+        return frame['events']
+    return [frame]
+
+
+def _api_call(name:str):
+    """
+    time calls of a RemoteApiClient method in schd_api_request_duration_seconds, count the failed ones.
+    """
+    duration = metrics.API_DURATION.labels(name)
+    errors = metrics.API_ERRORS.labels(name)
+
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                duration.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
 class RemoteApiClient:
-    def __init__(self, base_url:str):
+    def __init__(self, base_url:str, conn_limit:int=100, conn_limit_per_host:int=0, keepalive_timeout:float=30):
+        """
+        :param conn_limit: total number of simultaneous connections in the pool, 0 for no limit.
+        :param conn_limit_per_host: simultaneous connections to the same endpoint, 0 for no limit.
+        :param keepalive_timeout: seconds an idle connection is kept open for reuse.
+        """
         self._base_url = base_url
+        self._conn_limit = conn_limit
+        self._conn_limit_per_host = conn_limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._session:"Optional[aiohttp.ClientSession]" = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # the session must be created inside a running event loop, so it is built on first use.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._conn_limit,
+                                             limit_per_host=self._conn_limit_per_host,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @_api_call('register_worker')
     async def register_worker(self, name:str):
         url = urljoin(self._base_url, f'/api/workers/{name}')
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url) as response:
-                response.raise_for_status()
-                result = await response.json()
+        session = self._get_session()
+        async with session.put(url) as response:
+            response.raise_for_status()
+            result = await response.json()
 
-    async def register_job(self, worker_name, job_name, cron, timezone=None):
+    @_api_call('register_job')
+    async def register_job(self, worker_name, job_name, cron, timezone=None, queue=None):
         url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}')
-        post_data = {
-            'cron': cron,
-        }
-        if timezone:
-            post_data['timezone'] = timezone
+        post_data = job_definition(cron, timezone, queue)
+
+        session = self._get_session()
+        async with session.put(url, json=post_data) as response:
+            response.raise_for_status()
+            result = await response.json()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url, json=post_data) as response:
-                response.raise_for_status()
-                result = await response.json()
+    @_api_call('register_jobs')
+    async def register_jobs(self, worker_name, jobs:Dict[str, dict]):
+        """
+        register many jobs in one request, `jobs` maps job names to job_definition().
+        raises ClientResponseError 404/405 when the server has no bulk endpoint.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs')
+        post_data = {'jobs': [dict(definition, job_name=job_name) for job_name, definition in jobs.items()]}
+        session = self._get_session()
+        async with session.put(url, json=post_data) as response:
+            response.raise_for_status()
+            result = await response.json()
 
-    async def subscribe_worker_eventstream(self, worker_name, socket_timeout=600):
+    @_api_call('unregister_job')
+    async def unregister_job(self, worker_name, job_name):
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}')
+        session = self._get_session()
+        async with session.delete(url) as response:
+            response.raise_for_status()
+
+    @_api_call('list_jobs')
+    async def list_jobs(self, worker_name) -> Dict[str, dict]:
+        """
+        jobs the server has for the worker, by job name.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs')
+        session = self._get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            result = await response.json()
+            return {job['job_name']: job for job in result['jobs']}
+
+    async def subscribe_worker_eventstream(self, worker_name, socket_timeout=600, last_event_id=None, on_connected=None):
+        """
+        :param last_event_id: `event_id` of the last event handled, the server replays the events after it.
+        :param on_connected: called once the server accepted the subscription.
+        """
         url = urljoin(self._base_url, f'/api/workers/{worker_name}/eventstream')
         headers = {
             'X-SchdClient': 'schd_%s' % schd_version,
         }
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = str(last_event_id)
         timeout = aiohttp.ClientTimeout(sock_read=socket_timeout)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, headers=headers) as resp:
+        session = self._get_session()
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as resp:
                 resp.raise_for_status()
-                async for line in resp.content:
-                    decoded = line.decode("utf-8").strip()
-                    logger.debug('got event, raw data: %s', decoded)
-                    event = json.loads(decoded)
-                    event_type = event['event_type']
-                    if event_type == 'NewJobInstance':
-                        # event = JobInstanceEvent()
-                        yield event
-                    elif event_type == 'heartbeat':
-                        logger.debug('heartbeat received.')
-                        continue
-                    else:
-                        raise ValueError('unknown event type %s' % event_type)
+                # the stream stays open, only the time to subscribe is a round-trip
+                metrics.API_DURATION.labels('subscribe_worker_eventstream').observe(time.perf_counter() - start)
+                if on_connected is not None:
+                    on_connected()
+                debug = logger.isEnabledFor(logging.DEBUG)
+                async for line in iter_lines(resp.content):
+                    if debug:
+                        logger.debug('got event, raw data: %s', line.decode('utf-8', 'replace').strip())
+                    for event in parse_frame(line):
+                        event_type = event['event_type']
+                        if event_type == 'NewJobInstance':
+                            # event = JobInstanceEvent()
+                            yield event
+                        elif event_type == 'heartbeat':
+                            if debug:
+                                logger.debug('heartbeat received.')
+                        else:
+                            raise ValueError('unknown event type %s' % event_type)
+        except Exception:
+            metrics.API_ERRORS.labels('subscribe_worker_eventstream').inc()
+            raise
                     
+    @_api_call('update_job_instance')
     async def update_job_instance(self, worker_name, job_name, job_instance_id, status, ret_code=None):
         url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}')
         post_data = {'status':status}
         if ret_code is not None:
             post_data['ret_code'] = ret_code
 
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url, json=post_data) as response:
-                response.raise_for_status()
-                result = await response.json()
+        session = self._get_session()
+        async with session.put(url, json=post_data) as response:
+            response.raise_for_status()
+            result = await response.json()
+
+    @_api_call('update_job_instances')
+    async def update_job_instances(self, worker_name, updates:List[dict]):
+        """
+        report status of many job instances in one request,
+        each update has job_name, id, status and optionally ret_code.
+        raises ClientResponseError 404/405 when the server has no bulk endpoint.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/instances')
+        session = self._get_session()
+        async with session.put(url, json={'updates': updates}) as response:
+            response.raise_for_status()
+            result = await response.json()
 
-    async def commit_job_log(self, worker_name, job_name, job_instance_id, logfile_path):
+    @_api_call('commit_job_log')
+    async def commit_job_log(self, worker_name, job_name, job_instance_id, logfile_path, content_encoding=None):
+        """
+        upload the job log. a compressed log is sent as is, as the request body with its Content-Encoding,
+        form-data parts cannot carry a Content-Encoding.
+        """
         upload_url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}/log')
-        async with aiohttp.ClientSession() as session:
+        session = self._get_session()
+        if content_encoding:
+            headers = {'Content-Type': 'text/plain; charset=utf-8', 'Content-Encoding': content_encoding}
             with open(logfile_path, 'rb') as f:
-                data = aiohttp.FormData()
-                data.add_field('logfile', f, filename=os.path.basename(logfile_path), content_type='application/octet-stream')
+                async with session.put(upload_url, data=f, headers=headers) as resp:
+                    resp.raise_for_status()
+            return
+
+        with open(logfile_path, 'rb') as f:
+            data = aiohttp.FormData()
+            data.add_field('logfile', f, filename=os.path.basename(logfile_path), content_type='application/octet-stream')
+
+            async with session.put(upload_url, data=data) as resp:
+                logger.info("Status: %d", resp.status)
+                logger.info("Response: %s", await resp.text())
+                resp.raise_for_status()
+
+    @_api_call('append_job_log')
+    async def append_job_log(self, worker_name, job_name, job_instance_id, offset:int, data:bytes) -> int:
+        """
+        upload a chunk of job log starting at `offset`, returns the offset acknowledged by server.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}/log/chunks')
+        session = self._get_session()
+        headers = {'Content-Type': 'application/octet-stream'}
+        async with session.put(url, params={'offset': offset}, data=data, headers=headers) as response:
+            response.raise_for_status()
+            result = await response.json()
+            return result['offset']
+
+    @_api_call('get_job_log_offset')
+    async def get_job_log_offset(self, worker_name, job_name, job_instance_id) -> int:
+        """
+        the offset up to which the server has stored job log chunks.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}/log/chunks')
+        session = self._get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            result = await response.json()
+            return result['offset']
 
-                async with session.put(upload_url, data=data) as resp:
-                    logger.info("Status: %d", resp.status)
-                    logger.info("Response: %s", await resp.text())
+    @_api_call('seal_job_log')
+    async def seal_job_log(self, worker_name, job_name, job_instance_id, size:int, content_encoding=None):
+        """
+        mark the chunked job log as complete, `content_encoding` tells how the chunks are compressed.
+        """
+        url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/{job_instance_id}/log/seal')
+        session = self._get_session()
+        post_data = {'size': size}
+        if content_encoding:
+            post_data['content_encoding'] = content_encoding
+        async with session.put(url, json=post_data) as response:
+            response.raise_for_status()
+            result = await response.json()
 
+    @_api_call('add_trigger')
     async def add_trigger(self, worker_name, job_name, on_job_name, on_worker_name=None, on_job_status='ALL'):
         url = urljoin(self._base_url, f'/api/workers/{worker_name}/jobs/{job_name}/triggers')
-        async with aiohttp.ClientSession() as session:
-            post_data={
-                'on_job_name': on_job_name,
-                'on_worker_name': on_worker_name,
-                'on_job_status': on_job_status
-            }
-            async with session.post(url, json=post_data) as response:
-                response.raise_for_status()
-                result = await response.json()
-                return result
+        session = self._get_session()
+        post_data={
+            'on_job_name': on_job_name,
+            'on_worker_name': on_worker_name,
+            'on_job_status': on_job_status
+        }
+        async with session.post(url, json=post_data) as response:
+            response.raise_for_status()
+            result = await response.json()
+            return result
+
+
+# status reported to server for instances that don't fit in the pending queue
+OVERFLOW_STATUS = {
+    'block': None,
+    'reject': 'REJECTED',
+    'defer': 'DEFERRED',
+}
+
 
 class RemoteScheduler:
-    def __init__(self, worker_name:str, remote_host:str):
-        self.client = RemoteApiClient(remote_host)
+    def __init__(self, worker_name:str, remote_host:str, conn_limit:int=100, conn_limit_per_host:int=0,
+                 log_stream:bool=False, log_stream_chunk_size:int=256*1024, log_stream_interval:float=5,
+                 queues:"Optional[Dict[str, int]]"=None, max_inflight:int=100, max_pending:int=1000,
+                 overflow:str='block', process_pool_workers:"Optional[int]"=None,
+                 report_batch_size:int=100, report_max_backoff:float=30, report_max_pending:int=100000,
+                 data_dir:"Optional[str]"=None, joblog_store:"Optional[JoblogStore]"=None,
+                 joblog_cleanup_interval:float=600, reconnect_min:float=0.5, reconnect_max:float=60,
+                 reconnect_stable:float=10, dedup_size:int=10000, register_concurrency:int=16):
+        """
+        :param log_stream: upload job log in chunks while the job is running instead of once on completion.
+        :param log_stream_chunk_size: ship a chunk once this many bytes are pending.
+        :param log_stream_interval: ship pending bytes at least every this many seconds.
+        :param queues: max concurrency (slots) of each queue, queues not listed have 1 slot.
+        :param max_inflight: max job instances running at once on this worker, 0 for no limit.
+            it is taken after the queue slot, so a saturated queue doesn't hold permits of other queues.
+        :param max_pending: max job instances received but not running yet, 0 for no limit.
+        :param overflow: what to do with new instances when pending is full.
+            'block' stops reading the event stream until there is room,
+            'reject' / 'defer' report the instance as REJECTED / DEFERRED to the server.
+        :param process_pool_workers: worker processes for jobs with `executor: process`, defaults to cpu count.
+        :param report_batch_size: max status reports sent to the server in one round.
+        :param report_max_backoff: max seconds between retries of failed status reports.
+        :param report_max_pending: max status reports waiting for the server, the oldest are dropped beyond it.
+        :param data_dir: directory of the worker's local state. reports not sent yet are kept in an outbox
+            there and sent after a restart.
+        :param joblog_store: where job logs are written, defaults to gzip files under ./joblog.
+        :param joblog_cleanup_interval: seconds between two runs of the job log retention.
+        :param reconnect_min: first delay before reconnecting the event stream, doubled up to `reconnect_max`
+            and jittered, so workers don't reconnect in lockstep after a server restart.
+        :param reconnect_stable: seconds a stream must stay up before the delay starts over from `reconnect_min`,
+            it does as well once an event is received. a server accepting and dropping streams is backed off.
+        :param dedup_size: number of recent instance ids remembered to ignore redelivered NewJobInstance events.
+        :param register_concurrency: max job registrations in flight when the server has no bulk endpoint.
+        """
+        overflow = overflow.lower()
+        if overflow not in OVERFLOW_STATUS:
+            raise ValueError('invalid overflow: %s' % overflow)
+        self.client = RemoteApiClient(remote_host, conn_limit=conn_limit, conn_limit_per_host=conn_limit_per_host)
         self._worker_name = worker_name
-        self._jobs:"Dict[str,Tuple[Job,str]]" = {}
+        self._jobs:"Dict[str,Tuple[Job,JobConfig]]" = {}
         self._loop_task = None
         self._loop = asyncio.get_event_loop()
-        self.queue_semaphores = {}
+        self._queue_capacities = dict(queues or {})
+        self.queue_semaphores:"Dict[str, WeightedSemaphore]" = {}
+        self._log_stream = log_stream
+        self._log_stream_chunk_size = log_stream_chunk_size
+        self._log_stream_interval = log_stream_interval
+        self._inflight = asyncio.Semaphore(max_inflight) if max_inflight > 0 else None
+        self._max_pending = max_pending
+        self._pending_room = asyncio.Condition()
+        self._overflow = overflow
+        self._tasks:"Set[asyncio.Task]" = set()
+        self.process_executor = ProcessJobExecutor(process_pool_workers)
+        self.joblogs = joblog_store if joblog_store is not None else JoblogStore()
+        self._joblog_cleanup_interval = joblog_cleanup_interval
+        self._cleanup_task = None
+        self._reconnect_backoff = Backoff(reconnect_min, reconnect_max)
+        self._reconnect_stable = reconnect_stable
+        self._last_event_id = None
+        self._seen_instances = LRUSet(dedup_size)
+        self._register_concurrency = register_concurrency
+        self.outbox = Outbox(os.path.join(data_dir, 'outbox.sqlite3')) if data_dir else None
+        # status and logs are sent in the background, jobs don't wait for the server
+        self.reporter = StatusReporter(self.client, worker_name, batch_size=report_batch_size,
+                                       max_backoff=report_max_backoff, max_pending=report_max_pending,
+                                       outbox=self.outbox, joblogs=self.joblogs)
+        self.counters = {'queued': 0, 'running': 0, 'rejected': 0, 'deferred': 0, 'completed': 0}
+        metrics.INSTANCES_PENDING.labels().set_function(lambda: self.counters['queued'])
+        metrics.EXECUTOR_CAPACITY.labels(EXECUTOR_PROCESS).set_function(lambda: self.process_executor.max_workers)
+
+    @classmethod
+    def from_config(cls, config:SchdConfig) -> 'RemoteScheduler':
+        return cls(
+            worker_name=config.worker_name,
+            remote_host=config.scheduler_remote_host,
+            conn_limit=config.scheduler_remote_conn_limit,
+            conn_limit_per_host=config.scheduler_remote_conn_limit_per_host,
+            log_stream=config.log_stream,
+            log_stream_chunk_size=config.log_stream_chunk_size,
+            log_stream_interval=config.log_stream_interval,
+            queues={name: queue.max_concurrency for name, queue in config.queues.items()},
+            max_inflight=config.worker_max_inflight,
+            max_pending=config.worker_max_pending,
+            overflow=config.worker_overflow,
+            process_pool_workers=config.process_pool_workers,
+            report_batch_size=config.status_report_batch_size,
+            report_max_backoff=config.status_report_max_backoff,
+            report_max_pending=config.status_report_max_pending,
+            data_dir=config.data_dir,
+            joblog_store=JoblogStore(config.joblog_dir, compression=config.joblog_compression,
+                                     retention_days=config.joblog_retention_days,
+                                     max_count=config.joblog_max_count, max_bytes=config.joblog_max_bytes),
+            reconnect_min=config.event_stream_reconnect_min,
+            reconnect_max=config.event_stream_reconnect_max,
+            reconnect_stable=config.event_stream_reconnect_stable,
+            register_concurrency=config.job_register_concurrency,
+        )
 
     async def init(self):
+        install_child_watcher()
         await self.client.register_worker(self._worker_name)
+        self.reporter.start()
+        self._cleanup_task = self._loop.create_task(self._cleanup_joblogs())
+
+    async def _cleanup_joblogs(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.joblogs.cleanup)
+            except Exception as ex:
+                logger.error('error in joblog cleanup, %s', ex, exc_info=ex)
+            await asyncio.sleep(self._joblog_cleanup_interval)
 
     async def add_job(self, job:Job, job_name:str, job_config:JobConfig):
-        cron = job_config.cron
+        await self.client.register_job(self._worker_name, job_name=job_name, cron=job_config.cron,
+                                       timezone=job_config.timezone, queue=job_config.queue)
+        self._add_local_job(job, job_name, job_config)
+
+    async def add_jobs(self, jobs:"List[Tuple[Job, str, JobConfig]]"):
+        """
+        add many jobs. they are registered in one bulk request, or concurrently when the server has
+        no bulk endpoint. jobs the server already has with the same definition are not registered again.
+        """
+        definitions = {job_name: job_definition(job_config.cron, job_config.timezone, job_config.queue)
+                       for _, job_name, job_config in jobs}
+        try:
+            server_jobs = await self.client.list_jobs(self._worker_name)
+        except aiohttp.ClientError as ex:
+            logger.info('cannot list jobs on server, registering all of them, %s', ex)
+            server_jobs = {}
+
+        changed = {}
+        for job_name, definition in definitions.items():
+            server_job = server_jobs.get(job_name)
+            if server_job is None or server_job.get('definition_hash', definition_hash(server_job)) != definition['definition_hash']:
+                changed[job_name] = definition
+        logger.info('registering %d jobs, %d unchanged on server.', len(changed), len(definitions) - len(changed))
+        await self._register_jobs(changed)
+
+        for job, job_name, job_config in jobs:
+            self._add_local_job(job, job_name, job_config)
+
+    async def _register_jobs(self, definitions:Dict[str, dict]):
+        if not definitions:
+            return
+        try:
+            await self.client.register_jobs(self._worker_name, definitions)
+            return
+        except aiohttp.ClientResponseError as ex:
+            if ex.status not in (404, 405):
+                raise
+            logger.info('server has no bulk job registration, registering one by one.')
+
+        semaphore = asyncio.Semaphore(self._register_concurrency)
+        async def register(job_name, definition):
+            async with semaphore:
+                await self.client.register_job(self._worker_name, job_name, definition['cron'],
+                                               timezone=definition.get('timezone'), queue=definition.get('queue'))
+        results = await asyncio.gather(*(register(job_name, definition) for job_name, definition in definitions.items()),
+                                       return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.error('%d of %d job registrations failed.', len(errors), len(definitions))
+            raise errors[0]
+
+    async def remove_job(self, job_name:str):
+        """
+        unregister a job, instances already received still run.
+        """
+        try:
+            await self.client.unregister_job(self._worker_name, job_name)
+        except aiohttp.ClientResponseError as ex:
+            if ex.status != 404:
+                raise
+            logger.info('job %s not on server.', job_name)
+        self._jobs.pop(job_name, None)
+        logger.info('job %s removed.', job_name)
+
+    def _add_local_job(self, job:Job, job_name:str, job_config:JobConfig):
         queue_name = job_config.queue or ''
-        await self.client.register_job(self._worker_name, job_name=job_name, cron=cron, timezone=job_config.timezone)
-        self._jobs[job_name] = (job, queue_name)
+        self._jobs[job_name] = (job, job_config)
         if queue_name not in self.queue_semaphores:
-            # each queue has a max concurrency of 1
-            max_conc = 1
-            self.queue_semaphores[queue_name] = asyncio.Semaphore(max_conc)
+            # queues not configured have a max concurrency of 1
+            max_conc = self._queue_capacities.get(queue_name, 1)
+            semaphore = self.queue_semaphores[queue_name] = WeightedSemaphore(max_conc)
+            for state in ('capacity', 'used', 'waiting'):
+                metrics.QUEUE_SLOTS.labels(queue_name, state).set_function(
+                    lambda semaphore=semaphore, state=state: getattr(semaphore, state))
+            logger.info('queue %r created with %d slots, worker total %d slots', queue_name, max_conc,
+                        self.queue_stats()['*']['capacity'])
+
+        semaphore = self.queue_semaphores[queue_name]
+        if job_config.slots > semaphore.capacity:
+            logger.warning('job %s takes %d slots, more than queue %r has, it will take the whole queue (%d).',
+                           job_name, job_config.slots, queue_name, semaphore.capacity)
+
+    def queue_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        capacity, used and waiting slots of each queue, worker totals under '*'.
+        """
+        return queue_stats(self.queue_semaphores)
 
     async def start_main_loop(self):
+        loop = asyncio.get_running_loop()
+        backoff = self._reconnect_backoff
+        connected_at = None
+
+        def connected():
+            nonlocal connected_at
+            connected_at = loop.time()
+
         while True:
-            logger.info('start subscribing events.')
+            logger.info('start subscribing events, last event id %s.', self._last_event_id)
+            connected_at = None
             try:
-                async for event in self.client.subscribe_worker_eventstream(self._worker_name):
-                    logger.info('got event, %s', event)
-                    job_name = event['data']['job_name']
-                    instance_id = event['data']['id']
-                    _, queue_name = self._jobs[job_name]
-                    # Queue concurrency control
-                    semaphore = self.queue_semaphores[queue_name]
-                    self._loop.create_task(self._run_with_semaphore(semaphore, job_name, instance_id))
-                    # await self.execute_task(event['data']['job_name'], event['data']['id'])
-            except aiohttp.client_exceptions.ClientPayloadError:
-                logger.info('connection lost')
-                await asyncio.sleep(1)
-            except aiohttp.client_exceptions.SocketTimeoutError:
-                logger.info('SocketTimeoutError')
-                await asyncio.sleep(1)
-            except aiohttp.client_exceptions.ClientConnectorError:
-                # cannot connect, try later
-                logger.debug('connect failed, ClientConnectorError, try later.')
-                await asyncio.sleep(10)
-                continue
-            except ConnectionResetError:
-                logger.info('connect failed, ConnectionResetError, try later.')
-                await asyncio.sleep(10)
-                continue
+                async for event in self.client.subscribe_worker_eventstream(self._worker_name,
+                                                                            last_event_id=self._last_event_id,
+                                                                            on_connected=connected):
+                    # the stream delivers, a later drop starts over from the first delay
+                    backoff.reset()
+                    await self.handle_event(event)
+                logger.info('event stream closed by server.')
+            except aiohttp.client_exceptions.ClientConnectorError as ex:
+                logger.debug('connect failed, %s', ex)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as ex:
+                logger.info('connection lost, %s: %s', type(ex).__name__, ex)
             except Exception as ex:
                 logger.error('error in start_main_loop, %s', ex, exc_info=ex)
                 break
 
+            if connected_at is not None and loop.time() - connected_at >= self._reconnect_stable:
+                backoff.reset()
+            delay = backoff.next_delay()
+            logger.info('reconnect in %.2fs.', delay)
+            await asyncio.sleep(delay)
+
+    async def handle_event(self, event:dict):
+        """
+        admit the instance of a NewJobInstance event, unless it was received before.
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('got event, %s', event)
+        job_name = event['data']['job_name']
+        instance_id = event['data']['id']
+        if self._seen_instances.add(instance_id):
+            await self.admit(job_name, instance_id)
+        else:
+            logger.info('job %s@%s received again, ignored.', job_name, instance_id)
+        if event.get('event_id') is not None:
+            self._last_event_id = event['event_id']
+
+    def _pending_full(self) -> bool:
+        return self._max_pending > 0 and self.counters['queued'] >= self._max_pending
+
+    async def admit(self, job_name:str, instance_id:int):
+        """
+        accept a new job instance, it is pending until it gets its queue slot and an in-flight permit.
+        when pending is full it waits for room, or reports the instance back to server per `overflow`.
+        errors are logged, a bad instance doesn't stop the event stream.
+        """
+        if job_name not in self._jobs:
+            logger.error('unknown job %s, instance %s ignored.', job_name, instance_id)
+            return
+
+        if self._pending_full():
+            status = OVERFLOW_STATUS[self._overflow]
+            if status is not None:
+                self.counters[status.lower()] += 1
+                logger.warning('pending queue full, job %s@%d %s', job_name, instance_id, status)
+                self.reporter.report(job_name, instance_id, status)
+                return
+
+            logger.info('pending queue full, pausing event stream.')
+            async with self._pending_room:
+                await self._pending_room.wait_for(lambda: not self._pending_full())
+
+        self.counters['queued'] += 1
+        task = self._loop.create_task(self._run_instance(job_name, instance_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        # let the instance take free slots before the next one is judged against the pending limit
+        await asyncio.sleep(0)
+
+    async def _run_instance(self, job_name:str, instance_id:int):
+        # the job as admitted, a reload changing or removing it meanwhile doesn't affect this instance
+        job, job_config = self._jobs[job_name]
+        # Queue concurrency control
+        queue_name = job_config.queue or ''
+        semaphore = self.queue_semaphores[queue_name]
+        dequeued = False
+        start = time.perf_counter()
+        try:
+            async with semaphore.slots(job_config.slots):
+                if self._inflight is not None:
+                    await self._inflight.acquire()
+                try:
+                    metrics.QUEUE_WAIT.labels(queue_name).observe(time.perf_counter() - start)
+                    await self._dequeued()
+                    dequeued = True
+                    await self._run_with_slots(semaphore, job_name, instance_id, job_config.slots, (job, job_config))
+                finally:
+                    if self._inflight is not None:
+                        self._inflight.release()
+        finally:
+            if not dequeued:
+                await self._dequeued()
+
+    async def _dequeued(self):
+        self.counters['queued'] -= 1
+        async with self._pending_room:
+            self._pending_room.notify()
+
+    def _task_done(self, task:asyncio.Task):
+        self._tasks.discard(task)
+        self.counters['completed'] += 1
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('error when running job instance, %s', task.exception(), exc_info=task.exception())
+
+    def admission_stats(self) -> Dict[str, int]:
+        """
+        instances pending and running now, totals of rejected, deferred and completed.
+        """
+        return dict(self.counters)
+
     def start(self):
         self._loop_task = self._loop.create_task(self.start_main_loop())
 
-    async def execute_task(self, job_name, instance_id:int):
-        job, _ = self._jobs[job_name]
-        logfile_dir = f'joblog/{instance_id}'
-        if not os.path.exists(logfile_dir):
-            os.makedirs(logfile_dir)
-        logfile_path = os.path.join(logfile_dir, 'output.txt')
-        output_stream = io.FileIO(logfile_path, mode='w+')
+    async def close(self):
+        for task in (self._loop_task, self._cleanup_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = None
+        self._cleanup_task = None
+
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.process_executor.shutdown()
+        await asyncio.get_running_loop().run_in_executor(None, pyrunner.stop)
+        await self.reporter.close()
+        if self.outbox is not None:
+            self.outbox.close()
+        await self.client.close()
+
+    async def execute_task(self, job_name, instance_id:int, job_entry:"Optional[Tuple[Job, JobConfig]]"=None):
+        job, job_config = job_entry if job_entry is not None else self._jobs[job_name]
+        logfile_path, output_stream = self.joblogs.open(instance_id)
         text_stream = io.TextIOWrapper(output_stream, encoding='utf-8')
+        content_encoding = self.joblogs.content_encoding
 
         context = JobContext(job_name=job_name, stdout=text_stream)
         logger.info('starting job %s@%d', job_name, instance_id)
-        await self.client.update_job_instance(self._worker_name, job_name, instance_id, status='RUNNING')
+        self.reporter.report(job_name, instance_id, 'RUNNING')
+        streamer = None
+        if self._log_stream:
+            streamer = JobLogStreamer(self.client, self._worker_name, job_name, instance_id, logfile_path,
+                                      content_encoding=content_encoding,
+                                      chunk_size=self._log_stream_chunk_size, interval=self._log_stream_interval)
+            streamer.start()
+        start = time.perf_counter()
         try:
-            def execute_job():
-                with redirect_stdout(text_stream):
-                    job_result = job.execute(context)
-                    return job_result
-            
-            loop = asyncio.get_running_loop()
-            job_result = await loop.run_in_executor(
-                None, execute_job
-            )
-
-            if job_result is None:
-                ret_code = 0
-            elif isinstance(job_result, int):
-                ret_code = job_result
-            elif hasattr(job_result, 'get_code'):
-                ret_code = job_result.get_code()
+            if isinstance(job, LazyJob) and job_config.executor != EXECUTOR_PROCESS:
+                # importing the job module may take a while, keep it off the loop
+                job = await asyncio.get_running_loop().run_in_executor(None, job.get)
+
+            if job_config.executor == EXECUTOR_PROCESS:
+                with metrics.track_running(EXECUTOR_PROCESS):
+                    job_result = await self.process_executor.execute_async(job_name, job_config, context)
+            elif is_async_job(job):
+                # awaited right here, no thread is taken while the job waits on I/O
+                with metrics.track_running('async'), capture_output(text_stream, context.stderr):
+                    job_result = await asyncio.wait_for(job.execute(context), job_config.timeout)
+            elif hasattr(job, 'execute_async'):
+                # subprocess jobs are awaited on the loop without holding an executor thread
+                with metrics.track_running('async'):
+                    job_result = await asyncio.wait_for(job.execute_async(context), job_config.timeout)
             else:
-                raise ValueError('unsupported result type: %s', job_result)
-            
+                def execute_job():
+                    with metrics.track_running(EXECUTOR_THREAD), capture_output(text_stream, context.stderr):
+                        job_result = job.execute(context)
+                        return job_result
+
+                loop = asyncio.get_running_loop()
+                job_result = await loop.run_in_executor(
+                    None, execute_job
+                )
+
+            ret_code = job_result_code(job_result)
+        except asyncio.TimeoutError:
+            logger.error('job %s@%d timed out after %ss, cancelled.', job_name, instance_id, job_config.timeout)
+            ret_code = -1
         except Exception as ex:
             logger.exception('error when executing job, %s', ex)
             ret_code = -1
+        except asyncio.CancelledError:
+            # close() cancelled it, the instance is still finished so it isn't left RUNNING on the server
+            logger.warning('job %s@%d cancelled, the worker is closing.', job_name, instance_id)
+            self._finish_instance(job_name, instance_id, -1, time.perf_counter() - start, logfile_path,
+                                  output_stream, text_stream, streamer)
+            raise
+
+        self._finish_instance(job_name, instance_id, ret_code, time.perf_counter() - start, logfile_path,
+                              output_stream, text_stream, streamer)
 
+    def _finish_instance(self, job_name:str, instance_id:int, ret_code:int, duration:float, logfile_path:str,
+                         output_stream:BinaryIO, text_stream:io.TextIOWrapper, streamer:"Optional[JobLogStreamer]"):
         logger.info('job %s execute complete: %d, log_file: %s', job_name, ret_code, logfile_path)
         text_stream.flush()
-        output_stream.flush()
-        output_stream.close()
-        await self.client.commit_job_log(self._worker_name, job_name, instance_id, logfile_path)
-        await self.client.update_job_instance(self._worker_name, job_name, instance_id, status='COMPLETED', ret_code=ret_code)
-
-    async def _run_with_semaphore(self, semaphore, job_name, instance_id):
-        async with semaphore:
-            await self.execute_task(job_name, instance_id)
+        metrics.record_run(job_name, ret_code, duration, self.joblogs.bytes_written(output_stream) or 0)
+        # closing the text stream also ends the compressed stream and the file
+        text_stream.close()
+        # the reporter commits the log before COMPLETED and releases it then, the queue slot is released right away
+        self.reporter.commit_log(job_name, instance_id, logfile_path, self.joblogs.content_encoding, streamer=streamer)
+        self.reporter.report(job_name, instance_id, 'COMPLETED', ret_code)
+
+    async def _run_with_slots(self, semaphore:WeightedSemaphore, job_name, instance_id, slots=1, job_entry=None):
+        stats = self.queue_stats()
+        logger.info('job %s@%d acquired %d slots, worker slots in use %d/%d', job_name, instance_id, slots,
+                    stats['*']['used'], stats['*']['capacity'])
+        self.counters['running'] += 1
+        try:
+            await self.execute_task(job_name, instance_id, job_entry)
+        finally:
+            self.counters['running'] -= 1
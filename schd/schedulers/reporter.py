@@ -0,0 +1,308 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+import os
+import sqlite3
+from typing import Deque, List, Optional, Set, Union
+import aiohttp
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+# client errors that are worth retrying, any other 4xx drops the report
+RETRY_STATUSES = (408, 429)
+
+
+@dataclass
+class StatusUpdate:
+    job_name: str
+    instance_id: int
+    status: str
+    ret_code: Optional[int] = None
+    # sequence number in the outbox
+    seq: Optional[int] = field(default=None, compare=False)
+
+    def to_dict(self) -> dict:
+        data = {'job_name': self.job_name, 'id': self.instance_id, 'status': self.status}
+        if self.ret_code is not None:
+            data['ret_code'] = self.ret_code
+        return data
+
+
+@dataclass
+class LogCommit:
+    job_name: str
+    instance_id: int
+    logfile_path: str
+    content_encoding: Optional[str] = None
+    # a running JobLogStreamer, closing it ships the tail and seals the log
+    streamer: object = None
+    seq: Optional[int] = field(default=None, compare=False)
+
+
+Report = Union[StatusUpdate, LogCommit]
+
+
+def _to_record(item:Report):
+    if isinstance(item, StatusUpdate):
+        return 'status', {'job_name': item.job_name, 'instance_id': item.instance_id,
+                          'status': item.status, 'ret_code': item.ret_code}
+    # a streamer doesn't survive a restart, the replay uploads the whole file
+    return 'log', {'job_name': item.job_name, 'instance_id': item.instance_id, 'logfile_path': item.logfile_path,
+                   'content_encoding': item.content_encoding}
+
+
+def _from_record(seq:int, kind:str, payload:dict) -> Report:
+    if kind == 'status':
+        return StatusUpdate(seq=seq, **payload)
+    return LogCommit(seq=seq, **payload)
+
+
+def _retryable(ex:Exception) -> bool:
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return ex.status >= 500 or ex.status in RETRY_STATUSES
+    if isinstance(ex, FileNotFoundError):
+        # log file removed while the report waited, retrying won't bring it back
+        return False
+    return isinstance(ex, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+class StatusReporter:
+    """
+    Sends job instance status and job logs to the server in the background.
+
+    Reports are kept in FIFO order. Status updates waiting together are sent in one bulk request,
+    falling back to one request per update when the server has no bulk endpoint.
+    Failed reports are retried with exponential backoff. The log of an instance is always committed
+    before a later status of that instance, so COMPLETED never arrives ahead of its log.
+    With an outbox the reports are stored until sent, the ones left at shutdown are sent after restart.
+    Log files waiting to be committed are held in `joblogs`, its cleanup doesn't remove them.
+    """
+    def __init__(self, client, worker_name:str, batch_size:int=100, linger:float=0.05,
+                 min_backoff:float=0.5, max_backoff:float=30, close_timeout:float=10,
+                 outbox:"Optional[Outbox]"=None, max_pending:int=100000, joblogs:"Optional[JoblogStore]"=None):
+        """
+        :param batch_size: max reports handled per round.
+        :param linger: seconds to wait for more reports before sending a round.
+        :param close_timeout: seconds close() waits for the remaining reports.
+        :param outbox: durable store of the reports not sent yet.
+        :param max_pending: max reports waiting to be sent, the oldest are dropped beyond it. 0 for no limit.
+        :param joblogs: store of the log files, a log is released once committed or given up.
+        """
+        self.client = client
+        self.worker_name = worker_name
+        self.batch_size = batch_size
+        self.linger = linger
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.close_timeout = close_timeout
+        self.outbox = outbox
+        self.max_pending = max_pending
+        self.joblogs = joblogs
+        self.bulk_supported = True
+        self.counters = {'sent': 0, 'requests': 0, 'retries': 0, 'dropped': 0}
+        self._queue:"Deque[Report]" = deque()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task:"Optional[asyncio.Task]" = None
+        if outbox is not None:
+            self._queue.extend(_from_record(*record) for record in outbox.load())
+            if joblogs is not None:
+                for item in self._queue:
+                    if isinstance(item, LogCommit):
+                        joblogs.hold(item.logfile_path)
+            if self._queue:
+                logger.info('%d reports restored from outbox %s', len(self._queue), outbox.path)
+                self._idle.clear()
+                self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def report(self, job_name:str, instance_id:int, status:str, ret_code:"Optional[int]"=None):
+        self._put(StatusUpdate(job_name, instance_id, status, ret_code))
+
+    def commit_log(self, job_name:str, instance_id:int, logfile_path:str, content_encoding:"Optional[str]"=None,
+                   streamer=None):
+        self._put(LogCommit(job_name, instance_id, os.path.abspath(logfile_path), content_encoding, streamer))
+
+    def _put(self, item:Report):
+        if self.max_pending > 0 and len(self._queue) >= self.max_pending:
+            dropped = self._queue.popleft()
+            self.counters['dropped'] += 1
+            logger.error('%d reports pending, dropped the oldest: %s', len(self._queue) + 1, dropped)
+            self._forget([dropped])
+
+        if self.outbox is not None:
+            try:
+                item.seq = self.outbox.append(*_to_record(item))
+            except sqlite3.Error as ex:
+                logger.error('failed to store report in outbox, %s', ex, exc_info=ex)
+        self._queue.append(item)
+        self._idle.clear()
+        self._wakeup.set()
+
+    def _forget(self, items:List[Report]):
+        """
+        done with reports, sent or given up.
+        """
+        if self.joblogs is not None:
+            for item in items:
+                if isinstance(item, LogCommit):
+                    self.joblogs.release(item.logfile_path)
+        if self.outbox is None:
+            return
+        try:
+            self.outbox.delete(item.seq for item in items if item.seq is not None)
+        except sqlite3.Error as ex:
+            logger.error('failed to delete reports from outbox, %s', ex, exc_info=ex)
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    async def _run(self):
+        backoff = self.min_backoff
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                if self.outbox is not None:
+                    await self._compact()
+                # reports put while compacting set the wakeup again
+                if not self._queue:
+                    self._idle.set()
+                await self._wakeup.wait()
+                # let reports of other instances pile up, they go out in the same request
+                await asyncio.sleep(self.linger)
+
+            try:
+                sent = await self.send_round()
+            except Exception as ex:
+                # keep reporting, a bug in one round must not stop the reporter
+                logger.error('error in status reporter, %s', ex, exc_info=ex)
+                sent = False
+            if sent:
+                backoff = self.min_backoff
+            else:
+                self.counters['retries'] += 1
+                logger.warning('status report failed, %d pending, retry in %.1fs', len(self._queue), backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _compact(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.outbox.compact)
+        except sqlite3.Error as ex:
+            logger.error('failed to compact outbox, %s', ex, exc_info=ex)
+
+    async def send_round(self) -> bool:
+        """
+        send up to batch_size reports from the head of the queue, returns False if some must be retried.
+        """
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        logs = [item for item in batch if isinstance(item, LogCommit)]
+        results = await asyncio.gather(*(self._commit_log(item) for item in logs))
+        failed_logs = {(item.job_name, item.instance_id) for item, ok in zip(logs, results) if not ok}
+
+        updates = [item for item in batch
+                   if isinstance(item, StatusUpdate) and (item.job_name, item.instance_id) not in failed_logs]
+        failed_updates = await self._send_updates(updates)
+
+        retry = [item for item in batch
+                 if (isinstance(item, LogCommit) and (item.job_name, item.instance_id) in failed_logs)
+                 or (isinstance(item, StatusUpdate) and ((item.job_name, item.instance_id) in failed_logs
+                                                         or id(item) in failed_updates))]
+        self.counters['sent'] += len(batch) - len(retry)
+        retry_ids = {id(item) for item in retry}
+        self._forget([item for item in batch if id(item) not in retry_ids])
+        # back to the head in the original order
+        self._queue.extendleft(reversed(retry))
+        return not retry
+
+    async def _commit_log(self, item:LogCommit) -> bool:
+        try:
+            self.counters['requests'] += 1
+            if item.streamer is not None:
+                # it falls back to a full upload by itself. when that failed too, the log is retried
+                # with backoff as a plain commit, whose errors tell whether retrying is worth it
+                streamer, item.streamer = item.streamer, None
+                if not await streamer.close():
+                    logger.debug('failed to send streamed log of %s@%d', item.job_name, item.instance_id)
+                    return False
+            else:
+                await self.client.commit_job_log(self.worker_name, item.job_name, item.instance_id, item.logfile_path,
+                                                 content_encoding=item.content_encoding)
+            return True
+        except Exception as ex:
+            return not self._should_retry(ex, 'log of %s@%d' % (item.job_name, item.instance_id))
+
+    async def _send_updates(self, updates:List[StatusUpdate]) -> "Set[int]":
+        """
+        returns ids of the updates to retry.
+        """
+        if not updates:
+            return set()
+
+        if self.bulk_supported and len(updates) > 1:
+            try:
+                self.counters['requests'] += 1
+                await self.client.update_job_instances(self.worker_name, [update.to_dict() for update in updates])
+                return set()
+            except aiohttp.ClientResponseError as ex:
+                if ex.status not in (404, 405):
+                    return {id(update) for update in updates} if self._should_retry(ex, 'bulk status') else set()
+                logger.info('server has no bulk status endpoint, reporting status one by one.')
+                self.bulk_supported = False
+            except Exception as ex:
+                return {id(update) for update in updates} if self._should_retry(ex, 'bulk status') else set()
+
+        failed = set()
+        for update in updates:
+            # updates of an instance stay in order, later ones wait for the failed one
+            if failed and any(update.instance_id == other.instance_id for other in updates if id(other) in failed):
+                failed.add(id(update))
+                continue
+            try:
+                self.counters['requests'] += 1
+                await self.client.update_job_instance(self.worker_name, update.job_name, update.instance_id,
+                                                      status=update.status, ret_code=update.ret_code)
+            except Exception as ex:
+                if self._should_retry(ex, 'status %s of %s@%d' % (update.status, update.job_name, update.instance_id)):
+                    failed.add(id(update))
+        return failed
+
+    def _should_retry(self, ex:Exception, what:str) -> bool:
+        if _retryable(ex):
+            logger.debug('failed to send %s, %s', what, ex)
+            return True
+        self.counters['dropped'] += 1
+        logger.error('failed to send %s, dropped, %s', what, ex, exc_info=ex)
+        return False
+
+    async def flush(self, timeout:"Optional[float]"=None) -> bool:
+        """
+        wait until every report is sent, returns False on timeout.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        """
+        send what is left within close_timeout, then stop.
+        """
+        if self._task is not None:
+            if not await self.flush(self.close_timeout):
+                logger.error('status reporter closed with %d reports not sent.', len(self._queue))
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,352 @@
+"""
+in-process stand-in for schd-server.
+
+Implements the endpoints RemoteApiClient talks to with in-memory state,
+used by tests and benchmarks to exercise the remote worker protocol without a real server.
+Run on its own for a worker to connect to, job instances are created through /standin/ routes:
+
+    python -m schd.standin --port 8899
+    curl -X POST localhost:8899/standin/workers/w1/jobs/ls/instances?count=10
+    curl localhost:8899/standin/stats
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class StandinServer:
+    def __init__(self):
+        self.workers:Dict[str, Dict[str, Any]] = {}
+        self.jobs:Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.instances:Dict[int, Dict[str, Any]] = {}
+        self.logs:Dict[int, bytes] = {}
+        self.sealed_logs:Dict[int, int] = {}
+        # Content-Encoding of the stored logs, None for plain text
+        self.log_encodings:Dict[int, Optional[str]] = {}
+        self.triggers:List[Dict[str, Any]] = []
+        self.request_count = 0
+        # answer the next requests with 503, to exercise retries
+        self.fail_requests = 0
+        # serve the bulk status endpoint, off to behave like an older server
+        self.bulk_status = True
+        self.bulk_requests = 0
+        # serve the bulk job registration endpoint
+        self.bulk_register = True
+        self.job_registrations = 0
+        # seconds added to every response, like a remote server
+        self.latency = 0
+        # events of each worker, kept for replay, and how many of them were written to a stream
+        self.events:Dict[str, List[Dict[str, Any]]] = {}
+        self._delivered:Dict[str, int] = {}
+        self._event_seq = 0
+        self._wakeups:"Dict[str, Set[asyncio.Event]]" = {}
+        # (worker, Last-Event-ID, loop time) of each event stream connection
+        self.stream_connects:List[tuple] = []
+        # write the pending events of a stream as one JSON array per line
+        self.batch_events = False
+        self._streams:"Set[asyncio.Task]" = set()
+        # close the next event streams right after accepting them, like a flapping server
+        self.close_streams = 0
+        # seconds from new_job_instance() to the COMPLETED status of each instance, in completion order
+        self.completion_latencies:List[float] = []
+        self._created_at:Dict[int, float] = {}
+        self._next_instance_id = 1
+        # log bytes received by the upload endpoints, and when the first and last of them arrived
+        self.log_bytes = 0
+        self.log_window:"Optional[List[float]]" = None
+        self._runner:"Optional[web.AppRunner]" = None
+        self.port:"Optional[int]" = None
+        self.app = self.build_app()
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._count_middleware])
+        app.router.add_put('/api/workers/{worker}', self.handle_register_worker)
+        app.router.add_get('/api/workers/{worker}/eventstream', self.handle_eventstream)
+        app.router.add_put('/api/workers/{worker}/instances', self.handle_update_instances)
+        app.router.add_get('/api/workers/{worker}/jobs', self.handle_list_jobs)
+        app.router.add_put('/api/workers/{worker}/jobs', self.handle_register_jobs)
+        app.router.add_put('/api/workers/{worker}/jobs/{job}', self.handle_register_job)
+        app.router.add_delete('/api/workers/{worker}/jobs/{job}', self.handle_unregister_job)
+        app.router.add_post('/api/workers/{worker}/jobs/{job}/triggers', self.handle_add_trigger)
+        app.router.add_put('/api/workers/{worker}/jobs/{job}/{instance_id}', self.handle_update_instance)
+        app.router.add_put('/api/workers/{worker}/jobs/{job}/{instance_id}/log', self.handle_commit_log)
+        app.router.add_get('/api/workers/{worker}/jobs/{job}/{instance_id}/log/chunks', self.handle_log_offset)
+        app.router.add_put('/api/workers/{worker}/jobs/{job}/{instance_id}/log/chunks', self.handle_append_log)
+        app.router.add_put('/api/workers/{worker}/jobs/{job}/{instance_id}/log/seal', self.handle_seal_log)
+        # not part of schd-server, drive the stand-in when it runs in its own process
+        app.router.add_post('/standin/workers/{worker}/jobs/{job}/instances', self.handle_new_instances)
+        app.router.add_get('/standin/stats', self.handle_stats)
+        return app
+
+    @web.middleware
+    async def _count_middleware(self, request, handler):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_requests > 0:
+            self.fail_requests -= 1
+            return web.json_response({'error': 'unavailable'}, status=503)
+        return await handler(request)
+
+    async def start(self, host='127.0.0.1', port=0) -> str:
+        """
+        start serving, returns the base url.
+        """
+        # compressed logs are stored as sent
+        self._runner = web.AppRunner(self.app, auto_decompress=False)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return f'http://{host}:{self.port}/'
+
+    async def stop(self):
+        # event streams never end by themselves, cancel them or cleanup waits for them
+        await self.drop_streams()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def push_event(self, worker_name:str, event:Dict[str, Any]):
+        self._event_seq += 1
+        self.events.setdefault(worker_name, []).append(dict(event, event_id=self._event_seq))
+        for wakeup in self._wakeups.get(worker_name, ()):
+            wakeup.set()
+
+    async def drop_streams(self):
+        """
+        close the open event streams, like a server going away.
+        """
+        tasks = list(self._streams)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def new_job_instance(self, worker_name:str, job_name:str, instance_id:"Optional[int]"=None) -> int:
+        """
+        create an instance and send its event to the worker, without an id the next free one is taken.
+        """
+        if instance_id is None:
+            instance_id = self._next_instance_id
+        self._next_instance_id = max(self._next_instance_id, instance_id + 1)
+        self.instances[instance_id] = {'worker_name': worker_name, 'job_name': job_name, 'status': 'SCHEDULED'}
+        self._created_at[instance_id] = time.perf_counter()
+        self.push_event(worker_name, {'event_type': 'NewJobInstance',
+                                      'data': {'id': instance_id, 'job_name': job_name}})
+        return instance_id
+
+    def _status_updated(self, instance_id:int, status:"Optional[str]"):
+        if status == 'COMPLETED':
+            created_at = self._created_at.pop(instance_id, None)
+            if created_at is not None:
+                self.completion_latencies.append(time.perf_counter() - created_at)
+
+    def _log_received(self, size:int):
+        now = time.perf_counter()
+        if self.log_window is None:
+            self.log_window = [now, now]
+        self.log_window[1] = now
+        self.log_bytes += size
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        counts of the run so far, completion latencies as percentiles in seconds.
+        """
+        latencies = sorted(self.completion_latencies)
+        percentiles = {}
+        if latencies:
+            for p in (50, 90, 99, 100):
+                percentiles[f'p{p}'] = latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+        return {
+            'instances': len(self.instances),
+            'completed': len(latencies),
+            'completion_latency': percentiles,
+            'log_bytes': self.log_bytes,
+            'log_seconds': self.log_window[1] - self.log_window[0] if self.log_window else 0,
+            'requests': self.request_count,
+        }
+
+    async def handle_register_worker(self, request:web.Request):
+        worker_name = request.match_info['worker']
+        self.workers[worker_name] = {'name': worker_name}
+        self.jobs.setdefault(worker_name, {})
+        return web.json_response(self.workers[worker_name])
+
+    async def handle_register_job(self, request:web.Request):
+        worker_name = request.match_info['worker']
+        job_name = request.match_info['job']
+        data = await request.json()
+        self.jobs.setdefault(worker_name, {})[job_name] = data
+        self.job_registrations += 1
+        return web.json_response(data)
+
+    async def handle_unregister_job(self, request:web.Request):
+        jobs = self.jobs.get(request.match_info['worker'], {})
+        if jobs.pop(request.match_info['job'], None) is None:
+            raise web.HTTPNotFound()
+        return web.json_response({})
+
+    async def handle_list_jobs(self, request:web.Request):
+        jobs = self.jobs.get(request.match_info['worker'], {})
+        return web.json_response({'jobs': [dict(data, job_name=job_name) for job_name, data in jobs.items()]})
+
+    async def handle_register_jobs(self, request:web.Request):
+        if not self.bulk_register:
+            raise web.HTTPMethodNotAllowed('PUT', ['GET'])
+        worker_jobs = self.jobs.setdefault(request.match_info['worker'], {})
+        data = await request.json()
+        for job in data['jobs']:
+            job = dict(job)
+            worker_jobs[job.pop('job_name')] = job
+        self.job_registrations += len(data['jobs'])
+        return web.json_response({'registered': len(data['jobs'])})
+
+    async def handle_eventstream(self, request:web.Request):
+        """
+        streams the events after Last-Event-ID, or the ones not written to any stream yet.
+        """
+        worker_name = request.match_info['worker']
+        last_event_id = request.headers.get('Last-Event-ID')
+        self.stream_connects.append((worker_name, last_event_id, asyncio.get_running_loop().time()))
+        events = self.events.setdefault(worker_name, [])
+        if last_event_id is not None:
+            cursor = bisect.bisect_right([event['event_id'] for event in events], int(last_event_id))
+        else:
+            cursor = self._delivered.get(worker_name, 0)
+
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        if self.close_streams > 0:
+            self.close_streams -= 1
+            return resp
+        task = asyncio.current_task()
+        wakeup = asyncio.Event()
+        self._streams.add(task)
+        self._wakeups.setdefault(worker_name, set()).add(wakeup)
+        try:
+            while True:
+                wakeup.clear()
+                while cursor < len(events):
+                    if self.batch_events:
+                        batch = events[cursor:]
+                        await resp.write(json.dumps(batch).encode('utf-8') + b'\n')
+                    else:
+                        batch = events[cursor:cursor + 1]
+                        await resp.write(json.dumps(batch[0]).encode('utf-8') + b'\n')
+                    cursor += len(batch)
+                    self._delivered[worker_name] = max(self._delivered.get(worker_name, 0), cursor)
+                await wakeup.wait()
+        finally:
+            self._streams.discard(task)
+            self._wakeups[worker_name].discard(wakeup)
+
+    async def handle_update_instance(self, request:web.Request):
+        instance_id = int(request.match_info['instance_id'])
+        data = await request.json()
+        instance = self.instances.setdefault(instance_id, {'worker_name': request.match_info['worker'],
+                                                           'job_name': request.match_info['job']})
+        instance.update(data)
+        self._status_updated(instance_id, data.get('status'))
+        return web.json_response(instance)
+
+    async def handle_update_instances(self, request:web.Request):
+        if not self.bulk_status:
+            raise web.HTTPNotFound()
+        self.bulk_requests += 1
+        data = await request.json()
+        for update in data['updates']:
+            update = dict(update)
+            instance_id = update.pop('id')
+            instance = self.instances.setdefault(instance_id, {'worker_name': request.match_info['worker'],
+                                                               'job_name': update['job_name']})
+            instance.update(update)
+            self._status_updated(instance_id, update.get('status'))
+        return web.json_response({'updated': len(data['updates'])})
+
+    async def handle_commit_log(self, request:web.Request):
+        instance_id = int(request.match_info['instance_id'])
+        if request.content_type.startswith('multipart/'):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == 'logfile':
+                    self.logs[instance_id] = await part.read()
+            self.log_encodings[instance_id] = None
+        else:
+            self.logs[instance_id] = await request.read()
+            self.log_encodings[instance_id] = request.headers.get('Content-Encoding')
+        self._log_received(len(self.logs.get(instance_id, b'')))
+        return web.json_response({'size': len(self.logs.get(instance_id, b''))})
+
+    async def handle_log_offset(self, request:web.Request):
+        instance_id = int(request.match_info['instance_id'])
+        return web.json_response({'offset': len(self.logs.get(instance_id, b''))})
+
+    async def handle_append_log(self, request:web.Request):
+        instance_id = int(request.match_info['instance_id'])
+        offset = int(request.query['offset'])
+        stored = self.logs.get(instance_id, b'')
+        if offset > len(stored):
+            return web.json_response({'offset': len(stored)}, status=409)
+        # chunks overlapping what is already stored are re-sent after a reconnect, keep the new bytes.
+        chunk = await request.read()
+        self.logs[instance_id] = stored[:offset] + chunk
+        self._log_received(len(chunk))
+        return web.json_response({'offset': len(self.logs[instance_id])})
+
+    async def handle_seal_log(self, request:web.Request):
+        instance_id = int(request.match_info['instance_id'])
+        data = await request.json()
+        self.sealed_logs[instance_id] = data['size']
+        self.log_encodings[instance_id] = data.get('content_encoding')
+        return web.json_response({'offset': len(self.logs.get(instance_id, b''))})
+
+    async def handle_add_trigger(self, request:web.Request):
+        data = await request.json()
+        data['worker_name'] = request.match_info['worker']
+        data['job_name'] = request.match_info['job']
+        self.triggers.append(data)
+        return web.json_response(data)
+
+    async def handle_new_instances(self, request:web.Request):
+        worker_name = request.match_info['worker']
+        job_name = request.match_info['job']
+        count = int(request.query.get('count', 1))
+        ids = [self.new_job_instance(worker_name, job_name) for _ in range(count)]
+        return web.json_response({'ids': ids})
+
+    async def handle_stats(self, request:web.Request):
+        return web.json_response(self.stats())
+
+
+async def serve(host:str, port:int):
+    server = StandinServer()
+    base_url = await server.start(host, port)
+    logger.info('schd-server stand-in listening on %s', base_url)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='in-memory stand-in for schd-server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
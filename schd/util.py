@@ -1,4 +1,9 @@
-from typing import Union
+import asyncio
+from collections import OrderedDict
+import os
+import random
+import sys
+from typing import Hashable, Union
 
 def ensure_bool(s: Union[bool, int, float, str]) -> bool:
     if isinstance(s, bool):
@@ -15,3 +20,69 @@ def ensure_bool(s: Union[bool, int, float, str]) -> bool:
             return False
         raise ValueError(f"Cannot convert string '{s}' to bool")
     raise TypeError(f"Unsupported type: {type(s)}")
+
+
+def install_child_watcher():
+    """
+    Before Python 3.12 asyncio waits for each subprocess in a dedicated thread,
+    switch to a pidfd based watcher where the kernel supports it, so waiting costs no thread.
+    Must be called with the event loop running.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return
+
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.set_child_watcher(watcher)
+
+
+class Backoff:
+    """
+    exponential backoff with full jitter: the n-th delay is uniform in [0, min(cap, base * 2**n)],
+    so clients failing at the same moment don't retry in lockstep.
+    """
+    def __init__(self, base:float=0.5, cap:float=60):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        # stop growing the exponent once the cap is reached
+        if self.base * 2 ** self.attempt < self.cap:
+            self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class LRUSet:
+    """
+    set remembering the `maxsize` most recently added keys.
+    """
+    def __init__(self, maxsize:int):
+        self.maxsize = maxsize
+        self._keys:"OrderedDict[Hashable, None]" = OrderedDict()
+
+    def add(self, key:Hashable) -> bool:
+        """
+        add the key, returns False if it was already there.
+        """
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return True
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
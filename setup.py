@@ -11,6 +11,9 @@ setup(
     url="https://github.com/kevenli/schd",
     packages=find_packages(exclude=('tests', 'tests.*')),
     install_requires=['apscheduler<4.0', 'pyaml', 'aiohttp'],
+    extras_require={
+        'speedups': ['orjson'],
+    },
     entry_points={
         'console_scripts': [
             'schd = schd.cmds.schd:main',
@@ -0,0 +1,12 @@
+builds = 0
+
+
+class CountingJob:
+    def __init__(self, greeting='hello'):
+        global builds
+        builds += 1
+        self.greeting = greeting
+
+    def execute(self, context):
+        print(self.greeting)
+        return 0
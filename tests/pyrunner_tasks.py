@@ -0,0 +1,20 @@
+import os
+import signal
+import sys
+import time
+
+
+def hello(name, code=0):
+    print('hello', name)
+    print('warn', file=sys.stderr)
+    return code
+
+
+def fail():
+    raise RuntimeError('boom')
+
+
+def interrupted():
+    os.kill(os.getpid(), signal.SIGINT)
+    time.sleep(5)
+    return 0
@@ -0,0 +1,158 @@
+"""
+in-process SMTP stand-in, like the old smtpd debugging server.
+
+Accepts mail from smtplib in a background thread and keeps it in memory, used by tests to exercise
+alert delivery without a mail server. Speaks EHLO/HELO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP
+and QUIT, no STARTTLS.
+"""
+import base64
+from dataclasses import dataclass
+import email
+from email.message import Message
+import email.policy
+import logging
+import socketserver
+import threading
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReceivedMail:
+    mail_from: str
+    rcpt_tos: List[str]
+    message: Message
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def reply(self, line:str):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        standin = self.server.standin
+        with standin._lock:
+            standin.connections += 1
+        mail_from = None
+        rcpt_tos:List[str] = []
+        self.reply('220 standin ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.reply('250-standin')
+                self.reply('250-AUTH PLAIN')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO':
+                self.reply('250 standin')
+            elif command == 'AUTH':
+                mechanism, _, initial = arg.partition(' ')
+                if mechanism.upper() != 'PLAIN':
+                    self.reply('504 unsupported mechanism')
+                    continue
+                if not initial:
+                    self.reply('334 ')
+                    initial = self.rfile.readline().decode('ascii').strip()
+                _, user, password = base64.b64decode(initial).decode('utf-8').split('\0')
+                with standin._lock:
+                    standin.logins.append((user, password))
+                self.reply('235 authenticated')
+            elif command == 'MAIL':
+                mail_from = arg.partition(':')[2].split()[0].strip('<>') if ':' in arg else ''
+                rcpt_tos = []
+                self.reply('250 ok')
+            elif command == 'RCPT':
+                rcpt_tos.append(arg.partition(':')[2].strip().strip('<>'))
+                self.reply('250 ok')
+            elif command == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    # a leading dot was doubled by the client, the message is kept with \n line ends
+                    if data.startswith(b'..'):
+                        data = data[1:]
+                    lines.append(data.rstrip(b'\r\n') + b'\n')
+                if standin.delay:
+                    time.sleep(standin.delay)
+                with standin._lock:
+                    if standin.fail_messages > 0:
+                        standin.fail_messages -= 1
+                        self.reply('451 try again later')
+                        continue
+                    standin.messages.append(ReceivedMail(
+                        mail_from, rcpt_tos, email.message_from_bytes(b''.join(lines), policy=email.policy.default)))
+                    drop = standin.drop_after is not None and len(standin.messages) >= standin.drop_after
+                    if drop:
+                        standin.drop_after = None
+                self.reply('250 queued')
+                if drop:
+                    # like a server closing an idle or overloaded connection
+                    return
+            elif command == 'RSET':
+                mail_from, rcpt_tos = None, []
+                self.reply('250 ok')
+            elif command == 'NOOP':
+                self.reply('250 ok')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 command not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    standin: "SmtpStandin"
+
+
+class SmtpStandin:
+    def __init__(self):
+        self.messages:List[ReceivedMail] = []
+        self.logins:List[Tuple[str, str]] = []
+        self.connections = 0
+        # answer the next DATA commands with 451
+        self.fail_messages = 0
+        # close the connection once this many messages were received in total
+        self.drop_after:Optional[int] = None
+        # seconds each message takes, like a slow server
+        self.delay = 0.0
+        self._lock = threading.Lock()
+        self._server:"Optional[_Server]" = None
+        self._thread:"Optional[threading.Thread]" = None
+
+    def start(self, host:str='127.0.0.1', port:int=0) -> Tuple[str, int]:
+        """
+        start serving in a thread, returns the address.
+        """
+        self._server = _Server((host, port), _SmtpHandler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-standin', daemon=True)
+        self._thread.start()
+        return self._server.server_address[:2]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def wait_for(self, count:int, timeout:float=5) -> bool:
+        """
+        wait until `count` messages were received.
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.messages) < count:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
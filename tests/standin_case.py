@@ -0,0 +1,51 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from schd.schedulers.remote import RemoteScheduler
+from schd.standin import StandinServer
+
+
+class StandinTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    each test gets a fresh stand-in server and runs in a temporary working directory,
+    where job logs and outboxes are written. schedulers made by new_scheduler are closed after it.
+    """
+    async def asyncSetUp(self):
+        self.server = StandinServer()
+        self.base_url = await self.server.start()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tempdir.name)
+        self.schedulers = []
+
+    async def asyncTearDown(self):
+        await self.close_schedulers()
+        os.chdir(self.cwd)
+        await self.server.stop()
+        self.tempdir.cleanup()
+
+    def path(self, name:str) -> str:
+        return os.path.join(self.tempdir.name, name)
+
+    async def new_scheduler(self, worker_name:str='w1', init:bool=True, **kwargs) -> RemoteScheduler:
+        scheduler = RemoteScheduler(worker_name, self.base_url, **kwargs)
+        self.schedulers.append(scheduler)
+        if init:
+            await scheduler.init()
+        return scheduler
+
+    async def close_schedulers(self):
+        """
+        close the schedulers, the reports they still had are sent.
+        """
+        schedulers, self.schedulers = self.schedulers, []
+        for scheduler in schedulers:
+            await scheduler.close()
+
+    async def wait_for(self, predicate, timeout:float=10):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                self.fail('condition not met')
+            await asyncio.sleep(0.01)
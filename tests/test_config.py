@@ -1,5 +1,7 @@
+import os
 import unittest
-from schd.config import SchdConfig, JobConfig
+from unittest import mock
+from schd.config import ConfigValue, SchdConfig, JobConfig
 
 class TestSchdConfig(unittest.TestCase):
     def setUp(self):
@@ -26,4 +28,36 @@ class TestSchdConfig(unittest.TestCase):
 
     def test_attribute_access_still_works(self):
         self.assertEqual(self.config.scheduler_cls, "RemoteScheduler")
-        self.assertEqual(self.config.worker_name, "remote_worker")
\ No newline at end of file
+        self.assertEqual(self.config.worker_name, "remote_worker")
+
+
+class TestQueuesConfig(unittest.TestCase):
+    def test_queues(self):
+        config = SchdConfig.from_dict({
+            'queues': {'etl': {'max_concurrency': 8}},
+            'jobs': {'big': {'class': 'CommandJob', 'cron': '* * * * *', 'queue': 'etl', 'slots': 4}},
+        })
+        self.assertEqual(config.queues['etl'].max_concurrency, 8)
+        self.assertEqual(config.jobs['big'].slots, 4)
+        self.assertEqual(SchdConfig.from_dict({}).queues, {})
+
+
+class TestFromDict(unittest.TestCase):
+    def test_env_var_still_overrides(self):
+        with mock.patch.dict(os.environ, {'SCHD_WORKER_NAME': 'b', 'SCHD_SMTP_PORT': '2525'}):
+            config = SchdConfig.from_dict({'worker_name': 'a', 'email': {'smtp_port': 25}})
+        self.assertEqual(config.worker_name, 'b')
+        self.assertEqual(config.email.smtp_port, 2525)
+
+    def test_many_jobs(self):
+        config = SchdConfig.from_dict({'jobs': {
+            f'job{i}': {'class': 'CommandJob', 'cron': '* * * * *', 'params': {'cmd': f'echo {i}'}} for i in range(100)}})
+        self.assertEqual(len(config.jobs), 100)
+        self.assertIsInstance(config.jobs['job99'], JobConfig)
+        self.assertEqual(config.jobs['job99'].params, {'cmd': 'echo 99'})
+
+    def test_not_dataclass(self):
+        class NotDataclass(ConfigValue):
+            pass
+        with self.assertRaises(TypeError):
+            NotDataclass.from_dict({})
@@ -0,0 +1,139 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from apscheduler.triggers.cron import CronTrigger
+from schd.config import SchdConfig
+from schd.cron import CronEngine, compile_cron
+from schd.scheduler import LocalScheduler
+
+
+class StubExecutor:
+    def __init__(self, run=True):
+        self.run = run
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        if self.run:
+            fn(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class CronScheduleTest(unittest.TestCase):
+    def test_next_after(self):
+        start = datetime(2025, 3, 5, 10, 7, 30)
+        self.assertEqual(compile_cron('* * * * *').next_after(start), datetime(2025, 3, 5, 10, 8))
+        self.assertEqual(compile_cron('*/15 * * * *').next_after(start), datetime(2025, 3, 5, 10, 15))
+        self.assertEqual(compile_cron('0 9 * * mon-fri').next_after(start), datetime(2025, 3, 6, 9, 0))
+        self.assertEqual(compile_cron('30 2 1 jan,jul *').next_after(start), datetime(2025, 7, 1, 2, 30))
+        self.assertEqual(compile_cron('0 0 29 2 *').next_after(start), datetime(2028, 2, 29))
+        self.assertIsNone(compile_cron('0 0 31 2 *').next_after(start))
+
+    def test_same_as_apscheduler(self):
+        start = datetime(2025, 12, 31, 23, 58, 10)
+        for expr in ['* * * * *', '5/10 * * * *', '0 */6 * * *', '15 3 * * 0', '0 0 1-7 * 4', '0 12 * 2-11/3 *',
+                     '1,2,3 4-5 6 7 *', '59 23 31 12 *', '0 0 * * sat,sun']:
+            trigger = CronTrigger.from_crontab(expr, timezone=timezone.utc)
+            t = start
+            for _ in range(5):
+                expected = trigger.get_next_fire_time(
+                    None, (t + timedelta(minutes=1)).replace(second=0, tzinfo=timezone.utc)).replace(tzinfo=None)
+                t = compile_cron(expr).next_after(t)
+                self.assertEqual(t, expected, expr)
+
+    def test_shared(self):
+        self.assertIs(compile_cron('0 * * * *'), compile_cron(' 0  * * *  * '))
+
+    def test_invalid(self):
+        for expr in ['* * * *', '60 * * * *', '* 5-1 * * *', '*/0 * * * *', '* * * * 7', '* * * foo *']:
+            with self.assertRaises(ValueError, msg=expr):
+                compile_cron(expr)
+
+
+class CronEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2025, 3, 5, 10, 7, 30).timestamp()
+        self.executor = StubExecutor()
+        self.engine = CronEngine(self.executor, clock=lambda: self.now)
+        self.runs = []
+
+    def add(self, job_id, expr):
+        self.engine.add_job(self.record, compile_cron(expr), kwargs={'job_name': job_id}, id=job_id,
+                            replace_existing=True)
+
+    def record(self, job_name):
+        self.runs.append(job_name)
+
+    def test_run_pending(self):
+        self.add('a', '* * * * *')
+        self.add('b', '* * * * *')
+        self.add('c', '0 * * * *')
+        self.assertEqual(self.engine.run_pending(self.now), 0)
+        self.assertEqual(self.engine.get_next_fire_time('a'), datetime(2025, 3, 5, 10, 8))
+        # identical expressions share one heap entry
+        self.assertEqual(len(self.engine._heap), 2)
+
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 10, 8, 0, 200000).timestamp()), 2)
+        self.assertEqual(sorted(self.runs), ['a', 'b'])
+        self.assertEqual(self.engine.get_next_fire_time('a'), datetime(2025, 3, 5, 10, 9))
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 11, 0, 0, 500000).timestamp()), 1)
+        self.assertEqual(self.runs[-1], 'c')
+
+    def test_submitted_event(self):
+        events = []
+        self.engine.add_listener(events.append)
+        self.add('a', '* * * * *')
+        self.engine.run_pending(datetime(2025, 3, 5, 10, 8, 0, 200000).timestamp())
+        self.assertEqual([(event.job_id, event.scheduled_run_times) for event in events],
+                         [('a', [datetime(2025, 3, 5, 10, 8)])])
+
+    def test_misfire_skipped(self):
+        self.add('a', '* * * * *')
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 10, 8, 5).timestamp()), 0)
+        self.assertEqual(self.engine.get_next_fire_time('a'), datetime(2025, 3, 5, 10, 9))
+
+    def test_replace_remove(self):
+        self.add('a', '* * * * *')
+        self.add('a', '0 * * * *')
+        self.assertEqual(len(self.engine), 1)
+        self.assertEqual(self.engine.get_next_fire_time('a'), datetime(2025, 3, 5, 11, 0))
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 10, 8).timestamp()), 0)
+        with self.assertRaises(ValueError):
+            self.engine.add_job(self.record, compile_cron('* * * * *'), id='a')
+        self.engine.remove_job('a')
+        with self.assertRaises(KeyError):
+            self.engine.remove_job('a')
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 11, 0).timestamp()), 0)
+
+    def test_one_instance(self):
+        self.executor.run = False
+        self.add('a', '* * * * *')
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 10, 8).timestamp()), 1)
+        # the first run hasn't finished
+        self.assertEqual(self.engine.run_pending(datetime(2025, 3, 5, 10, 9).timestamp()), 0)
+
+    def test_start_shutdown(self):
+        self.engine.start()
+        self.assertTrue(self.engine.running)
+        self.engine.shutdown()
+        self.assertFalse(self.engine.running)
+
+
+class LocalSchedulerCronEngineTest(unittest.IsolatedAsyncioTestCase):
+    async def test_compiled(self):
+        config = SchdConfig.from_dict({'cron_engine': 'compiled',
+                                       'jobs': {'ls': {'class': 'CommandJob', 'cron': '0 * * * *', 'cmd': 'ls'}}})
+        scheduler = LocalScheduler(config)
+        self.assertIsInstance(scheduler.scheduler, CronEngine)
+        await scheduler.add_job(object(), 'ls', config.jobs['ls'])
+        self.assertEqual(scheduler.scheduler.get_next_fire_time('ls').minute, 0)
+        scheduler.start()
+        await scheduler.remove_job('ls')
+        self.assertEqual(len(scheduler.scheduler), 0)
+        await scheduler.close()
+        self.assertFalse(scheduler.scheduler.running)
+
+    def test_invalid_engine(self):
+        with self.assertRaises(ValueError):
+            SchdConfig.from_dict({'cron_engine': 'quartz'})
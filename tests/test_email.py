@@ -1,8 +1,14 @@
+import gzip
 import os
+import re
+import tempfile
+import time
 import unittest
 from unittest.mock import patch
-from schd.config import EmailConfig
-from schd.email import EmailService
+from schd.config import EmailConfig, JobConfig, SchdConfig
+from schd.email import AlertSender, EmailService
+from schd.scheduler import CommandJob, LocalScheduler
+from smtp_standin import SmtpStandin
 
 
 class EmailConfigTest(unittest.TestCase):
@@ -66,3 +72,153 @@ class EmailServiceTest(unittest.TestCase):
             raise unittest.SkipTest('SCHD_SMTP_TO env not specified, skip test')
         
         service.send_mail('test', 'test_content', recipient)
+
+
+class SmtpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smtp = SmtpStandin()
+        host, port = self.smtp.start()
+        self.service = EmailService(host, 'user', 'pass', 'schd@example.com', smtp_port=port)
+
+    def tearDown(self):
+        self.service.close()
+        self.smtp.stop()
+
+
+class EmailConnectionTest(SmtpTestCase):
+    def test_connection_reused(self):
+        for i in range(3):
+            self.service.send_mail(f'mail {i}', 'content', 'ops@example.com', bcc_emails=['audit@example.com'])
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(self.smtp.logins, [('user', 'pass')])
+        self.assertEqual([mail.message['Subject'] for mail in self.smtp.messages], ['mail 0', 'mail 1', 'mail 2'])
+        self.assertEqual(self.smtp.messages[0].rcpt_tos, ['ops@example.com', 'audit@example.com'])
+
+    def test_reconnect(self):
+        self.smtp.drop_after = 1
+        self.service.send_mail('first', 'content', 'ops@example.com')
+        # the server closed the connection, noticed when sending the next mail
+        self.service.send_mail('second', 'content', 'ops@example.com')
+        self.assertEqual(self.smtp.connections, 2)
+        self.assertEqual([mail.message['Subject'] for mail in self.smtp.messages], ['first', 'second'])
+
+
+class AlertSenderTest(SmtpTestCase):
+    def subjects(self):
+        return [mail.message['Subject'] for mail in self.smtp.messages]
+
+    def test_notify_doesnt_wait(self):
+        self.smtp.delay = 0.5
+        sender = AlertSender(self.service)
+        start = time.monotonic()
+        sender.notify('job failed', 'output', 'ops@example.com')
+        self.assertLess(time.monotonic() - start, 0.1)
+        sender.close()
+        self.assertEqual(self.subjects(), ['job failed'])
+        self.assertEqual(self.smtp.messages[0].message.get_content(), 'output\n')
+
+    def test_digest_window(self):
+        sender = AlertSender(self.service, digest_window=0.2)
+        for i in range(3):
+            sender.notify(f'job{i} failed', f'output {i}', 'ops@example.com')
+        sender.notify('other failed', 'output', 'dev@example.com')
+        self.assertTrue(self.smtp.wait_for(2))
+        sender.close()
+        self.assertEqual(sorted(self.subjects()), ['[3 alerts] job0 failed', 'other failed'])
+        digest = next(mail for mail in self.smtp.messages if mail.rcpt_tos == ['ops@example.com'])
+        content = digest.message.get_content()
+        for i in range(3):
+            self.assertIn(f'job{i} failed\n', content)
+            self.assertIn(f'output {i}\n', content)
+
+    def test_rate_limit(self):
+        now = [0.0]
+        sender = AlertSender(self.service, rate_limit=1, clock=lambda: now[0])
+        sender.notify('first', 'output', 'ops@example.com')
+        self.assertTrue(self.smtp.wait_for(1))
+        for i in range(5):
+            sender.notify(f'job{i} failed', 'output', 'ops@example.com')
+        time.sleep(0.1)
+        # held back until the minute is over, then mailed together
+        self.assertEqual(len(self.smtp.messages), 1)
+        now[0] = 60
+        with sender._cond:
+            sender._cond.notify()
+        self.assertTrue(self.smtp.wait_for(2))
+        sender.close()
+        self.assertEqual(self.subjects(), ['first', '[5 alerts] job0 failed'])
+
+    def test_max_pending(self):
+        sender = AlertSender(self.service, digest_window=10, max_pending=2)
+        for i in range(4):
+            sender.notify(f'job{i} failed', 'output', 'ops@example.com')
+        # close sends what is waiting without waiting for the window
+        sender.close()
+        self.assertEqual(self.subjects(), ['[2 alerts] job2 failed'])
+        self.assertIn('2 more alerts were dropped', self.smtp.messages[0].message.get_content())
+        self.assertEqual(sender.dropped, 2)
+
+    def test_retry(self):
+        self.smtp.fail_messages = 1
+        sender = AlertSender(self.service)
+        sender.notify('job failed', 'output', 'ops@example.com')
+        self.assertTrue(self.smtp.wait_for(1, timeout=5))
+        sender.close()
+        self.assertEqual((sender.sent, sender.failed), (1, 0))
+
+    def test_server_down(self):
+        self.smtp.stop()
+        sender = AlertSender(self.service, retries=1)
+        sender.notify('job failed', 'output', 'ops@example.com')
+        sender.close()
+        self.assertEqual((sender.sent, sender.failed), (0, 1))
+
+
+class LocalSchedulerAlertTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.smtp = SmtpStandin()
+        self.host, self.port = self.smtp.start()
+
+    async def asyncTearDown(self):
+        self.smtp.stop()
+
+    async def run_failing(self, cmd, **email):
+        config = SchdConfig.from_dict({'email': {'smtp_server': self.host, 'smtp_port': self.port,
+                                                 'from_addr': 'schd@example.com', 'to_addr': 'ops@example.com',
+                                                 **email}})
+        scheduler = LocalScheduler(config)
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd=cmd)
+        await scheduler.add_job(CommandJob.from_settings('broken', job_config), 'broken', job_config)
+        scheduler.execute_job('broken')
+        await scheduler.close()
+        self.assertEqual(len(self.smtp.messages), 1)
+        return self.smtp.messages[0].message
+
+    async def test_failure_mail(self):
+        message = await self.run_failing('echo broken; exit 3')
+        self.assertTrue(message['Subject'].endswith(' broken'))
+        content = message.get_content()
+        self.assertIn('return code:  3\n', content)
+        self.assertIn('output:       7 bytes\n', content)
+        self.assertTrue(content.endswith('----- output -----\nbroken\n'))
+        self.assertEqual(list(message.iter_attachments()), [])
+
+    async def test_large_output(self):
+        message = await self.run_failing('seq 1 100000; exit 3', tail_lines=5)
+        body = next(message.iter_parts()).get_content()
+        self.assertIn('output:       588895 bytes, the last 5 lines below, all of it attached as broken-', body)
+        self.assertTrue(body.endswith('----- output -----\n99996\n99997\n99998\n99999\n100000\n'))
+        attachment, = message.iter_attachments()
+        self.assertEqual(attachment.get_content_type(), 'application/gzip')
+        self.assertEqual(gzip.decompress(attachment.get_content()).decode(),
+                         ''.join(f'{i}\n' for i in range(1, 100001)))
+        # removed once sent
+        self.assertFalse(os.path.exists(os.path.join(tempfile.gettempdir(), attachment.get_filename())))
+
+    async def test_attachment_too_large(self):
+        message = await self.run_failing('seq 1 100000; exit 3', tail_lines=5, attachment_max_bytes=100)
+        self.assertEqual(list(message.iter_attachments()), [])
+        content = message.get_content()
+        name = re.search(r'attached as (\S+)\n', content).group(1)
+        self.assertTrue(content.endswith(f'100000\n\n\nnot attached, over the limit of 100 bytes per mail: {name}\n'))
+        self.assertFalse(os.path.exists(os.path.join(tempfile.gettempdir(), name)))
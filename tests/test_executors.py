@@ -0,0 +1,103 @@
+import asyncio
+import io
+import os
+import threading
+import unittest
+from schd.config import JobConfig, read_config
+from schd.executors import ProcessJobExecutor
+from schd.job import JobContext
+from schd.scheduler import LocalScheduler
+
+
+class PidJob:
+    def __init__(self, n=10):
+        self.n = n
+
+    def execute(self, context):
+        print('pid', os.getpid())
+        return sum(range(self.n)) % 7
+
+
+class FailingJob:
+    def execute(self, context):
+        raise RuntimeError('boom')
+
+
+class LockResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def get_code(self):
+        return 4
+
+
+class UnpicklableResultJob:
+    def __init__(self, with_code=False):
+        self.with_code = with_code
+
+    def execute(self, context):
+        return LockResult() if self.with_code else threading.Lock()
+
+
+class AsyncPidJob:
+    async def execute(self, context):
+        await asyncio.sleep(0)
+        print('pid', os.getpid())
+        return 5
+
+
+class ProcessJobExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = ProcessJobExecutor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_execute_in_child(self):
+        job_config = JobConfig(cls='test_executors:PidJob', cron='* * * * *', params={'n': 100}, executor='process')
+        output = io.StringIO()
+        result = self.executor.execute('pid', job_config, JobContext('pid', stdout=output))
+        self.assertEqual(result, sum(range(100)) % 7)
+        self.assertTrue(output.getvalue().startswith('pid '))
+        self.assertNotEqual(output.getvalue(), f'pid {os.getpid()}\n')
+
+    def test_exception_in_child(self):
+        job_config = JobConfig(cls='test_executors:FailingJob', cron='* * * * *', executor='process')
+        output = io.StringIO()
+        result = self.executor.execute('fail', job_config, JobContext('fail', stdout=output))
+        self.assertEqual(result, -1)
+        self.assertIn('RuntimeError: boom', output.getvalue())
+
+    def test_async_job(self):
+        job_config = JobConfig(cls='test_executors:AsyncPidJob', cron='* * * * *', executor='process')
+        output = io.StringIO()
+        result = self.executor.execute('pid', job_config, JobContext('pid', stdout=output))
+        self.assertEqual(result, 5)
+        self.assertTrue(output.getvalue().startswith('pid '))
+
+    def test_unpicklable_result(self):
+        job_config = JobConfig(cls='test_executors:UnpicklableResultJob', cron='* * * * *', executor='process',
+                               params={'with_code': True})
+        # only the return code comes back
+        self.assertEqual(self.executor.execute('lock', job_config, JobContext('lock', stdout=io.StringIO())), 4)
+
+        job_config.params = {}
+        output = io.StringIO()
+        result = self.executor.execute('lock', job_config, JobContext('lock', stdout=output))
+        self.assertEqual(result, -1)
+        self.assertIn('ValueError: job lock returned a result that cannot be sent back from the pool worker, '
+                      'unsupported result type: <unlocked _thread.lock object', output.getvalue())
+
+    def test_invalid_executor(self):
+        with self.assertRaises(ValueError):
+            JobConfig(cls='CommandJob', cron='* * * * *', executor='fiber')
+
+
+class LocalSchedulerProcessTest(unittest.IsolatedAsyncioTestCase):
+    async def test_execute_job(self):
+        config = read_config('tests/conf/schd.yaml')
+        target = LocalScheduler(config)
+        job_config = JobConfig(cls='test_executors:PidJob', cron='* * * * *', executor='process')
+        await target.add_job(PidJob(), 'pid', job_config)
+        target.execute_job('pid')
+        await target.close()
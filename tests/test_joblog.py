@@ -0,0 +1,60 @@
+import gzip
+import os
+import tempfile
+import time
+import unittest
+from schd.schedulers.joblog import JoblogStore
+
+
+class JoblogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tempdir.name, 'joblog')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, store, instance_id, data=b'x', mtime=None):
+        path, stream = store.open(instance_id)
+        with stream:
+            stream.write(data)
+        store.release(path)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_sharded_gzip(self):
+        store = JoblogStore(self.root)
+        path = self.write(store, 12345678, b'hello\n')
+        self.assertEqual(path, os.path.join(self.root, '012', '345', '12345678.log.gz'))
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'hello\n')
+        self.assertEqual(store.content_encoding, 'gzip')
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            JoblogStore(self.root, compression='lz4')
+
+    def test_retention(self):
+        now = time.time()
+        store = JoblogStore(self.root, compression='none', retention_days=1, max_count=3, max_bytes=0)
+        self.write(store, 1, mtime=now - 3 * 86400)
+        for instance_id in range(2, 7):
+            self.write(store, instance_id, mtime=now - 100 + instance_id)
+        # still being written, never removed
+        active, stream = store.open(2001)
+        os.utime(active, (now - 5 * 86400, now - 5 * 86400))
+
+        self.assertEqual(store.cleanup(now), 3)
+        remaining = sorted(os.listdir(os.path.join(self.root, '000', '000')))
+        self.assertEqual(remaining, ['4.log', '5.log', '6.log'])
+        self.assertTrue(os.path.exists(active))
+        stream.close()
+
+    def test_max_bytes_removes_empty_shards(self):
+        store = JoblogStore(self.root, compression='none', max_bytes=10)
+        self.write(store, 1000, b'a' * 10, mtime=1000)
+        self.write(store, 2000, b'b' * 10, mtime=2000)
+        self.assertEqual(store.cleanup(3000), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.root, '000', '001')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, '000', '002', '2000.log')))
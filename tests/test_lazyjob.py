@@ -0,0 +1,39 @@
+import io
+import sys
+import unittest
+from schd.config import JobConfig
+from schd.job import JobContext
+from schd.lazyjob import JobCache, LazyJob, resolve_job
+
+
+def job_config(greeting='hello'):
+    return JobConfig(cls='lazy_tasks:CountingJob', cron='* * * * *', params={'greeting': greeting})
+
+
+class LazyJobTest(unittest.TestCase):
+    def setUp(self):
+        sys.modules.pop('lazy_tasks', None)
+
+    def test_built_on_first_run(self):
+        job = LazyJob('count', job_config())
+        self.assertNotIn('lazy_tasks', sys.modules)
+        self.assertFalse(job.built)
+
+        output = io.StringIO()
+        self.assertEqual(job.execute(JobContext('count', stdout=output)), 0)
+        self.assertTrue(job.built)
+        self.assertIs(resolve_job(job), job.get())
+        self.assertEqual(sys.modules['lazy_tasks'].builds, 1)
+
+    def test_cache_drops_idle_jobs(self):
+        cache = JobCache(1)
+        first = LazyJob('first', job_config('a'), cache)
+        second = LazyJob('second', job_config('b'), cache)
+        first.get()
+        second.get()
+        self.assertFalse(first.built)
+        self.assertTrue(second.built)
+        self.assertEqual(len(cache), 1)
+        # built again on its next run
+        self.assertEqual(first.get().greeting, 'a')
+        self.assertEqual(sys.modules['lazy_tasks'].builds, 3)
@@ -0,0 +1,137 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+import aiohttp
+from apscheduler.events import EVENT_JOB_SUBMITTED, JobSubmissionEvent
+from schd import metrics
+from schd.config import JobConfig, SchdConfig
+from schd.metrics import Counter, Gauge, Histogram, Registry
+from schd.scheduler import CommandJob, LocalScheduler
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.remote import RemoteScheduler
+from schd.standin import StandinServer
+
+
+def sample(name, **labels):
+    """
+    value of a sample in the default registry, 0 when it isn't there.
+    """
+    label_text = ','.join('%s="%s"' % item for item in labels.items())
+    prefix = '%s{%s} ' % (name, label_text) if labels else name + ' '
+    for line in metrics.REGISTRY.expose().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0
+
+
+class MetricTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = Counter('runs_total', 'Runs.', ['job', 'result'], registry=self.registry)
+        counter.labels('a', 'success').inc()
+        counter.labels(job='a', result='success').inc(2)
+        counter.labels('b"\n', 'failure').inc()
+        self.assertEqual(self.registry.expose(),
+                         '# HELP runs_total Runs.\n# TYPE runs_total counter\n'
+                         'runs_total{job="a",result="success"} 3\n'
+                         'runs_total{job="b\\"\\n",result="failure"} 1\n')
+        with self.assertRaises(ValueError):
+            counter.labels('a')
+        with self.assertRaises(ValueError):
+            Counter('runs_total', 'Runs.', registry=self.registry)
+
+    def test_histogram(self):
+        histogram = Histogram('duration_seconds', 'Durations.', buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.expose()[2:], [
+            'duration_seconds_bucket{le="0.1"} 2',
+            'duration_seconds_bucket{le="1"} 3',
+            'duration_seconds_bucket{le="+Inf"} 4',
+            'duration_seconds_sum 3.65',
+            'duration_seconds_count 4',
+        ])
+
+    def test_gauge(self):
+        gauge = Gauge('running', 'Running.', ['executor'], registry=self.registry)
+        gauge.labels('thread').inc(3)
+        gauge.labels('thread').dec()
+        gauge.labels('process').set_function(lambda: 4)
+        gauge.labels('broken').set_function(lambda: 1 / 0)
+        self.assertEqual(gauge.expose()[2:], ['running{executor="thread"} 2', 'running{executor="process"} 4'])
+
+    def test_threads(self):
+        counter = Counter('count_total', 'Count.', registry=self.registry)
+        histogram = Histogram('value', 'Value.', buckets=(1,), registry=self.registry)
+
+        def work():
+            for _ in range(10000):
+                counter.inc()
+                histogram.observe(0.5)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels().get(), 80000)
+        self.assertEqual(histogram.labels().get(), ([80000, 80000], 40000))
+
+
+class MetricsServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_endpoint(self):
+        registry = Registry()
+        Counter('runs_total', 'Runs.', registry=registry).inc()
+        runner = await metrics.start_metrics_server('127.0.0.1', 0, registry)
+        try:
+            port = runner.addresses[0][1]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    self.assertEqual(response.status, 200)
+                    self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+                    self.assertIn('runs_total 1\n', await response.text())
+        finally:
+            await runner.cleanup()
+
+
+class SchedulerMetricsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_local(self):
+        scheduler = LocalScheduler(SchdConfig.from_dict({}))
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo hello')
+        await scheduler.add_job(CommandJob.from_settings('metrics_local', job_config), 'metrics_local', job_config)
+        lags = sample('schd_scheduling_lag_seconds_count')
+        lag_sum = sample('schd_scheduling_lag_seconds_sum')
+        # a run planned 2s ago
+        scheduler._run_submitted(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'metrics_local', 'default',
+                                                    [datetime.fromtimestamp(time.time() - 2)]))
+        scheduler.execute_job('metrics_local')
+        await scheduler.close()
+        self.assertEqual(sample('schd_scheduling_lag_seconds_count'), lags + 1)
+        self.assertAlmostEqual(sample('schd_scheduling_lag_seconds_sum') - lag_sum, 2, delta=0.5)
+        self.assertEqual(sample('schd_job_runs_total', job='metrics_local', result='success'), 1)
+        self.assertEqual(sample('schd_job_run_duration_seconds_count', job='metrics_local'), 1)
+        self.assertEqual(sample('schd_job_output_bytes_total', job='metrics_local'), 6)
+        self.assertEqual(sample('schd_jobs_running', executor='thread'), 0)
+
+    async def test_remote(self):
+        server = StandinServer()
+        base_url = await server.start()
+        with tempfile.TemporaryDirectory() as joblog_dir:
+            scheduler = RemoteScheduler('w1', base_url, joblog_store=JoblogStore(joblog_dir))
+            registers = sample('schd_api_request_duration_seconds_count', call='register_worker')
+            await scheduler.init()
+            job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo hello', queue='metrics')
+            await scheduler.add_job(CommandJob.from_settings('metrics_remote', job_config), 'metrics_remote', job_config)
+            self.assertEqual(sample('schd_queue_slots', queue='metrics', state='capacity'), 1)
+            await scheduler.admit('metrics_remote', 1)
+            await asyncio.gather(*scheduler._tasks)
+            await scheduler.close()
+            await server.stop()
+        self.assertEqual(sample('schd_api_request_duration_seconds_count', call='register_worker'), registers + 1)
+        self.assertEqual(sample('schd_queue_wait_seconds_count', queue='metrics'), 1)
+        self.assertEqual(sample('schd_job_runs_total', job='metrics_remote', result='success'), 1)
+        self.assertEqual(sample('schd_job_output_bytes_total', job='metrics_remote'), 6)
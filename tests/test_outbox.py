@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+from schd.schedulers.outbox import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'data', 'outbox.sqlite3')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_survives_reopen(self):
+        outbox = Outbox(self.path)
+        first = outbox.append('status', {'instance_id': 1, 'status': 'RUNNING'})
+        outbox.append('log', {'instance_id': 1})
+        outbox.append('status', {'instance_id': 1, 'status': 'COMPLETED'})
+        outbox.delete([first])
+        outbox.close()
+
+        outbox = Outbox(self.path)
+        records = outbox.load()
+        self.assertEqual([kind for _, kind, _ in records], ['log', 'status'])
+        self.assertEqual(records[1][2]['status'], 'COMPLETED')
+        self.assertGreater(records[1][0], records[0][0])
+        outbox.close()
+
+    def test_compact(self):
+        outbox = Outbox(self.path, compact_free_pages=16)
+        seqs = [outbox.append('status', {'payload': 'x' * 1000}) for _ in range(500)]
+        self.assertFalse(outbox.compact())
+        outbox.delete(seqs)
+        self.assertEqual(outbox.count(), 0)
+        size = os.path.getsize(self.path)
+        self.assertTrue(outbox.compact())
+        self.assertLess(os.path.getsize(self.path), size)
+        outbox.close()
@@ -0,0 +1,70 @@
+import io
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from schd.output import JobOutput, StreamDispatcher, capture_output
+
+
+class CaptureOutputTest(unittest.TestCase):
+    def test_concurrent_threads(self):
+        barrier = threading.Barrier(4)
+
+        def job(n):
+            buffer = io.StringIO()
+            with capture_output(buffer):
+                barrier.wait()
+                for _ in range(100):
+                    print('job', n)
+            return buffer.getvalue()
+
+        with ThreadPoolExecutor(4) as executor:
+            outputs = list(executor.map(job, range(4)))
+
+        for n, output in enumerate(outputs):
+            self.assertEqual(output, f'job {n}\n' * 100)
+
+    def test_nested_and_fallback(self):
+        outer, inner = io.StringIO(), io.StringIO()
+        with capture_output(outer):
+            print('a')
+            with capture_output(inner):
+                print('b')
+            print('c')
+        self.assertIsInstance(sys.stdout, StreamDispatcher)
+        self.assertEqual(outer.getvalue(), 'a\nc\n')
+        self.assertEqual(inner.getvalue(), 'b\n')
+
+    def test_stderr(self):
+        out, err = io.StringIO(), io.StringIO()
+        with capture_output(out, err):
+            print('error', file=sys.stderr)
+        self.assertEqual(err.getvalue(), 'error\n')
+        self.assertEqual(out.getvalue(), '')
+
+
+class JobOutputTest(unittest.TestCase):
+    def test_spooled(self):
+        output = JobOutput(spool_size=100)
+        with capture_output(output):
+            for i in range(100):
+                print(f'line {i} \u00e9')
+        self.assertTrue(output._file._rolled)
+        self.assertEqual(output.size, len(output.getvalue().encode('utf-8')))
+        self.assertEqual(b''.join(output.chunks(7)).decode('utf-8'), output.getvalue())
+        self.assertTrue(output.getvalue().startswith('line 0 \u00e9\nline 1 '))
+        # written after reading, at the end
+        output.write('end\n')
+        self.assertTrue(output.getvalue().endswith('line 99 \u00e9\nend\n'))
+        output.close()
+
+    def test_tail(self):
+        output = JobOutput()
+        output.write(''.join(f'line {i}\n' for i in range(100)))
+        self.assertEqual(output.tail(0), (output.getvalue(), False))
+        self.assertEqual(output.tail(10000, 200), (output.getvalue(), False))
+        self.assertEqual(output.tail(10000, 2), ('line 98\nline 99\n', True))
+        # from the first complete line
+        self.assertEqual(output.tail(12), ('line 99\n', True))
+        output.write('x' * 50)
+        self.assertEqual(output.tail(20), ('x' * 20, True))
@@ -0,0 +1,73 @@
+import io
+import subprocess
+import sys
+import unittest
+from schd.config import JobConfig
+from schd.job import JobContext
+from schd.pump import OutputPump, pump_command_output
+from schd.scheduler import CommandJob
+
+
+def run_python(code):
+    return subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class CountingStream(io.TextIOBase):
+    def __init__(self):
+        self.size = 0
+        self.max_write = 0
+
+    def write(self, s):
+        self.size += len(s)
+        self.max_write = max(self.max_write, len(s))
+        return len(s)
+
+
+class OutputPumpTest(unittest.TestCase):
+    def test_large_output_bounded_chunks(self):
+        process = run_python('import sys\nfor i in range(2000): sys.stdout.write("x" * 1000)')
+        target = CountingStream()
+        OutputPump(target, target, buffer_size=4096).pump(process.stdout, process.stderr)
+        process.wait()
+        self.assertEqual(target.size, 2000 * 1000)
+        self.assertLessEqual(target.max_write, 4096)
+
+    def test_multibyte_split_across_chunks(self):
+        process = run_python('import sys\nsys.stdout.buffer.write("中文".encode("utf-8") * 100)')
+        target = io.StringIO()
+        OutputPump(target, None, buffer_size=5, encoding='utf-8').pump(process.stdout, process.stderr)
+        process.wait()
+        self.assertEqual(target.getvalue(), '中文' * 100)
+
+    def test_stderr_after_stdout(self):
+        process = run_python('import sys\nsys.stderr.write("err\\n"); sys.stderr.flush(); print("out")')
+        target = io.StringIO()
+        pump_command_output(process, target, interleave=False)
+        process.wait()
+        self.assertEqual(target.getvalue(), 'out\nerr\n')
+
+
+class CommandJobTest(unittest.TestCase):
+    def test_execute_captures_stderr(self):
+        job = CommandJob.from_settings('outputstderr', JobConfig(cls='CommandJob', cron='* * * * *',
+                                                                 cmd=f'"{sys.executable}" tests/outputstderr.py'))
+        output = io.StringIO()
+        ret_code = job.execute(JobContext('outputstderr', stdout=output))
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(output.getvalue(), 'test output into stderr.\n')
+
+    def test_separate_stderr(self):
+        job = CommandJob(f'"{sys.executable}" -c "import sys; print(1); print(2, file=sys.stderr)"')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        job.execute(JobContext('separate', stdout=stdout, stderr=stderr))
+        self.assertEqual(stdout.getvalue(), '1\n')
+        self.assertEqual(stderr.getvalue(), '2\n')
+
+
+class CommandJobAsyncTest(unittest.IsolatedAsyncioTestCase):
+    async def test_execute_async(self):
+        job = CommandJob(f'"{sys.executable}" tests/outputstderr.py')
+        output = io.StringIO()
+        ret_code = await job.execute_async(JobContext('outputstderr', stdout=output))
+        self.assertEqual(ret_code, 1)
+        self.assertEqual(output.getvalue(), 'test output into stderr.\n')
@@ -0,0 +1,43 @@
+import io
+import unittest
+from schd.config import JobConfig
+from schd.job import JobContext
+from schd import pyrunner
+from schd.pyrunner import PythonJob
+from schd.scheduler import build_job
+
+
+class PythonJobTest(unittest.TestCase):
+    def test_run_entry(self):
+        job_config = JobConfig(cls='PythonJob', cron='* * * * *',
+                               params={'entry': 'pyrunner_tasks:hello', 'args': ['schd'], 'kwargs': {'code': 3}})
+        job = build_job('hello', job_config.cls, job_config)
+        output = io.StringIO()
+        ret_code = job.execute(JobContext('hello', stdout=output))
+        self.assertEqual(ret_code, 3)
+        self.assertEqual(output.getvalue(), 'hello schd\nwarn\n')
+
+    def test_exception(self):
+        output = io.StringIO()
+        ret_code = PythonJob('pyrunner_tasks:fail').execute(JobContext('fail', stdout=output))
+        self.assertEqual(ret_code, 1)
+        self.assertIn('RuntimeError: boom', output.getvalue())
+
+    def test_interrupt(self):
+        output = io.StringIO()
+        ret_code = PythonJob('pyrunner_tasks:interrupted').execute(JobContext('interrupted', stdout=output))
+        self.assertEqual(ret_code, 1)
+        self.assertIn('KeyboardInterrupt', output.getvalue())
+
+    def test_stop(self):
+        job = PythonJob('pyrunner_tasks:hello', args=['schd'])
+        self.assertEqual(job.execute(JobContext('hello')), 0)
+        process = pyrunner.get_zygote()._process
+        pyrunner.stop()
+        self.assertFalse(process.is_alive())
+        # started again by the next run
+        self.assertEqual(job.execute(JobContext('hello')), 0)
+
+    def test_invalid_entry(self):
+        with self.assertRaises(ValueError):
+            PythonJob('pyrunner_tasks.hello')
@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+from schd.schedulers.queues import WeightedSemaphore, queue_stats
+
+
+class WeightedSemaphoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_weighted_slots(self):
+        sem = WeightedSemaphore(8)
+        await sem.acquire(4)
+        await sem.acquire(3)
+        self.assertEqual(sem.used, 7)
+
+        acquired = []
+        async def take(name, weight):
+            await sem.acquire(weight)
+            acquired.append(name)
+
+        heavy = asyncio.ensure_future(take('heavy', 4))
+        light = asyncio.ensure_future(take('light', 1))
+        await asyncio.sleep(0)
+        # light job fits but waits behind the heavy one, fifo
+        self.assertEqual(acquired, [])
+        self.assertEqual(sem.waiting, 2)
+
+        sem.release(4)
+        await asyncio.gather(heavy, light)
+        self.assertEqual(acquired, ['heavy', 'light'])
+        self.assertEqual(sem.used, 8)
+
+    async def test_weight_clamped_to_capacity(self):
+        sem = WeightedSemaphore(2)
+        async with sem.slots(5):
+            self.assertEqual(sem.used, 2)
+        self.assertEqual(sem.used, 0)
+
+    async def test_cancel_waiter(self):
+        sem = WeightedSemaphore(1)
+        await sem.acquire()
+        waiter = asyncio.ensure_future(sem.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        sem.release()
+        self.assertEqual(sem.used, 0)
+        self.assertEqual(sem.waiting, 0)
+
+    def test_queue_stats(self):
+        stats = queue_stats({'': WeightedSemaphore(1), 'etl': WeightedSemaphore(8)})
+        self.assertEqual(stats['etl']['capacity'], 8)
+        self.assertEqual(stats['*']['capacity'], 9)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from schd.config import JobConfig, read_config
+from schd.reload import ConfigReloader, diff_jobs
+from schd.scheduler import LocalScheduler, build_job
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.remote import RemoteScheduler
+from schd.standin import StandinServer
+
+CONFIG = """
+jobs:
+  ls:
+    class: CommandJob
+    cron: "* * * * *"
+    cmd: "ls -l"
+  date:
+    class: CommandJob
+    cron: "0 * * * *"
+    cmd: "date"
+"""
+
+CONFIG_CHANGED = """
+jobs:
+  ls:
+    class: CommandJob
+    cron: "* * * * *"
+    cmd: "ls -l"
+  date:
+    class: CommandJob
+    cron: "30 * * * *"
+    cmd: "date"
+  pwd:
+    class: CommandJob
+    cron: "* * * * *"
+    cmd: "pwd"
+"""
+
+CONFIG_REMOVED = """
+jobs:
+  ls:
+    class: CommandJob
+    cron: "* * * * *"
+    cmd: "ls -l"
+"""
+
+
+def make_job(job_name, job_config):
+    return build_job(job_name, job_config.cls, job_config)
+
+
+class DiffJobsTest(unittest.TestCase):
+    def test_diff(self):
+        old = {'a': JobConfig(cls='CommandJob', cron='* * * * *'), 'b': JobConfig(cls='CommandJob', cron='* * * * *')}
+        new = {'a': JobConfig(cls='CommandJob', cron='* * * * *'), 'b': JobConfig(cls='CommandJob', cron='0 * * * *'),
+               'c': JobConfig(cls='CommandJob', cron='* * * * *')}
+        diff = diff_jobs(old, new)
+        self.assertEqual((diff.added, diff.removed, diff.changed), (['c'], [], ['b']))
+        diff = diff_jobs(new, old)
+        self.assertEqual((diff.added, diff.removed, diff.changed), ([], ['c'], ['b']))
+        self.assertFalse(diff_jobs(old, old))
+
+
+class ConfigFileTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.config_file = tempfile.mkstemp(suffix='.yaml')
+        os.close(fd)
+        self.write(CONFIG)
+
+    def tearDown(self):
+        os.remove(self.config_file)
+
+    def write(self, content):
+        with open(self.config_file, 'w', encoding='utf8') as f:
+            f.write(content)
+
+    async def add_all(self, scheduler, config):
+        await scheduler.add_jobs([(make_job(job_name, job_config), job_name, job_config)
+                                  for job_name, job_config in config.jobs.items()])
+
+
+class LocalReloadTest(ConfigFileTestCase):
+    async def asyncSetUp(self):
+        self.config = read_config(self.config_file)
+        self.scheduler = LocalScheduler(self.config)
+        await self.add_all(self.scheduler, self.config)
+        self.scheduler.start()
+        self.reloader = ConfigReloader(self.scheduler, self.config, self.config_file, make_job, interval=0.05)
+
+    async def asyncTearDown(self):
+        await self.reloader.stop()
+        await self.scheduler.close()
+
+    async def test_reload(self):
+        ls_job = self.scheduler._jobs['ls']
+        self.write(CONFIG_CHANGED)
+        diff = await self.reloader.reload()
+        self.assertEqual((diff.added, diff.removed, diff.changed), (['pwd'], [], ['date']))
+        self.assertEqual({job.id for job in self.scheduler.scheduler.get_jobs()}, {'ls', 'date', 'pwd'})
+        self.assertIn("minute='30'", str(self.scheduler.scheduler.get_job('date').trigger))
+        # untouched jobs are not rebuilt
+        self.assertIs(self.scheduler._jobs['ls'], ls_job)
+
+        self.write(CONFIG_REMOVED)
+        diff = await self.reloader.reload()
+        self.assertEqual(diff.removed, ['date', 'pwd'])
+        self.assertEqual({job.id for job in self.scheduler.scheduler.get_jobs()}, {'ls'})
+        self.assertEqual(set(self.config.jobs), {'ls'})
+
+    async def test_invalid_config_kept(self):
+        self.write('jobs: [')
+        diff = await self.reloader.reload()
+        self.assertFalse(diff)
+        self.assertEqual({job.id for job in self.scheduler.scheduler.get_jobs()}, {'ls', 'date'})
+
+    async def test_bad_job_skipped(self):
+        self.write(CONFIG_REMOVED + '  bad:\n    class: "nomodule:NoJob"\n    cron: "* * * * *"\n')
+        await self.reloader.reload()
+        self.assertEqual(set(self.scheduler._jobs), {'ls'})
+        self.assertNotIn('bad', self.config.jobs)
+
+    async def test_watch(self):
+        self.reloader.start()
+        self.write(CONFIG_CHANGED)
+        for _ in range(100):
+            if self.reloader.reloads:
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(self.reloader.reloads, 1)
+        self.assertIn('pwd', self.scheduler._jobs)
+
+
+class RemoteReloadTest(ConfigFileTestCase):
+    async def asyncSetUp(self):
+        self.server = StandinServer()
+        base_url = await self.server.start()
+        self.config = read_config(self.config_file)
+        self.joblog_dir = tempfile.TemporaryDirectory()
+        self.scheduler = RemoteScheduler('w1', base_url, joblog_store=JoblogStore(self.joblog_dir.name))
+        await self.scheduler.init()
+        await self.add_all(self.scheduler, self.config)
+        self.reloader = ConfigReloader(self.scheduler, self.config, self.config_file, make_job, interval=0)
+
+    async def asyncTearDown(self):
+        await self.reloader.stop()
+        await self.scheduler.close()
+        await self.server.stop()
+        self.joblog_dir.cleanup()
+
+    async def test_reload(self):
+        self.server.job_registrations = 0
+        self.write(CONFIG_CHANGED)
+        await self.reloader.reload()
+        # only the new and the changed job are registered
+        self.assertEqual(self.server.job_registrations, 2)
+        self.assertEqual(self.server.jobs['w1']['date']['cron'], '30 * * * *')
+
+        self.write(CONFIG_REMOVED)
+        await self.reloader.reload()
+        self.assertEqual(set(self.server.jobs['w1']), {'ls'})
+        self.assertEqual(set(self.scheduler._jobs), {'ls'})
+
+    async def test_removed_job_instance_runs(self):
+        job, job_config = self.scheduler._jobs['date']
+        self.write(CONFIG_REMOVED)
+        await self.reloader.reload()
+        await self.scheduler.execute_task('date', 1, (job, job_config))
+        await self.scheduler.reporter.flush(5)
+        self.assertEqual(self.server.instances[1]['status'], 'COMPLETED')
@@ -0,0 +1,573 @@
+import asyncio
+import gzip
+import os
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+from schd.config import JobConfig
+from schd.scheduler import CommandJob
+from schd.schedulers.logstream import JobLogStreamer
+from schd.schedulers.remote import RemoteApiClient, parse_frame
+from schd.lazyjob import LazyJob
+from schd.schedulers.joblog import JoblogStore
+from schd.schedulers.outbox import Outbox
+from schd.schedulers.reporter import StatusReporter
+from standin_case import StandinTestCase
+
+
+class RemoteApiClientTest(StandinTestCase):
+    async def test_session_reused(self):
+        client = RemoteApiClient(self.base_url, conn_limit=4, conn_limit_per_host=2)
+        await client.register_worker('w1')
+        session = client._get_session()
+        await client.register_job('w1', 'job1', '* * * * *', timezone='UTC')
+        await client.update_job_instance('w1', 'job1', 1, status='RUNNING')
+        self.assertIs(session, client._get_session())
+        self.assertEqual(session.connector.limit, 4)
+        self.assertEqual(session.connector.limit_per_host, 2)
+        self.assertEqual(self.server.jobs['w1']['job1']['timezone'], 'UTC')
+        self.assertEqual(self.server.instances[1]['status'], 'RUNNING')
+        await client.close()
+        self.assertTrue(session.closed)
+
+    async def test_eventstream_frames(self):
+        self.server.batch_events = True
+        self.server.push_event('w1', {'event_type': 'heartbeat'})
+        for instance_id in range(1, 4):
+            self.server.new_job_instance('w1', 'job1', instance_id)
+        events = []
+        async with RemoteApiClient(self.base_url) as client:
+            async for event in client.subscribe_worker_eventstream('w1'):
+                events.append(event)
+                if len(events) == 3:
+                    break
+        # the heartbeat in the same frame is skipped
+        self.assertEqual([event['data']['id'] for event in events], [1, 2, 3])
+
+    def test_parse_frame(self):
+        event = {'event_type': 'NewJobInstance', 'data': {'id': 1, 'job_name': 'job1'}}
+        self.assertEqual(parse_frame(b'{"event_type": "NewJobInstance", "data": {"id": 1, "job_name": "job1"}}'), [event])
+        self.assertEqual(parse_frame(b'[{"event_type": "heartbeat"}]'), [{'event_type': 'heartbeat'}])
+        self.assertEqual(parse_frame(b'{"event_type": "batch", "events": [{"event_type": "heartbeat"}]}\r'),
+                         [{'event_type': 'heartbeat'}])
+
+    async def test_context_manager_closes(self):
+        async with RemoteApiClient(self.base_url) as client:
+            await client.add_trigger('w1', 'job1', 'job0')
+            session = client._get_session()
+        self.assertTrue(session.closed)
+        self.assertEqual(self.server.triggers[0]['on_job_name'], 'job0')
+
+    async def test_standin_control(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.base_url + 'standin/workers/w1/jobs/job1/instances?count=2') as response:
+                self.assertEqual((await response.json())['ids'], [1, 2])
+        self.assertEqual([event['data']['id'] for event in self.server.events['w1']], [1, 2])
+
+        async with RemoteApiClient(self.base_url) as client:
+            await client.update_job_instance('w1', 'job1', 1, status='COMPLETED', ret_code=0)
+            await client.update_job_instances('w1', [{'job_name': 'job1', 'id': 2, 'status': 'COMPLETED'}])
+            await client.append_job_log('w1', 'job1', 1, 0, b'hello')
+            async with client._get_session().get(self.base_url + 'standin/stats') as response:
+                stats = await response.json()
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(set(stats['completion_latency']), {'p50', 'p90', 'p99', 'p100'})
+        self.assertEqual(stats['log_bytes'], 5)
+
+
+class JobLogStreamerTest(StandinTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.client = RemoteApiClient(self.base_url)
+        self.logfile_path = self.path('output.txt')
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await super().asyncTearDown()
+
+    async def test_stream_and_seal(self):
+        streamer = JobLogStreamer(self.client, 'w1', 'job1', 1, self.logfile_path,
+                                  chunk_size=10, interval=0.05, poll_interval=0.01)
+        with open(self.logfile_path, 'wb') as f:
+            streamer.start()
+            f.write(b'a' * 25)
+            f.flush()
+            await asyncio.sleep(0.2)
+            # chunks were shipped while the job is still running
+            self.assertEqual(self.server.logs[1], b'a' * 25)
+            f.write(b'b' * 5)
+        await streamer.close()
+        self.assertEqual(self.server.logs[1], b'a' * 25 + b'b' * 5)
+        self.assertEqual(self.server.sealed_logs[1], 30)
+
+    async def test_resume_after_failure(self):
+        with open(self.logfile_path, 'wb') as f:
+            f.write(b'0123456789')
+        streamer = JobLogStreamer(self.client, 'w1', 'job1', 2, self.logfile_path, chunk_size=4)
+        self.assertTrue(await streamer.ship())
+
+        # server lost the tail of the log, e.g. restarted from an older state
+        self.server.logs[2] = b'012345'
+        with open(self.logfile_path, 'ab') as f:
+            f.write(b'abc')
+        self.assertFalse(await streamer.ship())
+        await streamer.close()
+        self.assertEqual(self.server.logs[2], b'0123456789abc')
+        self.assertEqual(self.server.sealed_logs[2], 13)
+
+    async def test_close_reports_seal_error(self):
+        with open(self.logfile_path, 'wb') as f:
+            f.write(b'abc')
+        streamer = JobLogStreamer(self.client, 'w1', 'job1', 3, self.logfile_path)
+
+        async def broken_seal(*args, **kwargs):
+            raise aiohttp.ClientConnectionError('server gone')
+        self.client.seal_job_log = broken_seal
+        # reported, not raised, execute_task reports the job status right after
+        self.assertFalse(await streamer.close())
+        self.assertEqual(self.server.logs[3], b'abc')
+
+
+class RemoteSchedulerTest(StandinTestCase):
+    async def test_execute_command_job(self):
+        scheduler = await self.new_scheduler()
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo hello')
+        await scheduler.add_job(CommandJob.from_settings('echo', job_config), 'echo', job_config)
+        await scheduler.execute_task('echo', 1)
+        await self.close_schedulers()
+        self.assertEqual(self.server.instances[1]['status'], 'COMPLETED')
+        self.assertEqual(self.server.instances[1]['ret_code'], 0)
+        # uploaded as written, gzip compressed
+        self.assertEqual(self.server.log_encodings[1], 'gzip')
+        self.assertEqual(gzip.decompress(self.server.logs[1]), b'hello\n')
+        self.assertTrue(os.path.exists(os.path.join('joblog', '000', '000', '1.log.gz')))
+
+    async def test_streamed_compressed_log(self):
+        scheduler = await self.new_scheduler(log_stream=True)
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo hello')
+        await scheduler.add_job(CommandJob.from_settings('echo', job_config), 'echo', job_config)
+        await scheduler.execute_task('echo', 2)
+        await self.close_schedulers()
+        self.assertEqual(self.server.log_encodings[2], 'gzip')
+        self.assertEqual(gzip.decompress(self.server.logs[2]), b'hello\n')
+
+    async def test_lazy_job(self):
+        scheduler = await self.new_scheduler(joblog_store=JoblogStore(compression='none'))
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo lazy')
+        job = LazyJob('echo', job_config)
+        await scheduler.add_job(job, 'echo', job_config)
+        self.assertFalse(job.built)
+        await scheduler.execute_task('echo', 4)
+        await self.close_schedulers()
+        self.assertTrue(job.built)
+        self.assertEqual(self.server.logs[4], b'lazy\n')
+
+    async def test_plain_log(self):
+        scheduler = await self.new_scheduler(joblog_store=JoblogStore(compression='none'))
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='echo hello')
+        await scheduler.add_job(CommandJob.from_settings('echo', job_config), 'echo', job_config)
+        await scheduler.execute_task('echo', 3)
+        await self.close_schedulers()
+        self.assertIsNone(self.server.log_encodings[3])
+        self.assertEqual(self.server.logs[3], b'hello\n')
+
+    async def test_async_job(self):
+        scheduler = await self.new_scheduler(joblog_store=JoblogStore(compression='none'))
+        job_config = JobConfig(cls='AsyncJob', cron='* * * * *')
+        await scheduler.add_job(AsyncJob(), 'ping', job_config)
+        await scheduler.execute_task('ping', 5)
+        await self.close_schedulers()
+        self.assertEqual(self.server.instances[5]['ret_code'], 3)
+        self.assertEqual(self.server.logs[5], b'pong\n')
+
+    async def test_timeout(self):
+        scheduler = await self.new_scheduler(joblog_store=JoblogStore(compression='none'))
+        await scheduler.add_job(AsyncJob(delay=10), 'slow', JobConfig(cls='AsyncJob', cron='* * * * *', timeout=0.1))
+        job_config = JobConfig(cls='CommandJob', cron='* * * * *', cmd='sleep 10', timeout=0.1)
+        await scheduler.add_job(CommandJob.from_settings('sleep', job_config), 'sleep', job_config)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(scheduler.execute_task('slow', 6), scheduler.execute_task('sleep', 7))
+        self.assertLess(loop.time() - start, 5)
+        await self.close_schedulers()
+        self.assertEqual(self.server.instances[6]['ret_code'], -1)
+        self.assertEqual(self.server.instances[7]['ret_code'], -1)
+
+
+    async def test_cancelled_on_close(self):
+        scheduler = await self.new_scheduler(joblog_store=JoblogStore(compression='none'))
+        job = BlockingJob()
+        await scheduler.add_job(job, 'block', JobConfig(cls='BlockingJob', cron='* * * * *'))
+        await scheduler.admit('block', 8)
+        await self.wait_for(lambda: job.started == 1)
+        await self.close_schedulers()
+        # finished on the server with its log, not left RUNNING
+        self.assertEqual(self.server.instances[8]['status'], 'COMPLETED')
+        self.assertEqual(self.server.instances[8]['ret_code'], -1)
+        self.assertEqual(self.server.logs[8], b'')
+        self.assertEqual(scheduler.joblogs._active, set())
+
+
+class AsyncJob:
+    def __init__(self, delay=0):
+        self.delay = delay
+
+    async def execute(self, context):
+        await asyncio.sleep(self.delay)
+        print('pong')
+        return 3
+
+
+class RegisterJobsTest(StandinTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.scheduler = await self.new_scheduler(init=False, register_concurrency=4)
+
+    def jobs(self, count, cron='* * * * *'):
+        return [(QuickJob(), f'job{i}', JobConfig(cls='QuickJob', cron=cron, queue='q%d' % (i % 3)))
+                for i in range(count)]
+
+    async def test_bulk(self):
+        await self.scheduler.add_jobs(self.jobs(50))
+        # list + one bulk registration
+        self.assertEqual(self.server.request_count, 2)
+        self.assertEqual(self.server.jobs['w1']['job7']['queue'], 'q1')
+        self.assertEqual(len(self.scheduler._jobs), 50)
+
+    async def test_unchanged_skipped(self):
+        await self.scheduler.add_jobs(self.jobs(10))
+        self.server.request_count = 0
+        self.server.job_registrations = 0
+        jobs = self.jobs(10)
+        jobs[3][2].cron = '*/5 * * * *'
+        await self.scheduler.add_jobs(jobs)
+        self.assertEqual(self.server.job_registrations, 1)
+        self.assertEqual(self.server.jobs['w1']['job3']['cron'], '*/5 * * * *')
+
+    async def test_concurrent_fallback(self):
+        self.server.bulk_register = False
+        self.server.latency = 0.05
+        await self.scheduler.add_jobs(self.jobs(20))
+        self.assertEqual(self.server.job_registrations, 20)
+        self.assertEqual(set(self.server.jobs['w1']), {f'job{i}' for i in range(20)})
+
+
+class BlockingJob:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def execute_async(self, context):
+        self.started += 1
+        await self.release.wait()
+        return 0
+
+
+class AdmissionControlTest(StandinTestCase):
+    async def build_scheduler(self, job, job_config=None, **kwargs):
+        scheduler = await self.new_scheduler(**kwargs)
+        await scheduler.add_job(job, 'block', job_config or JobConfig(cls='BlockingJob', cron='* * * * *'))
+        return scheduler
+
+    async def test_reject_when_pending_full(self):
+        job = BlockingJob()
+        scheduler = await self.build_scheduler(job, queues={'': 10}, max_inflight=1, max_pending=1, overflow='reject')
+        scheduler.start()
+        for instance_id in range(1, 5):
+            self.server.new_job_instance('w1', 'block', instance_id)
+
+        # 1 running, 1 pending, 2 rejected
+        await self.wait_for(lambda: self.server.instances[4].get('status') == 'REJECTED')
+        self.assertEqual(self.server.instances[3]['status'], 'REJECTED')
+        self.assertEqual(job.started, 1)
+        stats = scheduler.admission_stats()
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['rejected'], 2)
+        self.assertEqual(stats['deferred'], 0)
+
+        job.release.set()
+        await self.wait_for(lambda: self.server.instances[2].get('status') == 'COMPLETED')
+        self.assertEqual(job.started, 2)
+        self.assertEqual(self.server.instances[1]['status'], 'COMPLETED')
+
+    async def test_block_pauses_admission(self):
+        job = BlockingJob()
+        scheduler = await self.build_scheduler(job, queues={'': 10}, max_inflight=1, max_pending=1)
+        await scheduler.admit('block', 1)
+        await scheduler.admit('block', 2)
+        admit = asyncio.ensure_future(scheduler.admit('block', 3))
+        await asyncio.sleep(0.1)
+        self.assertFalse(admit.done())
+        self.assertEqual(scheduler.admission_stats()['queued'], 1)
+        job.release.set()
+        await asyncio.wait_for(admit, 5)
+        await self.wait_for(lambda: scheduler.admission_stats()['completed'] == 3)
+
+    async def test_saturated_queue_keeps_inflight_permits(self):
+        job = BlockingJob()
+        scheduler = await self.build_scheduler(job, max_inflight=2, max_pending=10)
+        other = BlockingJob()
+        await scheduler.add_job(other, 'other', JobConfig(cls='BlockingJob', cron='* * * * *', queue='q2'))
+        # default queue has 1 slot, the extra instances wait for it without taking in-flight permits
+        for instance_id in range(1, 4):
+            await scheduler.admit('block', instance_id)
+        await scheduler.admit('other', 4)
+        await self.wait_for(lambda: other.started == 1)
+        self.assertEqual(scheduler.admission_stats()['running'], 2)
+        self.assertEqual(scheduler.admission_stats()['queued'], 2)
+        job.release.set()
+        other.release.set()
+
+    async def test_defer_reported_in_background(self):
+        job = BlockingJob()
+        scheduler = await self.build_scheduler(job, max_inflight=1, max_pending=1, overflow='DEFER')
+        await scheduler.admit('block', 1)
+        await scheduler.admit('block', 2)
+        self.server.fail_requests = 1
+        scheduler.reporter.min_backoff = 0.01
+        # neither a failed report nor an unknown job raise
+        await scheduler.admit('block', 3)
+        await scheduler.admit('unknown', 4)
+        self.assertEqual(scheduler.admission_stats()['deferred'], 1)
+        await scheduler.reporter.flush(5)
+        self.assertEqual(self.server.instances[3]['status'], 'DEFERRED')
+        job.release.set()
+
+
+class StatusReporterTest(StandinTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.client = RemoteApiClient(self.base_url)
+        self.reporter = StatusReporter(self.client, 'w1', linger=0.01, min_backoff=0.01)
+        self.logfile_path = self.path('output.txt')
+        with open(self.logfile_path, 'wb') as f:
+            f.write(b'done')
+
+    async def asyncTearDown(self):
+        await self.reporter.close()
+        await self.client.close()
+        await super().asyncTearDown()
+
+    async def test_bulk(self):
+        self.reporter.start()
+        for instance_id in range(1, 6):
+            self.reporter.report('job1', instance_id, 'RUNNING')
+            self.reporter.report('job1', instance_id, 'COMPLETED', 0)
+        self.assertTrue(await self.reporter.flush(5))
+        self.assertEqual(self.server.bulk_requests, 1)
+        for instance_id in range(1, 6):
+            self.assertEqual(self.server.instances[instance_id]['status'], 'COMPLETED')
+            self.assertEqual(self.server.instances[instance_id]['ret_code'], 0)
+
+    async def test_fallback_without_bulk_endpoint(self):
+        self.server.bulk_status = False
+        self.reporter.start()
+        self.reporter.report('job1', 1, 'RUNNING')
+        self.reporter.report('job1', 2, 'RUNNING')
+        self.assertTrue(await self.reporter.flush(5))
+        self.assertFalse(self.reporter.bulk_supported)
+        self.assertEqual(self.server.instances[2]['status'], 'RUNNING')
+
+    async def test_retry_keeps_log_before_completed(self):
+        calls = []
+        commit_job_log = self.client.commit_job_log
+        async def flaky_commit(*args, **kwargs):
+            calls.append('log')
+            if calls.count('log') == 1:
+                raise aiohttp.ClientConnectionError('server gone')
+            await commit_job_log(*args, **kwargs)
+        update_job_instance = self.client.update_job_instance
+        async def update(*args, **kwargs):
+            calls.append(kwargs['status'])
+            await update_job_instance(*args, **kwargs)
+        self.client.commit_job_log = flaky_commit
+        self.client.update_job_instance = update
+
+        self.reporter.start()
+        self.reporter.commit_log('job1', 1, self.logfile_path)
+        self.reporter.report('job1', 1, 'COMPLETED', 3)
+        self.assertTrue(await self.reporter.flush(5))
+        self.assertEqual(calls, ['log', 'log', 'COMPLETED'])
+        self.assertEqual(self.server.logs[1], b'done')
+        self.assertEqual(self.server.instances[1]['ret_code'], 3)
+        self.assertEqual(self.reporter.counters['retries'], 1)
+
+    async def test_streamed_log_retried(self):
+        streamer = JobLogStreamer(self.client, 'w1', 'job1', 1, self.logfile_path)
+        self.reporter.start()
+        # the tail upload, the fallback full upload and the retries fail
+        self.server.fail_requests = 5
+        self.reporter.commit_log('job1', 1, self.logfile_path, streamer=streamer)
+        self.reporter.report('job1', 1, 'COMPLETED', 0)
+        self.assertTrue(await self.reporter.flush(10))
+        self.assertEqual(self.server.logs[1], b'done')
+        self.assertEqual(self.server.instances[1]['status'], 'COMPLETED')
+        self.assertGreater(self.reporter.counters['retries'], 0)
+        self.assertEqual(self.reporter.counters['dropped'], 0)
+
+    async def test_client_error_dropped(self):
+        async def bad_request(*args, **kwargs):
+            request_info = aiohttp.RequestInfo(URL(self.base_url), 'PUT', CIMultiDictProxy(CIMultiDict()))
+            raise aiohttp.ClientResponseError(request_info, (), status=400)
+        self.client.update_job_instance = bad_request
+        self.reporter.start()
+        self.reporter.report('job1', 1, 'RUNNING')
+        self.assertTrue(await self.reporter.flush(5))
+        self.assertEqual(self.reporter.counters['dropped'], 1)
+
+    async def test_max_pending_drops_oldest(self):
+        reporter = StatusReporter(self.client, 'w1', max_pending=2)
+        for instance_id in range(1, 4):
+            reporter.report('job1', instance_id, 'RUNNING')
+        self.assertEqual(reporter.pending, 2)
+        self.assertEqual(reporter.counters['dropped'], 1)
+
+
+class OutboxReplayTest(StandinTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.outbox_path = self.path('outbox.sqlite3')
+        self.logfile_path = self.path('output.txt')
+        with open(self.logfile_path, 'wb') as f:
+            f.write(b'done')
+
+    async def test_replay_after_restart(self):
+        # server is down while the instances finish
+        async with RemoteApiClient('http://127.0.0.1:1/') as client:
+            outbox = Outbox(self.outbox_path)
+            reporter = StatusReporter(client, 'w1', linger=0, min_backoff=0.01, close_timeout=0.1, outbox=outbox)
+            reporter.start()
+            for instance_id in range(1, 51):
+                reporter.commit_log('job1', instance_id, self.logfile_path)
+                reporter.report('job1', instance_id, 'COMPLETED', 0)
+            await reporter.close()
+            outbox.close()
+
+        # the restarted worker replays them once the server is back
+        async with RemoteApiClient(self.base_url) as client:
+            outbox = Outbox(self.outbox_path)
+            reporter = StatusReporter(client, 'w1', outbox=outbox)
+            self.assertEqual(reporter.pending, 100)
+            reporter.start()
+            self.assertTrue(await reporter.flush(5))
+            await reporter.close()
+            self.assertEqual(outbox.count(), 0)
+            outbox.close()
+
+        for instance_id in range(1, 51):
+            self.assertEqual(self.server.instances[instance_id]['status'], 'COMPLETED')
+            self.assertEqual(self.server.logs[instance_id], b'done')
+        # statuses of all instances went out in one bulk request
+        self.assertEqual(self.server.bulk_requests, 1)
+
+    async def test_logs_kept_until_sent(self):
+        joblogs = JoblogStore(self.path('joblog'), compression='none', max_count=1)
+        paths = []
+        for instance_id in (1, 2):
+            path, stream = joblogs.open(instance_id)
+            stream.write(b'log %d' % instance_id)
+            stream.close()
+            paths.append(path)
+
+        # server is down, cleanup leaves the logs waiting in the reporter
+        async with RemoteApiClient('http://127.0.0.1:1/') as client:
+            outbox = Outbox(self.outbox_path)
+            reporter = StatusReporter(client, 'w1', linger=0, min_backoff=0.01, close_timeout=0.1,
+                                      outbox=outbox, joblogs=joblogs)
+            reporter.start()
+            for instance_id, path in enumerate(paths, 1):
+                reporter.commit_log('job1', instance_id, path)
+            await asyncio.sleep(0.05)
+            self.assertEqual(joblogs.cleanup(), 0)
+            await reporter.close()
+            outbox.close()
+
+        # after restart the logs restored from the outbox are held as well
+        joblogs = JoblogStore(self.path('joblog'), compression='none', max_count=1)
+        async with RemoteApiClient(self.base_url) as client:
+            outbox = Outbox(self.outbox_path)
+            reporter = StatusReporter(client, 'w1', outbox=outbox, joblogs=joblogs)
+            self.assertEqual(joblogs.cleanup(), 0)
+            reporter.start()
+            self.assertTrue(await reporter.flush(5))
+            await reporter.close()
+            outbox.close()
+
+        self.assertEqual(self.server.logs[1], b'log 1')
+        self.assertEqual(self.server.logs[2], b'log 2')
+        # released once sent
+        self.assertEqual(joblogs.cleanup(), 1)
+
+
+class QuickJob:
+    def __init__(self):
+        self.runs = 0
+
+    async def execute_async(self, context):
+        self.runs += 1
+        return 0
+
+
+class EventStreamTest(StandinTestCase):
+    async def start_worker(self, worker_name, job):
+        scheduler = await self.new_scheduler(worker_name, reconnect_min=0.2, reconnect_max=1)
+        await scheduler.add_job(job, 'quick', JobConfig(cls='QuickJob', cron='* * * * *'))
+        scheduler.start()
+        return scheduler
+
+    def completed(self, *instance_ids):
+        return all(self.server.instances.get(i, {}).get('status') == 'COMPLETED' for i in instance_ids)
+
+    async def test_replay_and_dedup(self):
+        job = QuickJob()
+        await self.start_worker('w1', job)
+        self.server.new_job_instance('w1', 'quick', 1)
+        await self.wait_for(lambda: self.completed(1))
+
+        # connection drops, instance 2 is created meanwhile and instance 1 is delivered again
+        await self.server.drop_streams()
+        self.server.new_job_instance('w1', 'quick', 2)
+        self.server.push_event('w1', {'event_type': 'NewJobInstance', 'data': {'id': 1, 'job_name': 'quick'}})
+        await self.wait_for(lambda: self.completed(2))
+        await asyncio.sleep(0.1)
+        self.assertEqual(job.runs, 2)
+        # the reconnect asked for the events after the last one handled
+        self.assertEqual(self.server.stream_connects[-1][1], '1')
+
+    async def test_flapping_stream_backed_off(self):
+        self.server.close_streams = 5
+        scheduler = await self.new_scheduler(reconnect_min=0.05, reconnect_max=1, reconnect_stable=5)
+        await scheduler.add_job(QuickJob(), 'quick', JobConfig(cls='QuickJob', cron='* * * * *'))
+        scheduler.start()
+        await self.wait_for(lambda: len(self.server.stream_connects) == 6)
+        # accepted then dropped right away, the delay kept growing
+        self.assertEqual(scheduler._reconnect_backoff.attempt, 5)
+
+        # an event shows the stream works
+        self.server.new_job_instance('w1', 'quick', 1)
+        await self.wait_for(lambda: self.completed(1))
+        self.assertEqual(scheduler._reconnect_backoff.attempt, 0)
+
+    async def test_reconnect_storm(self):
+        jobs = [QuickJob() for _ in range(20)]
+        for i, job in enumerate(jobs):
+            await self.start_worker(f'w{i}', job)
+        await self.wait_for(lambda: len(self.server.stream_connects) == 20)
+
+        # server restarts, instances are scheduled while it is down
+        port = self.server.port
+        await self.server.stop()
+        for i in range(20):
+            self.server.new_job_instance(f'w{i}', 'quick', 100 + i)
+        restarted_at = asyncio.get_running_loop().time()
+        await asyncio.sleep(0.3)
+        await self.server.start(port=port)
+        await self.wait_for(lambda: self.completed(*range(100, 120)))
+
+        reconnects = [t for _, last_event_id, t in self.server.stream_connects[20:]]
+        self.assertGreaterEqual(len(reconnects), 20)
+        # jittered, workers don't come back at the same instant
+        self.assertGreater(max(reconnects) - min(reconnects), 0.05)
+        self.assertTrue(all(t > restarted_at for t in reconnects))
+        self.assertEqual([job.runs for job in jobs], [1] * 20)
@@ -1,3 +1,5 @@
+import asyncio
+import time
 import unittest
 from contextlib import redirect_stdout
 import io
@@ -37,6 +39,62 @@ class LocalSchedulerTest(unittest.IsolatedAsyncioTestCase):
         target.execute_job("test_job")
 
 
+class AsyncOutputJob:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    async def execute(self, context):
+        await asyncio.sleep(self.delay)
+        print('async output')
+        return 2
+
+
+class AsyncJobTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.config = read_config('tests/conf/schd.yaml')
+        self.scheduler = LocalScheduler(self.config)
+        await self.scheduler.init()
+        self.finished = {}
+        self.scheduler._job_finished = lambda job_name, ret_code, output, duration: self.finished.update(
+            {job_name: (ret_code, output.getvalue())})
+
+    async def asyncTearDown(self):
+        await self.scheduler.close()
+
+    async def run_in_thread(self, job_name):
+        await asyncio.get_running_loop().run_in_executor(None, self.scheduler.execute_job, job_name)
+
+    async def test_awaited_on_loop(self):
+        job_config = JobConfig(cls='AsyncOutputJob', cron='* * * * *')
+        jobs = [(AsyncOutputJob(0.3), f'job{i}', job_config) for i in range(200)]
+        await self.scheduler.add_jobs(jobs)
+        start = time.perf_counter()
+        # the scheduler thread hands the job to the loop and returns
+        for _, job_name, _ in jobs:
+            await self.run_in_thread(job_name)
+        await asyncio.gather(*(asyncio.wrap_future(run) for run in self.scheduler._async_runs.values()))
+        self.assertLess(time.perf_counter() - start, 3)
+        self.assertEqual(len(self.finished), 200)
+        self.assertEqual(self.finished['job7'], (2, 'async output\n'))
+
+    async def test_timeout(self):
+        await self.scheduler.add_job(AsyncOutputJob(10), 'slow', JobConfig(cls='AsyncOutputJob', cron='* * * * *',
+                                                                           timeout=0.1))
+        await self.run_in_thread('slow')
+        # the run still going is not started again
+        await self.run_in_thread('slow')
+        await asyncio.wrap_future(self.scheduler._async_runs['slow'])
+        self.assertEqual(self.finished['slow'], (-1, ''))
+
+    def test_without_loop(self):
+        scheduler = LocalScheduler(self.config)
+        finished = {}
+        scheduler._job_finished = lambda job_name, ret_code, output, duration: finished.update({job_name: ret_code})
+        asyncio.run(scheduler.add_job(AsyncOutputJob(), 'job', JobConfig(cls='AsyncOutputJob', cron='* * * * *')))
+        scheduler.execute_job('job')
+        self.assertEqual(finished, {'job': 2})
+
+
 class JobHasParams:
     def __init__(self, x, y):
         self.x = x
@@ -1,5 +1,5 @@
 import unittest
-from schd.util import ensure_bool
+from schd.util import Backoff, LRUSet, ensure_bool
 
 class EnsureBoolTest(unittest.TestCase):
     def test_ensure_bool(self):
@@ -15,3 +15,25 @@ class EnsureBoolTest(unittest.TestCase):
         self.assertEqual(ensure_bool("no"), False)     # False
         with self.assertRaises(ValueError):
             self.assertEqual(ensure_bool("random")) # Raises ValueError
+
+
+class BackoffTest(unittest.TestCase):
+    def test_grows_to_cap(self):
+        backoff = Backoff(base=1, cap=8)
+        for _ in range(10):
+            self.assertLessEqual(backoff.next_delay(), 8)
+        self.assertEqual(backoff.attempt, 3)
+        backoff.reset()
+        self.assertLessEqual(backoff.next_delay(), 1)
+
+
+class LRUSetTest(unittest.TestCase):
+    def test_evicts_oldest(self):
+        keys = LRUSet(2)
+        self.assertTrue(keys.add(1))
+        self.assertTrue(keys.add(2))
+        self.assertFalse(keys.add(1))
+        keys.add(3)
+        self.assertIn(1, keys)
+        self.assertNotIn(2, keys)
+        self.assertEqual(len(keys), 2)